@@ -22,6 +22,18 @@ git fetch
 git checkout $BRANCH
 git pull
 
+# Appliquer les migrations de la base Supabase (supabase/migrations : table Scans...) avant de démarrer
+# la nouvelle version ; SUPABASE_DB_URL est la chaîne de connexion Postgres du projet
+if [ -n "$SUPABASE_DB_URL" ]; then
+    if ! command -v supabase > /dev/null; then
+        echo "CLI supabase introuvable : impossible d'appliquer les migrations"
+        exit 1
+    fi
+    supabase db push --db-url "$SUPABASE_DB_URL" || exit 1
+else
+    echo "SUPABASE_DB_URL non défini : appliquer à la main les scripts de supabase/migrations (éditeur SQL)"
+fi
+
 # Construire et démarrer les conteneurs
 docker-compose -f $COMPOSE_FILE down
 docker-compose -f $COMPOSE_FILE up -d --build
@@ -1,5 +1,6 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
-from supabase import create_client
+from flask import (Flask, Request, render_template, request, redirect, url_for, session, jsonify, Response, g,
+                   stream_with_context)
+from concurrent.futures import TimeoutError as FutureTimeoutError, as_completed
 from flask_talisman import Talisman
 from datetime import timedelta
 from functools import wraps
@@ -7,34 +8,112 @@ import os
 from dotenv import load_dotenv
 import logging
 from logging.handlers import RotatingFileHandler
-from PIL import Image
 from io import BytesIO
 import base64
+import hashlib
+import json
+import re
 import time
-import torch
+import threading
+import uuid
+import multiprocessing
 from footprint_recognition import initialize_model, footprint_model
+from batching import MicroBatcher
+from supabase_conn import AUTH_TIMEOUT, supabase, get_auth_client, stats as supabase_stats
+from auth_tokens import (AUTH_REFRESH_MARGIN, SessionRefresher, TokenExpired, TokenVerifier, auth_call,
+                         is_rejected, session_tokens)
+from upload_queue import UploadQueue
+from scan_history import create_scan_history
+from image_utils import STORAGE_FORMATS
+from result_cache import ResultCache, create_result_cache
+from session_store import create_session_interface
+from metrics import (CONTENT_TYPE, Gauge, HTTP_IN_FLIGHT, HTTP_REQUEST_SECONDS, PREDICTION_CACHE,
+                     SCAN_ERRORS, SCAN_IN_FLIGHT, SCAN_REQUESTS, SCAN_STAGE_SECONDS, render_metrics, start_export)
 
 load_dotenv()
 
+# Analyse par lots (/api/scan/batch) : nombre maximal de photos et taille maximale de la requête
+SCAN_BATCH_MAX_IMAGES = int(os.getenv('SCAN_BATCH_MAX_IMAGES', '32'))
+SCAN_BATCH_MAX_CONTENT_LENGTH = int(os.getenv('SCAN_BATCH_MAX_MB', '256')) * 1024 * 1024
+
+
+class WildawareRequest(Request):
+    @property
+    def max_content_length(self):
+        # L'analyse par lots reçoit plusieurs photos : limite propre à cette route (connue avant la lecture du corps)
+        if self.endpoint == 'scan_batch':
+            return SCAN_BATCH_MAX_CONTENT_LENGTH
+        return super().max_content_length
+
+
 app = Flask(__name__,
             template_folder='../templates',
             static_folder='../static')
+app.request_class = WildawareRequest
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 Mo
 app.secret_key = os.getenv('FLASK_SECRET_KEY')
 app.config['SESSION_COOKIE_SECURE'] = os.getenv('FLASK_ENV') == 'production'
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=1)
 
+# Sessions côté serveur (SESSION_STORE / SESSION_STORE_URL) : le cookie ne porte qu'un identifiant.
+# Par défaut, session complète dans le cookie signé de Flask
+session_interface = create_session_interface()
+if session_interface is not None:
+    app.session_interface = session_interface
+
 # Initialisation du modèle d'IA - Changé pour un fichier .pth
-MODEL_PATH = os.path.join(os.path.dirname(__file__), 'animal_footprint_model_safe.pth')
-try:
-    initialize_model(MODEL_PATH)
-    app.logger.info('Modèle d\'IA PyTorch chargé avec succès')
-except Exception as e:
-    app.logger.error(f'Erreur lors du chargement du modèle d\'IA: {str(e)}')
+MODEL_PATH = os.getenv('MODEL_PATH', os.path.join(os.path.dirname(__file__), 'animal_footprint_model_safe.pth'))
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '0'))
+INFERENCE_TIMEOUT = float(os.getenv('INFERENCE_TIMEOUT', '30'))
+inference_pool = None
+
+# En dessous de cette probabilité, l'analyse est signalée comme incertaine et les autres espèces proposées
+PREDICTION_MIN_CONFIDENCE = float(os.getenv('PREDICTION_MIN_CONFIDENCE', '0.5'))
+
+# Jetons d'accès Supabase vérifiés localement à chaque requête protégée (voir auth_tokens.py) ;
+# attente maximale, en fin de requête, d'un rafraîchissement lancé en arrière-plan
+token_verifier = TokenVerifier()
+session_refresher = SessionRefresher()
+AUTH_REFRESH_WAIT = float(os.getenv('AUTH_REFRESH_WAIT', '0.5'))
+
+# Pages de l'API d'historique des analyses (/api/history)
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '20'))
+HISTORY_MAX_PAGE_SIZE = 100
+
+# Normalisation des photos avant stockage dans UserImg (faite par les threads d'upload) :
+# plus grand côté borné, JPEG progressif ou WebP sans métadonnées, miniature pour la page de résultat
+USER_IMAGE_NORMALIZE = os.getenv('USER_IMAGE_NORMALIZE', 'true').lower() == 'true'
+USER_IMAGE_FORMAT = os.getenv('USER_IMAGE_FORMAT', 'jpeg').lower()
+USER_IMAGE_MAX_SIDE = int(os.getenv('USER_IMAGE_MAX_SIDE', '1600'))
+USER_IMAGE_QUALITY = int(os.getenv('USER_IMAGE_QUALITY', '85'))
+USER_THUMBNAIL_SIDE = int(os.getenv('USER_THUMBNAIL_SIDE', '600'))
+if USER_IMAGE_FORMAT not in STORAGE_FORMATS:
+    raise ValueError(f"USER_IMAGE_FORMAT invalide: {USER_IMAGE_FORMAT} (attendu : {', '.join(STORAGE_FORMATS)})")
+
+# Les processus d'inférence (spawn) réimportent ce module : ils ne doivent ni charger
+# le modèle, ni démarrer à leur tour un pool, ni traiter la file d'upload
+IS_INFERENCE_WORKER = multiprocessing.parent_process() is not None
+
+# Le modèle n'est pas chargé à l'import : les pages sont servies immédiatement et le modèle
+# est chargé puis échauffé en arrière-plan (voir /ready). En production (gunicorn avec
+# preload_app, voir gunicorn.conf.py), il peut être chargé une seule fois par le processus
+# maître avant le fork, puis partagé par copie sur écriture.
+# Les threads ne survivent pas au fork : ils sont démarrés dans chaque worker par
+# start_background_services(), appelé depuis le hook post_fork.
+DEFER_BACKGROUND_SERVICES = os.getenv('WILDAWARE_DEFER_SERVICES', 'false').lower() == 'true'
+
+_model_lock = threading.Lock()
+_model_loaded = False
+
+# Regroupement des prédictions concurrentes en batchs pour une seule passe avant
+inference_batcher = MicroBatcher(footprint_model.predict_batch, autostart=False)
+
+# Cache des résultats indexé par hash d'image et version du modèle
+prediction_cache = create_result_cache()
 
 if os.getenv('FLASK_ENV') == 'production':
-    Talisman(app,
+    talisman = Talisman(app,
              force_https=True,
              strict_transport_security=True,
              session_cookie_secure=True,
@@ -45,7 +124,7 @@ if os.getenv('FLASK_ENV') == 'production':
                  'img-src': ["'self'", "data:", "blob:", "*"]  # Ajout de "*" pour les images externes
              })
 else:
-    Talisman(app,
+    talisman = Talisman(app,
              force_https=False,
              session_cookie_secure=False,
              content_security_policy={
@@ -55,9 +134,67 @@ else:
                  'img-src': ["'self'", "data:", "blob:", "*"]  # Ajout de "*" pour les images externes
              })
 
-supabase_url = os.getenv('SUPABASE_URL')
-supabase_key = os.getenv('SUPABASE_KEY')
-supabase = create_client(supabase_url, supabase_key)
+# Uploads vers Supabase Storage traités en arrière-plan, persistés sur disque et retentés en cas d'échec
+upload_queue = UploadQueue(supabase, autostart=False)
+
+# Historique des analyses de chaque utilisateur, écrit par lots en arrière-plan
+scan_history = create_scan_history(supabase, autostart=False)
+
+
+def preload_model():
+    """
+    Charger le modèle et précharger le catalogue des espèces, une seule fois par processus
+    (appelé par le maître gunicorn avant le fork, ou par le thread d'échauffement)
+    """
+    global _model_loaded
+    with _model_lock:
+        if _model_loaded:
+            return
+        try:
+            initialize_model(MODEL_PATH, start_refresh=False)
+            app.logger.info('Modèle d\'IA PyTorch chargé avec succès')
+        except Exception as e:
+            app.logger.error(f'Erreur lors du chargement du modèle d\'IA: {str(e)}')
+        _model_loaded = True
+
+
+def _warm_up():
+    """Charger le modèle si besoin, démarrer l'inférence, puis échauffer le modèle (lève footprint_model.ready)."""
+    global inference_pool
+    started = time.perf_counter()
+    preload_model()
+
+    if INFERENCE_WORKERS > 0 and footprint_model.model is not None and inference_pool is None:
+        try:
+            from inference_pool import InferencePool
+            inference_pool = InferencePool(MODEL_PATH, num_workers=INFERENCE_WORKERS)
+            footprint_model.attach_pool(inference_pool)
+            app.logger.info(f'Pool d\'inférence démarré avec {INFERENCE_WORKERS} processus')
+        except Exception as e:
+            app.logger.error(f'Erreur lors du démarrage du pool d\'inférence: {str(e)}')
+
+    inference_batcher.start(workers=INFERENCE_WORKERS if inference_pool else 1)
+    footprint_model.warm_up()
+    app.logger.info(f'Modèle prêt en {time.perf_counter() - started:.1f}s '
+                    f'(version {footprint_model.model_version})')
+
+
+def start_background_services():
+    """
+    Démarrer les threads et processus d'arrière-plan du processus courant :
+    rafraîchissement du catalogue, file d'upload, historique des analyses, écriture des métriques (METRICS_DIR)
+    et, en arrière-plan, chargement et échauffement du modèle, pool d'inférence et file de batching
+    """
+    if IS_INFERENCE_WORKER:
+        return
+
+    start_export()
+    footprint_model.catalog.start_background_refresh()
+    upload_queue.start()
+    scan_history.start()
+    if not footprint_model.ready.is_set():
+        threading.Thread(target=_warm_up, name="model-warmup", daemon=True).start()
+
 
 if not os.path.exists('logs'):
     os.makedirs('logs')
@@ -69,18 +206,143 @@ file_handler.setLevel(logging.INFO)
 app.logger.addHandler(file_handler)
 app.logger.setLevel(logging.INFO)
 app.logger.info('Démarrage de l\'application')
+if not token_verifier.can_verify_locally:
+    app.logger.warning("Ni SUPABASE_JWT_SECRET ni le paquet cryptography : chaque jeton d'accès sera vérifié "
+                       "par Supabase Auth (appel réseau par requête, pages protégées indisponibles sans Auth)")
+
+if not IS_INFERENCE_WORKER and not DEFER_BACKGROUND_SERVICES:
+    start_background_services()
+
+
+# Jauges lues au moment de l'export /metrics
+Gauge('wildaware_model_ready', "1 si le modèle est chargé et échauffé").set_function(
+    lambda: int(footprint_model.ready.is_set()))
+Gauge('wildaware_inference_queue_depth', "Demandes de prédiction en attente d'un batch").set_function(
+    lambda: inference_batcher.stats()['queue_depth'])
+Gauge('wildaware_upload_pending', "Uploads en attente dans la file").set_function(
+    lambda: upload_queue.stats()['pending'])
+Gauge('wildaware_scan_history_pending', "Analyses en attente d'écriture dans l'historique").set_function(
+    lambda: scan_history.stats()['pending'])
+
+
+@app.before_request
+def _start_request_timer():
+    request.metrics_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+
+
+@app.teardown_request
+def _record_request(error=None):
+    started = getattr(request, 'metrics_started', None)
+    if started is None:
+        return
+    HTTP_IN_FLIGHT.dec()
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                 endpoint=request.endpoint or 'unknown', method=request.method,
+                                 status=getattr(request, 'metrics_status', 500 if error else 200))
+
+
+@app.after_request
+def _remember_status(response):
+    request.metrics_status = response.status_code
+    return response
+
+
+def start_user_session(user_id, email, auth_session):
+    """Ouvrir la session d'un utilisateur qui vient de se connecter ou de s'inscrire."""
+    # Sessions côté serveur : nouvel identifiant à chaque connexion (pas de fixation de session)
+    if hasattr(session, 'regenerate'):
+        session.regenerate()
+    session.permanent = True
+    session['user_id'] = user_id
+    session['email'] = email
+    session['auth'] = session_tokens(auth_session)
+
+
+def authenticate_request():
+    """
+    Vérifier le jeton d'accès de la session, localement et sans appel réseau si le secret JWT ou
+    les clés publiques du projet sont disponibles (sinon par Supabase Auth) ; le rafraîchir
+    en arrière-plan s'il expire bientôt, ou avant de répondre s'il a expiré
+
+    Returns:
+        bool: True si l'utilisateur est authentifié
+    """
+    tokens = session.get('auth')
+    if not tokens:
+        # Session ouverte avant la vérification des jetons : nouvelle connexion nécessaire
+        return False
+    try:
+        try:
+            claims = token_verifier.verify(tokens['access_token'])
+        except TokenExpired:
+            tokens = session_refresher.refresh(tokens['refresh_token']).result(timeout=AUTH_TIMEOUT)
+            claims = token_verifier.verify(tokens['access_token'])
+            session['auth'] = tokens
+    except Exception as e:
+        app.logger.warning(f'Authentification refusée pour {session.get("email")}: {str(e) or type(e).__name__}')
+        # Service indisponible : la session est gardée pour une nouvelle tentative
+        if is_rejected(e):
+            session.clear()
+        return False
+
+    if claims['sub'] != session['user_id']:
+        session.clear()
+        return False
+    if claims['exp'] - time.time() < AUTH_REFRESH_MARGIN:
+        # Rafraîchissement pendant le traitement de la requête, repris par _collect_token_refresh
+        g.token_refresh = session_refresher.refresh(tokens['refresh_token'])
+    return True
+
+
+@app.after_request
+def _collect_token_refresh(response):
+    refresh = g.pop('token_refresh', None)
+    if refresh is not None:
+        try:
+            session['auth'] = refresh.result(timeout=AUTH_REFRESH_WAIT)
+        except Exception as e:
+            # Le jeton actuel est encore valide : résultat repris (ou nouvelle tentative) à la requête suivante
+            app.logger.info(f'Rafraîchissement de session non terminé: {str(e) or type(e).__name__}')
+    return response
 
 
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        if 'user_id' not in session or not authenticate_request():
             return redirect(url_for('login'))
         return f(*args, **kwargs)
 
     return decorated_function
 
 
+@app.route('/health')
+@talisman(force_https=False)
+def health():
+    # Vivacité : le serveur répond et sert les pages, que le modèle soit prêt ou non
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/ready')
+@talisman(force_https=False)
+def ready():
+    # Disponibilité : le modèle est chargé et échauffé, les analyses peuvent être servies
+    is_ready = footprint_model.ready.is_set()
+    return jsonify({
+        'ready': is_ready,
+        'model_version': footprint_model.model_version,
+        'catalog_loaded': footprint_model.catalog.is_loaded
+    }), 200 if is_ready else 503
+
+
+@app.route('/metrics')
+@talisman(force_https=False)
+def metrics():
+    # Métriques Prometheus : agrégat de tous les workers gunicorn si METRICS_DIR est défini, sinon ce processus
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
+
 @app.route('/')
 def index():
     return render_template('accueil.html')
@@ -104,14 +366,12 @@ def login():
             if not '@' in email:
                 raise ValueError("Format d'email invalide")
 
-            response = supabase.auth.sign_in_with_password({
+            response = auth_call('sign_in', lambda: get_auth_client().sign_in_with_password({
                 "email": email,
                 "password": password
-            })
+            }), retries=None)
 
-            session.permanent = True
-            session['user_id'] = response.user.id
-            session['email'] = email
+            start_user_session(response.user.id, email, response.session)
             app.logger.info(f'Connexion réussie pour l\'utilisateur: {email}')
 
             return redirect(url_for('scan'))
@@ -147,14 +407,18 @@ def inscription():
             if password != confirm_password:
                 raise ValueError("Les mots de passe ne correspondent pas")
 
-            response = supabase.auth.sign_up({
+            response = auth_call('sign_up', lambda: get_auth_client().sign_up({
                 "email": email,
                 "password": password
-            })
+            }))
+
+            if response.session is None:
+                # Confirmation de l'adresse email exigée par le projet : pas encore de session
+                app.logger.info(f'Inscription en attente de confirmation pour l\'utilisateur: {email}')
+                return render_template('connexion.html',
+                                       error="Compte créé : confirmez votre adresse email puis connectez-vous")
 
-            session.permanent = True
-            session['user_id'] = response.user.id
-            session['email'] = email
+            start_user_session(response.user.id, email, response.session)
             app.logger.info(f'Inscription réussie pour l\'utilisateur: {email}')
 
             return redirect(url_for('scan'))
@@ -181,83 +445,349 @@ def scan():
         return redirect(url_for('login'))
 
 
+def scan_storage(filename):
+    """
+    Emplacement dans UserImg (dossier de l'utilisateur connecté) d'une photo analysée
+
+    Args:
+        filename (str): Nom du fichier
+
+    Returns:
+        tuple: (chemin de l'image, chemin de la miniature ou None, options de normalisation ou None)
+    """
+    user_email = session.get('email').replace('@', '_at_')  # Création d'un nom de dossier sécurisé
+    user_path = f"{user_email}/{filename}"
+    thumbnail_path = f"{user_email}/thumbnails/{filename}" if USER_IMAGE_NORMALIZE and USER_THUMBNAIL_SIDE else None
+    normalize = None
+    if USER_IMAGE_NORMALIZE:
+        normalize = {"max_side": USER_IMAGE_MAX_SIDE, "image_format": USER_IMAGE_FORMAT,
+                     "quality": USER_IMAGE_QUALITY, "thumbnail_side": USER_THUMBNAIL_SIDE,
+                     "thumbnail_path": thumbnail_path}
+    return user_path, thumbnail_path, normalize
+
+
+def alternatives(result):
+    """Autres espèces proposées : nom et probabilité en pourcentage seulement."""
+    return [{'animal': candidate['animal'], 'confidence': candidate['confidence'] * 100}
+            for candidate in result.get('predictions', [])[1:footprint_model.top_k]]
+
+
 @app.route('/upload-image', methods=['POST'])
 @login_required
 def upload_image():
+    started = time.perf_counter()
+    SCAN_IN_FLIGHT.inc()
     try:
         app.logger.info("Début de l'upload")
 
         # Vérifier si un fichier a été envoyé
         if 'image' not in request.files:
             app.logger.error("Pas d'image dans la requête")
+            SCAN_REQUESTS.inc(outcome='invalid')
             return jsonify({'success': False, 'error': 'Pas d\'image reçue'})
 
         uploaded_file = request.files['image']
         if not uploaded_file:
             app.logger.error("Fichier vide")
+            SCAN_REQUESTS.inc(outcome='invalid')
             return jsonify({'success': False, 'error': 'Fichier vide'})
 
-        # Lire les données du fichier
-        image_bytes = uploaded_file.read()
-
-        # Génération du nom de fichier
+        # Génération du nom de fichier : le suffixe aléatoire distingue deux analyses de la même seconde
         timestamp = int(time.time())
-        filename = f"scan_{session['user_id']}_{timestamp}.jpg"
-        user_email = session.get('email').replace('@', '_at_')  # Création d'un nom de dossier sécurisé
+        extension, content_type = STORAGE_FORMATS[USER_IMAGE_FORMAT] if USER_IMAGE_NORMALIZE else ('.jpg', 'image/jpeg')
+        filename = f"scan_{session['user_id']}_{timestamp}_{uuid.uuid4().hex[:8]}{extension}"
+        user_path, thumbnail_path, normalize = scan_storage(filename)
+        user_email = session.get('email').replace('@', '_at_')
+        upload_job = None
+        submitted = False
 
         try:
-            # Upload uniquement dans UserImg avec dossier utilisateur
-            app.logger.info(f"Upload vers UserImg/{user_email}")
-            user_path = f"{user_email}/{filename}"
-
-            response_user = supabase.storage \
-                .from_('UserImg') \
-                .upload(
-                path=user_path,
-                file=image_bytes,
-                file_options={"content-type": "image/jpeg"}
-            )
-
-            if hasattr(response_user, 'error') and response_user.error is not None:
-                raise Exception(f"Erreur UserImg: {response_user.error}")
-
-            # Obtenir l'URL publique de l'image
+            # Une seule lecture du fichier reçu (mis en fichier temporaire par Werkzeug au-delà de 500 Ko) :
+            # chaque bloc est haché et écrit dans le spool de la file d'upload, sans copie complète en mémoire
+            digest = hashlib.md5()
+            with SCAN_STAGE_SECONDS.time(stage='read'):
+                upload_job = upload_queue.stage('UserImg', user_path, uploaded_file.stream, content_type=content_type,
+                                                on_chunk=digest.update, normalize=normalize)
+
+            # Une image déjà analysée par la même version du modèle est servie depuis le cache ;
+            # sinon l'analyse est lancée tout de suite et s'exécute pendant la mise en file de l'upload
+            with SCAN_STAGE_SECONDS.time(stage='cache_lookup'):
+                cache_key = ResultCache.key_for_digest(digest.hexdigest(), footprint_model.model_version)
+                result = prediction_cache.get(cache_key)
+            PREDICTION_CACHE.inc(result='miss' if result is None else 'hit')
+            if result is None and not footprint_model.ready.is_set():
+                app.logger.warning("Analyse demandée avant la fin du chargement du modèle")
+                upload_queue.cancel(upload_job)
+                SCAN_REQUESTS.inc(outcome='not_ready')
+                return jsonify({'success': False,
+                                'error': 'Le modèle est en cours de chargement, réessayez dans quelques instants'}), 503
+            prediction = None
+            if result is None:
+                # Le modèle décode directement le fichier reçu, qui reste ouvert jusqu'à la fin de la requête
+                uploaded_file.stream.seek(0)
+                prediction = inference_batcher.submit(uploaded_file.stream)
+
+            # Obtenir l'URL publique de l'image et de sa miniature (calculées localement, sans attendre l'upload)
             image_url = supabase.storage.from_('UserImg').get_public_url(user_path)
+            thumbnail_url = supabase.storage.from_('UserImg').get_public_url(thumbnail_path) if thumbnail_path else None
 
             # Analyse de l'image avec l'IA
             try:
                 app.logger.info("Analyse de l'image avec l'IA")
 
+                # Attendre le résultat du modèle d'IA
+                if result is None:
+                    with SCAN_STAGE_SECONDS.time(stage='prediction_wait'):
+                        result = prediction.result(timeout=INFERENCE_TIMEOUT)
+                    if 'error' in result:
+                        # Image illisible : ni mise en cache, ni upload, ni historique
+                        app.logger.warning(f"Analyse impossible: {result['error']}")
+                        upload_queue.cancel(upload_job)
+                        SCAN_REQUESTS.inc(outcome='error')
+                        return jsonify({'success': False, 'error': result['error']})
+                    prediction_cache.set(cache_key, result)
+                else:
+                    app.logger.info("Résultat servi depuis le cache de prédictions")
+
+                # Upload uniquement dans UserImg avec dossier utilisateur, en arrière-plan avec reprises ;
+                # confié seulement une fois l'analyse réussie, pour pouvoir l'abandonner sinon
+                app.logger.info(f"Upload vers UserImg/{user_email}")
+                with SCAN_STAGE_SECONDS.time(stage='storage_enqueue'):
+                    upload_queue.submit(upload_job)
+                submitted = True
+
                 # Au lieu de stocker l'image complète en session, stockons seulement l'URL
                 session['image_url'] = image_url  # Nouvelle ligne
+                session['thumbnail_url'] = thumbnail_url
 
-                # Analyser l'image avec le modèle d'IA
-                result = footprint_model.predict(image_bytes)
-
-                # Stocker les résultats en session (mais pas l'image complète)
+                # Stocker les résultats en session (mais pas l'image complète) ; les autres espèces
+                # proposées ne gardent que leur nom et leur probabilité, pour limiter la taille du cookie
                 session['analysis_result'] = {
                     'animal': result['animal'],
                     'confidence': result['confidence'] * 100,  # Convertir en pourcentage
                     'card_url': result['card_url'],
-                    'fun_fact': result['fun_fact']
+                    'fun_fact': result['fun_fact'],
+                    'low_confidence': result['confidence'] < PREDICTION_MIN_CONFIDENCE,
+                    'alternatives': alternatives(result)
                 }
 
                 app.logger.info(f"Animal identifié: {result['animal']} avec une confiance de {result['confidence']}")
+                scan_history.record(session['user_id'], user_path, result['animal'], result['confidence'],
+                                    model_version=footprint_model.model_version, thumbnail_path=thumbnail_path)
+                SCAN_REQUESTS.inc(outcome='low_confidence' if session['analysis_result']['low_confidence'] else 'success')
 
                 # Rediriger vers la page de résultats
                 return jsonify({'success': True, 'redirect': url_for('scan_result')})
 
             except Exception as e:
                 app.logger.error(f"Erreur lors de l'analyse de l'image: {str(e)}")
+                if not submitted:
+                    upload_queue.cancel(upload_job)
+                SCAN_ERRORS.inc(stage='prediction_wait')
+                SCAN_REQUESTS.inc(outcome='error')
                 return jsonify({'success': False, 'error': f"Erreur lors de l'analyse: {str(e)}"})
 
         except Exception as e:
             app.logger.error(f'Erreur lors de l\'upload Supabase : {str(e)}')
+            if upload_job is not None and not submitted:
+                upload_queue.cancel(upload_job)
+            SCAN_ERRORS.inc(stage='storage_enqueue')
+            SCAN_REQUESTS.inc(outcome='error')
             return jsonify({'success': False, 'error': str(e)})
 
     except Exception as e:
         app.logger.error(f'Erreur générale : {str(e)}')
+        SCAN_ERRORS.inc(stage='read')
+        SCAN_REQUESTS.inc(outcome='error')
         return jsonify({'success': False, 'error': str(e)})
+    finally:
+        SCAN_IN_FLIGHT.dec()
+        SCAN_STAGE_SECONDS.observe(time.perf_counter() - started, stage='total')
+
+@app.route('/api/scan/batch', methods=['POST'])
+@login_required
+def scan_batch():
+    """
+    Analyser plusieurs photos reçues dans une seule requête multipart (champ `images` répété).
+
+    Les photos sont lues une fois (hash et spool d'upload) et confiées ensemble à la file de
+    batching (passes avant de INFERENCE_MAX_BATCH_SIZE images) ; chacune n'est confiée à la
+    file d'upload qu'une fois analysée avec succès, et abandonnée sinon. La réponse est en NDJSON : une ligne par photo dès que son résultat est
+    prêt (champ `index` : rang dans la requête), puis une ligne de synthèse.
+    """
+    started = time.perf_counter()
+    files = request.files.getlist('images')
+    if not files:
+        return jsonify({'success': False, 'error': 'Pas d\'image reçue (champ images)'}), 400
+    if len(files) > SCAN_BATCH_MAX_IMAGES:
+        return jsonify({'success': False,
+                        'error': f'Trop d\'images : {SCAN_BATCH_MAX_IMAGES} au plus par requête'}), 413
+
+    user_id = session['user_id']
+    model_version = footprint_model.model_version
+    # Préfixe commun aux photos du lot, unique même pour deux lots envoyés dans la même seconde
+    prefix = f"scan_{user_id}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+    extension, content_type = STORAGE_FORMATS[USER_IMAGE_FORMAT] if USER_IMAGE_NORMALIZE else ('.jpg', 'image/jpeg')
+    scans = []
+    try:
+        for index, uploaded_file in enumerate(files):
+            scan = {'index': index, 'filename': uploaded_file.filename, 'stream': uploaded_file.stream}
+            scans.append(scan)
+            if not uploaded_file.filename:
+                scan['error'] = 'Fichier vide'
+                continue
+            scan['path'], scan['thumbnail_path'], normalize = scan_storage(
+                f"{prefix}_{index}{extension}")
+            digest = hashlib.md5()
+            with SCAN_STAGE_SECONDS.time(stage='read'):
+                scan['upload'] = upload_queue.stage('UserImg', scan['path'], uploaded_file.stream,
+                                                    content_type=content_type, on_chunk=digest.update,
+                                                    normalize=normalize)
+            scan['cache_key'] = ResultCache.key_for_digest(digest.hexdigest(), model_version)
+            scan['result'] = prediction_cache.get(scan['cache_key'])
+            PREDICTION_CACHE.inc(result='miss' if scan['result'] is None else 'hit')
+    except Exception as e:
+        app.logger.error(f'Erreur lors de la lecture du lot : {str(e)}')
+        for scan in scans:
+            if 'upload' in scan:
+                upload_queue.cancel(scan['upload'])
+        SCAN_ERRORS.inc(stage='read')
+        SCAN_REQUESTS.inc(len(scans), outcome='error')
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    misses = [scan for scan in scans if 'upload' in scan and scan['result'] is None]
+    if misses and not footprint_model.ready.is_set():
+        for scan in scans:
+            if 'upload' in scan:
+                upload_queue.cancel(scan['upload'])
+        SCAN_REQUESTS.inc(len(scans), outcome='not_ready')
+        return jsonify({'success': False,
+                        'error': 'Le modèle est en cours de chargement, réessayez dans quelques instants'}), 503
+
+    # Toutes les photos sont mises en file ensemble : la file de batching les regroupe en passes avant
+    predictions = {}
+    for scan in misses:
+        scan['stream'].seek(0)
+        predictions[inference_batcher.submit(scan['stream'])] = scan
+    app.logger.info(f"Analyse par lots de {len(scans)} image(s) ({len(misses)} à inférer)")
+
+    bucket = supabase.storage.from_('UserImg')
+
+    def _line(scan, result=None, error=None):
+        """Ligne NDJSON du résultat d'une photo, et succès de son analyse ; confie ou abandonne son upload."""
+        error = error or scan.get('error') or (result or {}).get('error')
+        if error is not None:
+            if 'upload' in scan:
+                # Photo illisible ou non analysée : ni upload, ni historique
+                upload_queue.cancel(scan.pop('upload'))
+                SCAN_REQUESTS.inc(outcome='error')
+            else:
+                SCAN_REQUESTS.inc(outcome='invalid')
+            return json.dumps({'index': scan['index'], 'filename': scan['filename'], 'success': False,
+                               'error': error}, ensure_ascii=False) + '\n', False
+        with SCAN_STAGE_SECONDS.time(stage='storage_enqueue'):
+            upload_queue.submit(scan.pop('upload'))
+        low_confidence = result['confidence'] < PREDICTION_MIN_CONFIDENCE
+        SCAN_REQUESTS.inc(outcome='low_confidence' if low_confidence else 'success')
+        record = scan_history.record(user_id, scan['path'], result['animal'], result['confidence'],
+                                     model_version=model_version, thumbnail_path=scan['thumbnail_path'])
+        return json.dumps({
+            'index': scan['index'], 'filename': scan['filename'], 'success': True, 'scan_id': record['id'],
+            'animal': result['animal'], 'confidence': result['confidence'] * 100,
+            'low_confidence': low_confidence, 'alternatives': alternatives(result),
+            'card_url': result['card_url'], 'fun_fact': result['fun_fact'],
+            'image_url': bucket.get_public_url(scan['path']),
+            'thumbnail_url': bucket.get_public_url(scan['thumbnail_path']) if scan['thumbnail_path'] else None,
+        }, ensure_ascii=False) + '\n', True
+
+    def _results():
+        # Photos invalides et résultats en cache d'abord, puis chaque photo dès que sa passe avant est terminée
+        for scan in scans:
+            if scan not in misses:
+                yield _line(scan, scan.get('result'))
+        try:
+            for prediction in as_completed(predictions, timeout=INFERENCE_TIMEOUT):
+                scan = predictions.pop(prediction)
+                try:
+                    result = prediction.result()
+                except Exception as e:
+                    SCAN_ERRORS.inc(stage='prediction_wait')
+                    yield _line(scan, error=f"Erreur lors de l'analyse: {str(e)}")
+                    continue
+                # Photo illisible : ni mise en cache ni enregistrée dans l'historique
+                if 'error' not in result:
+                    prediction_cache.set(scan['cache_key'], result)
+                yield _line(scan, result)
+        except FutureTimeoutError:
+            for scan in predictions.values():
+                SCAN_ERRORS.inc(stage='prediction_wait')
+                yield _line(scan, error="Délai d'analyse dépassé")
+
+    def _stream():
+        SCAN_IN_FLIGHT.inc(len(scans))
+        succeeded = 0
+        try:
+            for line, success in _results():
+                succeeded += success
+                yield line
+            yield json.dumps({'done': True, 'count': len(scans), 'succeeded': succeeded,
+                              'failed': len(scans) - succeeded}) + '\n'
+        finally:
+            # Aussi exécuté si le client se déconnecte avant la fin du flux : les photos dont le résultat
+            # n'a pas été envoyé ne sont pas enregistrées, leurs uploads sont abandonnés
+            for scan in scans:
+                if 'upload' in scan:
+                    upload_queue.cancel(scan.pop('upload'))
+            SCAN_IN_FLIGHT.dec(len(scans))
+            SCAN_STAGE_SECONDS.observe(time.perf_counter() - started, stage='batch_total')
+
+    # Pas de mise en tampon par nginx : chaque ligne part dès qu'elle est écrite
+    return Response(stream_with_context(_stream()), mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-store'})
+
+
+@app.route('/inference/stats')
+@talisman(force_https=False)
+def inference_stats():
+    # Diagnostic interne, comme /metrics : refusé par nginx, consulté directement sur wildaware-app:5000
+    stats = inference_batcher.stats()
+    if inference_pool is not None:
+        stats['pool'] = inference_pool.stats()
+    stats['uploads'] = upload_queue.stats()
+    stats['cache'] = prediction_cache.stats()
+    stats['history'] = scan_history.stats()
+    stats['supabase'] = supabase_stats()
+    stats['auth'] = token_verifier.stats()
+    if session_interface is not None:
+        stats['sessions'] = session_interface.stats()
+    return jsonify(stats)
+
+
+@app.route('/api/history')
+@login_required
+def history():
+    # Analyses de l'utilisateur, de la plus récente à la plus ancienne : ?limit=20&cursor=<next_cursor>
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Paramètre limit invalide'}), 400
+    cursor = request.args.get('cursor') or None
+    if cursor is not None and not re.fullmatch(r'[0-9a-f]{32}', cursor):
+        return jsonify({'success': False, 'error': 'Paramètre cursor invalide'}), 400
+
+    try:
+        page = scan_history.page(session['user_id'], limit=limit, cursor=cursor)
+    except Exception as e:
+        app.logger.error(f'Erreur lors de la lecture de l\'historique: {str(e)}')
+        return jsonify({'success': False, 'error': 'Historique indisponible'}), 503
+
+    # URLs publiques calculées localement, sans appel à Supabase
+    bucket = supabase.storage.from_('UserImg')
+    for item in page['items']:
+        item['image_url'] = bucket.get_public_url(item['image_path'])
+        item['thumbnail_url'] = bucket.get_public_url(item['thumbnail_path']) if item['thumbnail_path'] else None
+    return jsonify({'success': True, **page})
+
 
 # Modifiez également la route scan_result pour utiliser l'URL de l'image au lieu de l'image en base64
 @app.route('/scan_result')
@@ -275,10 +805,13 @@ def scan_result():
         return render_template('scan_result.html',
                                email=email,
                                image_url=image_url,  # Passez l'URL au template
+                               thumbnail_url=session.get('thumbnail_url'),
                                animal=result['animal'],
                                confidence=result['confidence'],
                                card_url=result['card_url'],
-                               fun_fact=result['fun_fact'])
+                               fun_fact=result['fun_fact'],
+                               low_confidence=result.get('low_confidence', False),
+                               alternatives=result.get('alternatives', []))
 
     except Exception as e:
         app.logger.error(f'Erreur lors de l\'affichage des résultats: {str(e)}')
@@ -290,7 +823,9 @@ def logout():
     try:
         if 'user_id' in session:
             email = session.get('email', 'Utilisateur inconnu')
-            supabase.auth.sign_out()
+            # Révocation des refresh tokens de l'utilisateur, sans attendre Supabase Auth
+            if session.get('auth'):
+                session_refresher.revoke(session['auth']['access_token'])
             app.logger.info(f'Déconnexion réussie pour l\'utilisateur: {email}')
     except Exception as e:
         app.logger.error(f'Erreur lors de la déconnexion: {str(e)}')
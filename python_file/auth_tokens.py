@@ -0,0 +1,404 @@
+"""
+Authentification des requêtes par les jetons d'accès Supabase, sans appel réseau.
+
+Le jeton d'accès (JWT) obtenu à la connexion est gardé en session et vérifié localement
+à chaque requête protégée : signature, expiration, audience et utilisateur. La signature
+est vérifiée avec le secret JWT du projet (HS256, SUPABASE_JWT_SECRET) ou avec ses clés
+publiques (RS256 / ES256, JWKS mis en cache ; nécessite le paquet cryptography). Sans clé
+locale, le jeton est vérifié par Supabase Auth et le résultat mis en cache une minute.
+
+Un jeton proche de l'expiration est rafraîchi en arrière-plan, pendant le traitement de la
+requête. Un refresh token n'est utilisable qu'une fois : les requêtes simultanées d'une
+même session partagent le même rafraîchissement.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import AUTH_OPERATIONS, AUTH_SECONDS, AUTH_VERIFICATIONS
+from result_cache import LocalCacheBackend
+from supabase_conn import AUTH_TIMEOUT, call, get_auth_client
+
+# Tolérance sur l'expiration (horloges décalées), en secondes
+AUTH_CLOCK_LEEWAY = float(os.getenv('AUTH_CLOCK_LEEWAY', '30'))
+# Un jeton qui expire dans moins de AUTH_REFRESH_MARGIN secondes est rafraîchi en arrière-plan
+AUTH_REFRESH_MARGIN = float(os.getenv('AUTH_REFRESH_MARGIN', '300'))
+# Durée de validité du cache des clés publiques du projet (JWKS)
+AUTH_JWKS_TTL = float(os.getenv('AUTH_JWKS_TTL', '600'))
+# Délai minimal entre deux rechargements des clés pour un identifiant de clé inconnu
+JWKS_MIN_RELOAD_INTERVAL = 30
+
+
+class InvalidToken(Exception):
+    """Jeton d'accès refusé : mal formé, signature ou audience invalide."""
+
+
+class TokenExpired(InvalidToken):
+    """Jeton d'accès expiré : la session peut être rafraîchie."""
+
+
+def _b64decode(segment):
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+
+def is_rejected(error):
+    """Jeton ou refresh token refusé (et non service indisponible) : la session est à fermer."""
+    return isinstance(error, InvalidToken) or getattr(error, 'status', None) in (400, 401, 403)
+
+
+def auth_call(operation, fn, retries=0):
+    """
+    Appeler Supabase Auth, avec mesure de la durée et du résultat (voir supabase_conn.call)
+
+    Args:
+        operation (str): sign_in, sign_up, refresh, sign_out, get_user, jwks
+        fn (callable): Appel à exécuter, sans argument
+        retries (int, optional): Nouvelles tentatives sur erreur transitoire (None : SUPABASE_RETRIES)
+
+    Returns:
+        Le résultat de fn()
+    """
+    started = time.perf_counter()
+    try:
+        result = call(f'auth.{operation}', fn, retries=retries)
+    except Exception:
+        AUTH_OPERATIONS.inc(operation=operation, result='failure')
+        raise
+    finally:
+        AUTH_SECONDS.observe(time.perf_counter() - started, operation=operation)
+    AUTH_OPERATIONS.inc(operation=operation, result='success')
+    return result
+
+
+def session_tokens(auth_session):
+    """
+    Jetons d'une session Supabase, à garder dans la session Flask
+
+    Returns:
+        dict: {"access_token", "refresh_token", "expires_at"}
+    """
+    expires_at = auth_session.expires_at or int(time.time()) + (auth_session.expires_in or 0)
+    return {"access_token": auth_session.access_token, "refresh_token": auth_session.refresh_token,
+            "expires_at": expires_at}
+
+
+class TokenVerifier:
+    """Vérification locale des jetons d'accès Supabase."""
+
+    def __init__(self, jwt_secret=None, supabase_url=None, api_key=None, audience="authenticated",
+                 leeway=None, jwks_ttl=None):
+        """
+        Args:
+            jwt_secret (str, optional): Secret JWT du projet (SUPABASE_JWT_SECRET), pour les jetons HS256
+            supabase_url (str, optional): URL du projet, pour les clés publiques (SUPABASE_URL)
+            api_key (str, optional): Clé API du projet (SUPABASE_KEY)
+            audience (str): Audience attendue des jetons des utilisateurs connectés
+            leeway (float, optional): Tolérance sur l'expiration, en secondes (AUTH_CLOCK_LEEWAY)
+            jwks_ttl (float, optional): Durée de validité du cache des clés publiques (AUTH_JWKS_TTL)
+        """
+        self.jwt_secret = jwt_secret if jwt_secret is not None else os.getenv('SUPABASE_JWT_SECRET')
+        self.supabase_url = supabase_url or os.getenv('SUPABASE_URL')
+        self.api_key = api_key or os.getenv('SUPABASE_KEY')
+        self.audience = audience
+        self.leeway = leeway if leeway is not None else AUTH_CLOCK_LEEWAY
+        self.jwks_ttl = jwks_ttl if jwks_ttl is not None else AUTH_JWKS_TTL
+
+        self._keys = {}
+        self._keys_loaded_at = 0.0
+        self._keys_attempted_at = float('-inf')
+        self._keys_lock = threading.Lock()
+        self._keys_refreshing = False
+        self._remote = LocalCacheBackend(max_entries=10000, ttl=60)
+
+    def verify(self, token):
+        """
+        Vérifier un jeton d'accès
+
+        Args:
+            token (str): JWT reçu de Supabase Auth
+
+        Returns:
+            dict: Contenu du jeton (sub, email, exp...)
+
+        Raises:
+            TokenExpired: Si le jeton a expiré
+            InvalidToken: Si le jeton est refusé
+        """
+        started = time.perf_counter()
+        method, result = 'local', 'valid'
+        try:
+            try:
+                header_segment, payload_segment, signature_segment = token.split('.')
+                header = json.loads(_b64decode(header_segment))
+                claims = json.loads(_b64decode(payload_segment))
+                signature = _b64decode(signature_segment)
+            except (AttributeError, TypeError, ValueError) as e:
+                raise InvalidToken(f"Jeton mal formé: {e}") from None
+
+            method = self._verify_signature(header, f"{header_segment}.{payload_segment}".encode('ascii'),
+                                            signature)
+            self._check_claims(claims)
+            if method == 'remote':
+                self._verify_remote(token)
+            return claims
+        except TokenExpired:
+            result = 'expired'
+            raise
+        except InvalidToken:
+            result = 'invalid'
+            raise
+        except Exception:
+            result = 'error'
+            raise
+        finally:
+            AUTH_VERIFICATIONS.inc(method=method, result=result)
+            AUTH_SECONDS.observe(time.perf_counter() - started, operation='verify')
+
+    def _verify_signature(self, header, signing_input, signature):
+        """Vérifier la signature avec une clé locale ; 'remote' si aucune clé n'est disponible."""
+        alg = header.get('alg')
+        if alg == 'HS256':
+            if not self.jwt_secret:
+                return 'remote'
+            expected = hmac.new(self.jwt_secret.encode('utf-8'), signing_input, hashlib.sha256).digest()
+            if not hmac.compare_digest(expected, signature):
+                raise InvalidToken("Signature invalide")
+            return 'hs256'
+        if alg not in ('RS256', 'ES256'):
+            raise InvalidToken(f"Algorithme non supporté: {alg}")
+
+        key = self._public_key(header.get('kid'), alg)
+        if key is None:
+            return 'remote'
+        self._verify_asymmetric(key, alg, signing_input, signature)
+        return 'jwks'
+
+    def _check_claims(self, claims):
+        exp = claims.get('exp')
+        if not isinstance(exp, (int, float)):
+            raise InvalidToken("Expiration absente")
+        if exp + self.leeway < time.time():
+            raise TokenExpired("Jeton expiré")
+        audience = claims.get('aud')
+        if self.audience not in (audience if isinstance(audience, list) else [audience]):
+            raise InvalidToken(f"Audience invalide: {audience}")
+        if not claims.get('sub'):
+            raise InvalidToken("Utilisateur absent")
+
+    @staticmethod
+    def _verify_asymmetric(key, alg, signing_input, signature):
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import ec, padding
+        from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+
+        key_alg, public_key = key
+        if key_alg != alg:
+            raise InvalidToken(f"Clé {key_alg} utilisée pour un jeton {alg}")
+        try:
+            if alg == 'RS256':
+                public_key.verify(signature, signing_input, padding.PKCS1v15(), hashes.SHA256())
+            else:
+                # Signature JWS ES256 : r et s concaténés (32 octets chacun), à convertir en DER
+                if len(signature) != 64:
+                    raise InvalidToken("Signature invalide")
+                der = encode_dss_signature(int.from_bytes(signature[:32], 'big'),
+                                           int.from_bytes(signature[32:], 'big'))
+                public_key.verify(der, signing_input, ec.ECDSA(hashes.SHA256()))
+        except InvalidSignature:
+            raise InvalidToken("Signature invalide") from None
+
+    @staticmethod
+    def _parse_jwk(jwk):
+        from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+        def _int(value):
+            return int.from_bytes(_b64decode(value), 'big')
+
+        if jwk.get('kty') == 'RSA':
+            return 'RS256', rsa.RSAPublicNumbers(_int(jwk['e']), _int(jwk['n'])).public_key()
+        if jwk.get('kty') == 'EC' and jwk.get('crv') == 'P-256':
+            return 'ES256', ec.EllipticCurvePublicNumbers(_int(jwk['x']), _int(jwk['y']),
+                                                          ec.SECP256R1()).public_key()
+        return None
+
+    def _load_keys(self):
+        """Télécharger les clés publiques du projet (JWKS) ; les anciennes sont gardées en cas d'échec."""
+        import httpx
+
+        self._keys_attempted_at = time.monotonic()
+        try:
+            response = auth_call('jwks', lambda: httpx.get(
+                f"{self.supabase_url}/auth/v1/.well-known/jwks.json",
+                headers={"apikey": self.api_key or ''}, timeout=AUTH_TIMEOUT))
+            response.raise_for_status()
+            keys = {}
+            for jwk in response.json().get('keys', []):
+                parsed = self._parse_jwk(jwk)
+                if parsed is not None:
+                    keys[jwk.get('kid')] = parsed
+        except Exception as e:
+            print(f"Clés publiques Supabase indisponibles: {e}")
+            return
+        self._keys = keys
+        self._keys_loaded_at = time.monotonic()
+
+    def _reload_keys_in_background(self):
+        with self._keys_lock:
+            if self._keys_refreshing:
+                return
+            self._keys_refreshing = True
+
+        def _reload():
+            try:
+                with self._keys_lock:
+                    self._load_keys()
+            finally:
+                self._keys_refreshing = False
+
+        threading.Thread(target=_reload, name="jwks-refresh", daemon=True).start()
+
+    def _public_key(self, kid, alg):
+        """
+        Clé publique `kid` du projet, depuis le cache
+
+        Returns:
+            tuple | None: (alg, clé), ou None sans clé locale possible (paquet cryptography absent,
+                clés indisponibles, clé inconnue alors que le rechargement est limité) : le jeton est
+                alors vérifié par Supabase Auth
+
+        Raises:
+            InvalidToken: Clé absente des clés publiques qui viennent d'être rechargées
+        """
+        try:
+            import cryptography  # noqa: F401
+        except ImportError:
+            return None
+
+        key = self._keys.get(kid)
+        if key is not None:
+            # Clé connue : le cache périmé est rechargé en arrière-plan, sans attendre
+            if time.monotonic() - self._keys_loaded_at > self.jwks_ttl:
+                self._reload_keys_in_background()
+            return key
+
+        # Clé inconnue (premier jeton, rotation des clés du projet) : rechargement immédiat, limité
+        reloaded = False
+        with self._keys_lock:
+            if kid not in self._keys and time.monotonic() - self._keys_attempted_at > JWKS_MIN_RELOAD_INTERVAL:
+                self._load_keys()
+                reloaded = self._keys_loaded_at >= self._keys_attempted_at
+        key = self._keys.get(kid)
+        if key is None and reloaded and self._keys:
+            raise InvalidToken(f"Clé de signature inconnue: {kid}")
+        # Rechargement limité ou en échec : une clé tout juste publiée ne doit pas fermer la session
+        return key
+
+    def _verify_remote(self, token):
+        """Faire vérifier le jeton par Supabase Auth (résultat mis en cache une minute)."""
+        digest = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        if self._remote.get(digest):
+            return
+        try:
+            response = auth_call('get_user', lambda: get_auth_client().get_user(token))
+        except Exception as e:
+            if is_rejected(e):
+                raise InvalidToken(f"Jeton refusé par Supabase Auth: {e}") from None
+            raise
+        if response is None or response.user is None:
+            raise InvalidToken("Jeton refusé par Supabase Auth")
+        self._remote.set(digest, True)
+
+    @property
+    def can_verify_locally(self):
+        """Vrai si les jetons peuvent être vérifiés sans Supabase Auth (secret JWT ou paquet cryptography)."""
+        if self.jwt_secret:
+            return True
+        try:
+            import cryptography  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    @property
+    def mode(self):
+        if self.jwt_secret:
+            return 'hs256'
+        return 'jwks' if self._keys else 'remote'
+
+    def stats(self):
+        return {"mode": self.mode, "keys": len(self._keys)}
+
+
+class SessionRefresher:
+    """
+    Rafraîchissements de sessions et déconnexions Supabase, exécutés par un petit pool de threads.
+
+    Le rafraîchissement d'un refresh token est partagé par toutes les requêtes qui le
+    demandent, et son résultat reste disponible `keep` secondes pour les requêtes suivantes
+    de la même session.
+    """
+
+    def __init__(self, workers=None, keep=None):
+        """
+        Args:
+            workers (int, optional): Threads du pool (AUTH_REFRESH_WORKERS)
+            keep (float, optional): Durée de conservation d'un résultat, en secondes (AUTH_REFRESH_MARGIN)
+        """
+        self.workers = workers or int(os.getenv('AUTH_REFRESH_WORKERS', '2'))
+        self.keep = keep if keep is not None else AUTH_REFRESH_MARGIN
+        self._executor = None
+        self._refreshes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _submit(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="auth-refresh")
+        return self._executor.submit(fn, *args)
+
+    @staticmethod
+    def _refresh(refresh_token):
+        # _refresh_access_token plutôt que refresh_session : la session n'est pas mémorisée
+        # dans le client d'authentification, partagé par tous les utilisateurs
+        response = auth_call('refresh', lambda: get_auth_client()._refresh_access_token(refresh_token))
+        return session_tokens(response.session)
+
+    def refresh(self, refresh_token):
+        """
+        Rafraîchir une session en arrière-plan (ou reprendre le rafraîchissement déjà lancé)
+
+        Args:
+            refresh_token (str): Refresh token de la session
+
+        Returns:
+            Future: Résultat de session_tokens() pour la nouvelle session
+        """
+        with self._lock:
+            now = time.monotonic()
+            while self._refreshes and next(iter(self._refreshes.values()))[0] < now - self.keep:
+                self._refreshes.popitem(last=False)
+            entry = self._refreshes.get(refresh_token)
+            # Un échec est retenté par la requête suivante
+            if entry is not None and not (entry[1].done() and entry[1].exception() is not None):
+                return entry[1]
+            future = self._submit(self._refresh, refresh_token)
+            self._refreshes[refresh_token] = (now, future)
+            self._refreshes.move_to_end(refresh_token)
+            return future
+
+    def revoke(self, access_token):
+        """Révoquer en arrière-plan les refresh tokens d'un utilisateur qui se déconnecte."""
+        def _revoke():
+            try:
+                auth_call('sign_out', lambda: get_auth_client().admin.sign_out(access_token))
+            except Exception as e:
+                print(f"Erreur lors de la révocation de la session: {e}")
+
+        with self._lock:
+            return self._submit(_revoke)
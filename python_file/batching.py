@@ -0,0 +1,156 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    File d'attente qui regroupe les demandes de prédiction concurrentes en batchs.
+
+    Chaque appel à submit() renvoie un Future. Un thread d'inférence attend
+    la première demande, puis complète le batch jusqu'à max_batch_size demandes ou
+    jusqu'à ce que max_wait_ms soit écoulé, et exécute une seule passe avant.
+    Avec un pool de processus, plusieurs threads peuvent alimenter chacun un processus.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=None, max_wait_ms=None, history_size=1000,
+                 workers=1, autostart=True):
+        """
+        Args:
+            predict_fn (callable): Fonction liste d'entrées -> liste de résultats (même ordre)
+            max_batch_size (int, optional): Taille maximale d'un batch
+            max_wait_ms (float, optional): Attente maximale pour compléter un batch, en millisecondes
+            history_size (int): Nombre de mesures conservées pour les percentiles
+            workers (int): Nombre de threads qui exécutent des batchs en parallèle
+            autostart (bool): Démarrer les threads immédiatement ; sinon, appeler start()
+                (par ex. après le fork d'un worker gunicorn)
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size or int(os.getenv('INFERENCE_MAX_BATCH_SIZE', '8'))
+        self.max_wait = (max_wait_ms if max_wait_ms is not None
+                         else float(os.getenv('INFERENCE_MAX_WAIT_MS', '10'))) / 1000
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._wait_times = deque(maxlen=history_size)
+        self._inference_times = deque(maxlen=history_size)
+        self._requests = 0
+        self._errors = 0
+
+        self.workers = workers
+        self._collect_lock = threading.Lock()
+        self._threads = []
+        if autostart:
+            self.start()
+
+    def start(self, workers=None):
+        """
+        Démarrer les threads d'inférence (sans effet s'ils tournent déjà)
+
+        Args:
+            workers (int, optional): Nombre de threads, si différent de celui du constructeur
+        """
+        if any(thread.is_alive() for thread in self._threads):
+            return
+        self.workers = workers or self.workers
+        self._threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"inference-batcher-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, item):
+        """
+        Ajouter une demande de prédiction à la file
+
+        Args:
+            item: Entrée transmise à predict_fn (ex. image en bytes)
+
+        Returns:
+            Future: Résultat de la prédiction pour cette entrée
+        """
+        future = Future()
+        self._queue.put((item, future, time.monotonic()))
+        return future
+
+    def _collect_batch(self):
+        # Un seul thread à la fois constitue son batch, pour ne pas se partager les demandes
+        with self._collect_lock:
+            return self._collect_batch_locked()
+
+    def _collect_batch_locked(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.monotonic()
+            items = [item for item, _, _ in batch]
+
+            try:
+                results = self.predict_fn(items)
+                error = None
+            except Exception as e:
+                results = None
+                error = e
+
+            finished = time.monotonic()
+            with self._lock:
+                self._requests += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._inference_times.append(finished - started)
+                self._wait_times.extend(started - enqueued for _, _, enqueued in batch)
+                if error is not None:
+                    self._errors += len(batch)
+
+            for i, (_, future, _) in enumerate(batch):
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(results[i])
+
+    @staticmethod
+    def _percentiles(values):
+        if not values:
+            return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+        ordered = sorted(values)
+
+        def _at(p):
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+
+        return {"p50": _at(0.50), "p95": _at(0.95), "p99": _at(0.99), "max": round(ordered[-1] * 1000, 3)}
+
+    def stats(self):
+        """
+        Statistiques de la file, pour régler max_batch_size et max_wait_ms
+
+        Returns:
+            dict: Profondeur de file, histogramme des tailles de batch,
+            temps d'attente et d'inférence (ms) sur les dernières mesures
+        """
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "requests": self._requests,
+                "errors": self._errors,
+                "batches": sum(self._batch_sizes.values()),
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "wait_ms": self._percentiles(self._wait_times),
+                "inference_ms": self._percentiles(self._inference_times),
+            }
@@ -0,0 +1,137 @@
+"""
+Micro-benchmark du prétraitement des images.
+
+Compare, pour des JPEG synthétiques de plusieurs résolutions, l'ancien chemin
+(décodage complet PIL + transforms.Compose) et le chemin rapide de image_utils
+(décodage draft JPEG, orientation EXIF, normalisation dans un tenseur préalloué).
+Chaque mesure tourne dans un processus séparé, créé par un forkserver démarré avant
+la génération des images, pour obtenir un pic de RSS propre.
+
+Usage :
+    python bench_preprocess.py [--iterations 20] [--json resultats.json]
+"""
+import argparse
+import io
+import json
+import multiprocessing as mp
+import resource
+import statistics
+import time
+
+SIZES = [(640, 480), (1920, 1080), (4032, 3024)]
+
+
+def make_jpeg(width, height, quality=90):
+    """Générer un JPEG synthétique (dégradé + bruit) de la taille demandée."""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(width * height)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    noise = rng.normal(0, 20, size=(height, width, 3))
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def _legacy_path():
+    import torchvision.transforms as transforms
+    from PIL import Image
+
+    transform = transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    ])
+
+    def run(image_bytes):
+        return transform(Image.open(io.BytesIO(image_bytes)).convert('RGB'))
+
+    return run
+
+
+def _fast_path():
+    import torch
+    from image_utils import decode_to_tensor
+
+    out = torch.empty((3, 224, 224), dtype=torch.float32)
+
+    def run(image_bytes):
+        return decode_to_tensor(image_bytes, out=out)
+
+    return run
+
+
+def _measure(path, image_bytes, iterations, results):
+    run = _legacy_path() if path == 'transforms' else _fast_path()
+    run(image_bytes)  # Échauffement (imports, allocations)
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        run(image_bytes)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    results.put({
+        "median_ms": round(statistics.median(timings), 3),
+        "min_ms": round(min(timings), 3),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "rss_growth_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_kb) / 1024, 1),
+    })
+
+
+def _noop():
+    pass
+
+
+def run_benchmark(iterations):
+    # Le pic de RSS est hérité à la création d'un processus : le forkserver doit
+    # démarrer avant que ce processus n'alloue les images de test
+    ctx = mp.get_context('forkserver')
+    warmup = ctx.Process(target=_noop)
+    warmup.start()
+    warmup.join()
+
+    report = []
+    for width, height in SIZES:
+        image_bytes = make_jpeg(width, height)
+        row = {"resolution": f"{width}x{height}", "jpeg_kb": round(len(image_bytes) / 1024, 1)}
+        for path in ('transforms', 'fast'):
+            results = ctx.Queue()
+            process = ctx.Process(target=_measure, args=(path, image_bytes, iterations, results))
+            process.start()
+            row[path] = results.get()
+            process.join()
+        row["speedup"] = round(row['transforms']['median_ms'] / row['fast']['median_ms'], 2)
+        report.append(row)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--json', help="Fichier de sortie JSON")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.iterations)
+
+    print(f"{'Résolution':>12} {'JPEG':>9} {'transforms':>12} {'rapide':>10} {'gain':>6} "
+          f"{'RSS transforms':>15} {'RSS rapide':>11}")
+    for row in report:
+        print(f"{row['resolution']:>12} {row['jpeg_kb']:>7}Ko "
+              f"{row['transforms']['median_ms']:>10}ms {row['fast']['median_ms']:>8}ms {row['speedup']:>5}x "
+              f"{row['transforms']['peak_rss_mb']:>13}Mo {row['fast']['peak_rss_mb']:>9}Mo")
+    print("RSS : pic du processus de mesure (imports compris)")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
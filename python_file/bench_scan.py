@@ -0,0 +1,317 @@
+"""
+Test de charge du parcours d'analyse : /login -> /upload-image -> /scan_result.
+
+Démarre un Supabase de substitution (fake_supabase.py) et l'application sous gunicorn,
+configurée comme en production, puis simule --users utilisateurs connectés qui envoient
+des JPEG synthétiques de plusieurs résolutions. Pour chaque résolution : débit (analyses/s),
+latences p50/p95/p99 de chaque requête, erreurs et temps moyen par étape côté serveur
+(/metrics). Le pic de RSS couvre tous les processus de l'application (maître, workers,
+pool d'inférence).
+
+Chaque image envoyée est rendue unique (segment de commentaire JPEG) pour mesurer
+l'inférence et non le cache de prédictions ; --allow-cache désactive ce comportement.
+
+Usage :
+    python bench_scan.py [--users 8] [--requests 100] [--sizes 640x480,1920x1080,4032x3024]
+                         [--workers 1] [--model chemin.pth] [--supabase-latency-ms 20]
+                         [--json resultats.json]
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+from bench_preprocess import make_jpeg
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORPUS_SIZE = 8
+# Secret partagé par le substitut (signature des jetons) et l'application (vérification locale)
+JWT_SECRET = 'bench-jwt-secret'
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for(url, status=200, timeout=300, process=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Le processus s'est arrêté (code {process.returncode})")
+        try:
+            if httpx.get(url, timeout=2).status_code == status:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(f"{url} n'a pas répondu {status} en {timeout}s")
+
+
+def _unique(jpeg, n):
+    """Insérer un segment COM après SOI : l'image décodée est identique, son hash diffère."""
+    payload = f"bench-{n}".encode('ascii')
+    return jpeg[:2] + b'\xff\xfe' + struct.pack('>H', len(payload) + 2) + payload + jpeg[2:]
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def _at(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2)
+
+    return {"p50": _at(0.50), "p95": _at(0.95), "p99": _at(0.99), "max": round(ordered[-1] * 1000, 2)}
+
+
+def _process_tree(root_pid):
+    """pid du processus racine et de tous ses descendants (Linux, /proc)."""
+    parents = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open(f'/proc/{name}/stat') as f:
+                    parents[int(name)] = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    tree, frontier = {root_pid}, [root_pid]
+    while frontier:
+        pid = frontier.pop()
+        children = [child for child, parent in parents.items() if parent == pid]
+        tree.update(children)
+        frontier.extend(children)
+    return tree
+
+
+def _status_kb(pid, field):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class RssSampler(threading.Thread):
+    """Échantillonne la RSS totale de l'arbre de processus de l'application."""
+
+    def __init__(self, root_pid, interval=0.05):
+        super().__init__(daemon=True)
+        self.root_pid = root_pid
+        self.interval = interval
+        self.peak_kb = 0
+        self.peak_by_pid = {}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            pids = _process_tree(self.root_pid)
+            self.peak_kb = max(self.peak_kb, sum(_status_kb(pid, 'VmRSS') for pid in pids))
+            for pid in pids:
+                self.peak_by_pid[pid] = max(self.peak_by_pid.get(pid, 0), _status_kb(pid, 'VmHWM'))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _server_stage_means(metrics_text):
+    """Temps moyen (ms) par étape, d'après wildaware_scan_stage_seconds de /metrics."""
+    sums, counts = {}, {}
+    for kind, stage, value in re.findall(
+            r'^wildaware_scan_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', metrics_text, re.M):
+        (sums if kind == 'sum' else counts)[stage] = float(value)
+    return {stage: round(sums[stage] / counts[stage] * 1000, 2) for stage in sorted(sums) if counts.get(stage)}
+
+
+def _login(base_url, user_index):
+    client = httpx.Client(base_url=base_url, timeout=120)
+    response = client.post('/login', data={'username': f"bench{user_index}@wildaware.test",
+                                           'password': 'bench-password'})
+    if response.status_code != 302 or '/scan' not in response.headers.get('location', ''):
+        raise RuntimeError(f"Connexion refusée pour l'utilisateur {user_index} ({response.status_code})")
+    return client
+
+
+def run_load(base_url, clients, corpus, total_requests, unique):
+    """Envoyer total_requests analyses réparties entre les utilisateurs connectés."""
+    counter = iter(range(total_requests))
+    counter_lock = threading.Lock()
+    upload_times, result_times, scan_times, errors = [], [], [], []
+
+    def _user(client):
+        while True:
+            with counter_lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            image = corpus[n % len(corpus)]
+            if unique:
+                image = _unique(image, n)
+            started = time.perf_counter()
+            try:
+                response = client.post('/upload-image', files={'image': ('scan.jpg', image, 'image/jpeg')})
+                uploaded = time.perf_counter()
+                payload = response.json()
+                if response.status_code != 200 or not payload.get('success'):
+                    raise RuntimeError(payload.get('error') or f"HTTP {response.status_code}")
+                result = client.get('/scan_result')
+                finished = time.perf_counter()
+                if result.status_code != 200:
+                    raise RuntimeError(f"/scan_result HTTP {result.status_code}")
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            upload_times.append(uploaded - started)
+            result_times.append(finished - uploaded)
+            scan_times.append(finished - started)
+
+    threads = [threading.Thread(target=_user, args=(client,)) for client in clients]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+
+    return {
+        "requests": total_requests,
+        "completed": len(scan_times),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "duration_s": round(duration, 3),
+        "scans_per_s": round(len(scan_times) / duration, 2) if duration else 0.0,
+        "upload_image_ms": _percentiles(upload_times),
+        "scan_result_ms": _percentiles(result_times),
+        "scan_ms": _percentiles(scan_times),
+    }
+
+
+def run_benchmark(args):
+    sizes = [tuple(int(v) for v in size.split('x')) for size in args.sizes.split(',')]
+    workdir = tempfile.mkdtemp(prefix='bench-scan-')
+    supabase_port, app_port = _free_port(), _free_port()
+    supabase_url = f"http://127.0.0.1:{supabase_port}"
+    base_url = f"http://127.0.0.1:{app_port}"
+
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, 'fake_supabase.py'), '--port', str(supabase_port),
+         '--latency-ms', str(args.supabase_latency_ms), '--jwt-secret', JWT_SECRET],
+        stdout=subprocess.PIPE, text=True)
+    server = None
+    try:
+        fake.stdout.readline()
+        supabase_key = fake.stdout.readline().strip().split('=', 1)[1]
+
+        env = dict(os.environ,
+                   SUPABASE_URL=supabase_url,
+                   SUPABASE_KEY=supabase_key,
+                   SUPABASE_JWT_SECRET=JWT_SECRET,
+                   FLASK_ENV='development',
+                   FLASK_SECRET_KEY='bench-secret',
+                   GUNICORN_BIND=f"127.0.0.1:{app_port}",
+                   WEB_CONCURRENCY=str(args.workers),
+                   GUNICORN_THREADS=str(args.threads),
+                   UPLOAD_SPOOL_DIR=os.path.join(workdir, 'spool'))
+        if args.model:
+            env['MODEL_PATH'] = os.path.abspath(args.model)
+        log = open(os.path.join(workdir, 'server.log'), 'w')
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', os.path.join(HERE, 'gunicorn.conf.py'), 'wsgi:app'],
+            cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        _wait_for(f"{base_url}/ready", process=server, timeout=args.ready_timeout)
+
+        sampler = RssSampler(server.pid)
+        sampler.start()
+        clients = [_login(base_url, i) for i in range(args.users)]
+
+        results = []
+        for width, height in sizes:
+            corpus = [make_jpeg(width + i, height) for i in range(CORPUS_SIZE)]
+            # Échauffement : une analyse par utilisateur, non comptée
+            run_load(base_url, clients, corpus, len(clients), unique=not args.allow_cache)
+            row = {"resolution": f"{width}x{height}",
+                   "jpeg_kb": round(statistics.mean(len(image) for image in corpus) / 1024, 1)}
+            row.update(run_load(base_url, clients, corpus, args.requests, unique=not args.allow_cache))
+            results.append(row)
+
+        for client in clients:
+            client.close()
+        metrics_text = httpx.get(f"{base_url}/metrics", timeout=10).text
+        sampler.stop()
+
+        model_version = httpx.get(f"{base_url}/ready", timeout=10).json().get('model_version')
+        return {
+            "config": {"users": args.users, "requests": args.requests, "workers": args.workers,
+                       "threads": args.threads, "model_version": model_version,
+                       "supabase_latency_ms": args.supabase_latency_ms, "unique_images": not args.allow_cache},
+            "results": results,
+            "peak_rss_mb": round(sampler.peak_kb / 1024, 1),
+            "peak_rss_by_process_mb": {str(pid): round(kb / 1024, 1) for pid, kb in sorted(sampler.peak_by_pid.items())},
+            "server_stage_mean_ms": _server_stage_means(metrics_text),
+        }
+    except Exception:
+        log_path = os.path.join(workdir, 'server.log')
+        if os.path.exists(log_path):
+            with open(log_path) as f:
+                print(''.join(f.readlines()[-30:]), file=sys.stderr)
+        raise
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=60)
+        fake.terminate()
+        fake.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=8, help="Utilisateurs simultanés")
+    parser.add_argument('--requests', type=int, default=100, help="Analyses mesurées par résolution")
+    parser.add_argument('--sizes', default='640x480,1920x1080,4032x3024')
+    parser.add_argument('--workers', type=int, default=1, help="Workers gunicorn (WEB_CONCURRENCY)")
+    parser.add_argument('--threads', type=int, default=4, help="Threads par worker (GUNICORN_THREADS)")
+    parser.add_argument('--model', help="Fichier .pth (défaut : MODEL_PATH ou modèle de l'application)")
+    parser.add_argument('--supabase-latency-ms', type=float, default=20.0)
+    parser.add_argument('--allow-cache', action='store_true', help="Renvoyer les mêmes images (cache de prédictions)")
+    parser.add_argument('--ready-timeout', type=float, default=300)
+    parser.add_argument('--json', help="Fichier de sortie JSON")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+
+    print(f"Modèle {report['config']['model_version']}, {args.users} utilisateurs, "
+          f"{args.workers} worker(s) x {args.threads} threads")
+    print(f"{'Résolution':>12} {'JPEG':>9} {'analyses/s':>11} {'p50':>9} {'p95':>9} {'p99':>9} {'erreurs':>8}")
+    for row in report['results']:
+        print(f"{row['resolution']:>12} {row['jpeg_kb']:>7}Ko {row['scans_per_s']:>11} "
+              f"{row['scan_ms']['p50']:>7}ms {row['scan_ms']['p95']:>7}ms {row['scan_ms']['p99']:>7}ms "
+              f"{row['errors']:>8}")
+    print(f"Pic de RSS de l'application : {report['peak_rss_mb']} Mo")
+    print("Temps moyen par étape (serveur) : " +
+          ', '.join(f"{stage} {ms}ms" for stage, ms in report['server_stage_mean_ms'].items()))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
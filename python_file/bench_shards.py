@@ -0,0 +1,124 @@
+"""
+Benchmark de lecture du jeu de données d'empreintes : une image par fichier (copie
+locale du bucket Empreintes) ou shards de l'ETL (tar de JPEG, ou tableaux npy).
+
+Pour chaque disposition, mesure le temps de lecture seule (octets ou pixels) et le
+temps de préparation d'un batch (N, 3, 224, 224) normalisé, comme pour l'évaluation.
+Les fichiers viennent d'être écrits : les lectures sont servies par le cache disque,
+la différence mesurée est celle des ouvertures de fichiers et du décodage.
+
+Usage :
+    python bench_shards.py [--images 2000] [--shard-size 1000] [--json resultats.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from dataset_shards import ShardDataset, ShardWriter
+
+SPECIES = ["Renard", "Loup", "Raton laveur", "Lynx", "Ours", "Castor", "Chat", "Chien", "Coyote", "Ecureuil",
+           "Lapin", "Puma", "Rat"]
+
+
+def make_images(count):
+    """Images 224x224 synthétiques (dégradé + bruit), en pixels BGR comme produites par l'ETL."""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, 224, dtype=np.float32)
+    base = np.stack([x + 0 * x[:, None], x[:, None] + 0 * x, (x + x[:, None]) / 2], axis=-1)
+    for i in range(count):
+        yield SPECIES[i % len(SPECIES)], np.clip(base + rng.normal(0, 20, size=base.shape), 0, 255).astype(np.uint8)
+
+
+def write_layouts(root, count, shard_size):
+    files = os.path.join(root, "files")
+    tar_writer = ShardWriter(os.path.join(root, "tar"), "tar", shard_size)
+    npy_writer = ShardWriter(os.path.join(root, "npy"), "npy", shard_size)
+    for i, (label, pixels) in enumerate(make_images(count)):
+        data = cv2.imencode('.jpg', pixels, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+        os.makedirs(os.path.join(files, label), exist_ok=True)
+        path = os.path.join(files, label, f"img{i}.jpg")
+        with open(path, 'wb') as f:
+            f.write(data)
+        tar_writer.write(label, path, data)
+        npy_writer.write(label, path, cv2.cvtColor(pixels, cv2.COLOR_BGR2RGB))
+    tar_writer.close()
+    npy_writer.close()
+    return files
+
+
+def iter_files(folder):
+    for label in sorted(os.listdir(folder)):
+        for name in sorted(os.listdir(os.path.join(folder, label))):
+            with open(os.path.join(folder, label, name), 'rb') as f:
+                yield f.read(), label
+
+
+def measure(layout, source):
+    import torch
+    from image_utils import decode_to_tensor, pixels_to_tensor
+
+    def samples():
+        return iter_files(source) if layout == "files" else iter(ShardDataset(source))
+
+    started = time.perf_counter()
+    count = read_bytes = 0
+    for image, _ in samples():
+        # Copie des pixels d'un shard npy : lecture effective de la vue sur le fichier ouvert en mémoire
+        read_bytes += len(image) if isinstance(image, bytes) else len(image.tobytes())
+        count += 1
+    read_seconds = time.perf_counter() - started
+
+    batch = torch.empty((count, 3, 224, 224), dtype=torch.float32)
+    to_tensor = pixels_to_tensor if layout == "npy" else decode_to_tensor
+    started = time.perf_counter()
+    for row, (image, _) in enumerate(samples()):
+        to_tensor(image, out=batch[row])
+    batch_seconds = time.perf_counter() - started
+
+    disk_files = [os.path.join(directory, name) for directory, _, names in os.walk(source) for name in names]
+    return {
+        "layout": layout,
+        "images": count,
+        "files": len(disk_files),
+        "disk_mb": round(sum(os.path.getsize(path) for path in disk_files) / 1e6, 1),
+        "read_ms": round(read_seconds * 1000, 1),
+        "read_mb_per_s": round(read_bytes / 1e6 / read_seconds),
+        "batch_ms": round(batch_seconds * 1000, 1),
+        "batch_images_per_s": round(count / batch_seconds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=2000)
+    parser.add_argument('--shard-size', type=int, default=1000)
+    parser.add_argument('--json', help="Fichier de sortie JSON")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench-shards-")
+    try:
+        files = write_layouts(root, args.images, args.shard_size)
+        report = [measure("files", files), measure("tar", os.path.join(root, "tar")),
+                  measure("npy", os.path.join(root, "npy"))]
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    print(f"{'Disposition':>12} {'fichiers':>9} {'disque':>9} {'lecture':>10} {'Mo/s':>8} "
+          f"{'batch':>10} {'images/s':>10}")
+    for row in report:
+        print(f"{row['layout']:>12} {row['files']:>9} {row['disk_mb']:>7}Mo {row['read_ms']:>8}ms "
+              f"{row['read_mb_per_s']:>8} {row['batch_ms']:>8}ms {row['batch_images_per_s']:>10}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark du démarrage à froid de l'application.
+
+Chaque mesure tourne dans un interpréteur neuf (dossier de travail temporaire, services
+différés comme sous gunicorn) et relève :
+  - import_s          durée de `import app`
+  - first_response_s  délai jusqu'à la première réponse de /health (pages servies)
+  - ready_s           délai jusqu'à ce que /ready réponde 200 (modèle chargé et échauffé)
+  - first_predict_ms  latence de la première prédiction après /ready
+  - predict_ms        latence médiane des prédictions suivantes
+  - torch_at_import   torch était-il importé par `import app` ?
+
+Usage :
+    python bench_startup.py [--runs 3] [--model chemin.pth] [--json resultats.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+METRICS = ['import_s', 'first_response_s', 'ready_s', 'first_predict_ms', 'predict_ms']
+
+
+def _child(ready_timeout):
+    started = time.perf_counter()
+    import app
+    imported = time.perf_counter()
+    torch_at_import = 'torch' in sys.modules
+
+    client = app.app.test_client()
+    client.get('/health')
+    first_response = time.perf_counter()
+
+    app.start_background_services()
+    while client.get('/ready').status_code != 200:
+        if time.perf_counter() - started > ready_timeout:
+            raise TimeoutError("Le modèle n'est pas prêt")
+        time.sleep(0.01)
+    ready = time.perf_counter()
+
+    from bench_preprocess import make_jpeg
+    image_bytes = make_jpeg(1280, 960)
+    timings = []
+    for _ in range(6):
+        t = time.perf_counter()
+        app.footprint_model.predict(image_bytes)
+        timings.append((time.perf_counter() - t) * 1000)
+
+    print(json.dumps({
+        "import_s": round(imported - started, 3),
+        "first_response_s": round(first_response - started, 3),
+        "ready_s": round(ready - started, 3),
+        "first_predict_ms": round(timings[0], 1),
+        "predict_ms": round(statistics.median(timings[1:]), 1),
+        "torch_at_import": torch_at_import,
+        "model_version": app.footprint_model.model_version,
+    }))
+
+
+def run_once(model_path, ready_timeout):
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ,
+                   PYTHONPATH=HERE,
+                   WILDAWARE_DEFER_SERVICES='true',
+                   UPLOAD_SPOOL_DIR=os.path.join(workdir, 'spool'))
+        if model_path:
+            env['MODEL_PATH'] = os.path.abspath(model_path)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', '--ready-timeout', str(ready_timeout)],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True).stdout
+    # Les modules et leurs threads affichent leurs messages : la mesure est la ligne JSON
+    return json.loads(next(line for line in reversed(output.splitlines()) if line.startswith('{')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--model', help="Fichier .pth (défaut : MODEL_PATH ou modèle de l'application)")
+    parser.add_argument('--ready-timeout', type=float, default=300)
+    parser.add_argument('--json', help="Fichier de sortie JSON")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.ready_timeout)
+        return
+
+    runs = [run_once(args.model, args.ready_timeout) for _ in range(args.runs)]
+    report = {
+        "runs": runs,
+        "median": {metric: statistics.median(run[metric] for run in runs) for metric in METRICS},
+    }
+
+    print(f"Modèle : {runs[0]['model_version']}, torch importé par `import app` : "
+          f"{'oui' if runs[0]['torch_at_import'] else 'non'}")
+    for metric in METRICS:
+        values = ', '.join(str(run[metric]) for run in runs)
+        print(f"{metric:>17} : médiane {report['median'][metric]:>8}  ({values})")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
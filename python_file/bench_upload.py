@@ -0,0 +1,119 @@
+"""
+Mémoire par upload : ancien chemin (lecture complète en bytes) contre lecture en flux.
+
+Pour chaque taille d'image, une requête multipart réelle est analysée par Werkzeug (comme
+dans Flask), puis le fichier reçu est traité selon chacun des deux chemins de /upload-image :
+  - bytes : uploaded_file.read(), écriture du buffer dans le spool (MD5 calculé au passage), décodage depuis
+            io.BytesIO, relecture complète du spool par le thread d'upload
+  - flux  : une seule lecture par blocs (MD5 incrémental et écriture dans le spool),
+            décodage directement depuis le fichier reçu, envoi du spool par blocs
+Le pic d'allocation Python (tracemalloc) est mesuré pour une requête, puis pour
+--concurrency requêtes simultanées. L'analyse multipart et le décodage JPEG lui-même
+(identiques dans les deux chemins) ne sont pas comptés.
+
+Usage :
+    python bench_upload.py [--sizes 1280x960,4032x3024,6000x4000] [--concurrency 8]
+"""
+import argparse
+import hashlib
+import io
+import tempfile
+import threading
+import tracemalloc
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from bench_preprocess import make_jpeg
+from image_utils import decode_to_tensor
+from result_cache import ResultCache
+from upload_queue import UploadQueue
+
+
+def parse_upload(jpeg):
+    """Requête multipart analysée par Werkzeug : retourne le FileStorage de 'image'."""
+    builder = EnvironBuilder(method='POST', data={'image': (io.BytesIO(jpeg), 'scan.jpg', 'image/jpeg')})
+    request = Request(builder.get_environ())
+    return request.files['image']
+
+
+def bytes_path(uploaded_file, upload_queue):
+    image_bytes = uploaded_file.read()
+    digest = hashlib.md5()
+    job = upload_queue.stage('UserImg', 'bench/scan.jpg', image_bytes, on_chunk=digest.update)
+    ResultCache.key_for_digest(digest.hexdigest(), 'bench')
+    decode_to_tensor(image_bytes)
+    # Le thread d'upload relisait tout le fichier du spool avant de l'envoyer
+    with open(upload_queue._paths(job['id'])[0], 'rb') as f:
+        data = f.read()
+    del data
+    upload_queue.cancel(job)
+
+
+def stream_path(uploaded_file, upload_queue):
+    digest = hashlib.md5()
+    job = upload_queue.stage('UserImg', 'bench/scan.jpg', uploaded_file.stream, on_chunk=digest.update)
+    ResultCache.key_for_digest(digest.hexdigest(), 'bench')
+    uploaded_file.stream.seek(0)
+    decode_to_tensor(uploaded_file.stream)
+    # Le thread d'upload passe le fichier ouvert au client Supabase, qui l'envoie par blocs
+    with open(upload_queue._paths(job['id'])[0], 'rb'):
+        pass
+    upload_queue.cancel(job)
+
+
+def peak_mb(handler, jpeg, upload_queue, concurrency):
+    """Pic d'allocation pendant `concurrency` traitements simultanés, en Mo."""
+    files = [parse_upload(jpeg) for _ in range(concurrency)]
+    barrier = threading.Barrier(concurrency)
+
+    def _run(uploaded_file):
+        barrier.wait()
+        handler(uploaded_file, upload_queue)
+
+    threads = [threading.Thread(target=_run, args=(uploaded_file,)) for uploaded_file in files]
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    for uploaded_file in files:
+        uploaded_file.close()
+    return (peak - baseline) / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1280x960,4032x3024,6000x4000')
+    parser.add_argument('--quality', type=int, default=95)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    upload_queue = UploadQueue(client=None, spool_dir=tempfile.mkdtemp(prefix='bench-upload-'), autostart=False)
+    upload_queue.start()
+
+    # Premier passage hors mesure : imports et caches (torch, normalisation, décodeur)
+    warm = make_jpeg(320, 240)
+    bytes_path(parse_upload(warm), upload_queue)
+    stream_path(parse_upload(warm), upload_queue)
+
+    print(f"{'Résolution':>12} {'JPEG':>9}   {'bytes':>9} {'flux':>9} {'gain':>9}   "
+          f"{'bytes x' + str(args.concurrency):>10} {'flux x' + str(args.concurrency):>10}")
+    for size in args.sizes.split(','):
+        width, height = (int(v) for v in size.split('x'))
+        jpeg = make_jpeg(width, height, quality=args.quality)
+        single = {name: peak_mb(handler, jpeg, upload_queue, 1)
+                  for name, handler in (('bytes', bytes_path), ('stream', stream_path))}
+        concurrent = {name: peak_mb(handler, jpeg, upload_queue, args.concurrency)
+                      for name, handler in (('bytes', bytes_path), ('stream', stream_path))}
+        print(f"{size:>12} {len(jpeg) / 2 ** 20:>7.2f}Mo   {single['bytes']:>7.2f}Mo {single['stream']:>7.2f}Mo "
+              f"{single['bytes'] - single['stream']:>7.2f}Mo   "
+              f"{concurrent['bytes']:>8.1f}Mo {concurrent['stream']:>8.1f}Mo")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,51 +1,519 @@
-import torch
-import torch.nn as nn
-from torch.serialization import safe_globals
+"""
+Conversion et export du modèle de reconnaissance d'empreintes.
+
+1. Conversion (comportement d'origine) : modèle picklé animal_footprint_model.pth ->
+   state_dict animal_footprint_model_safe.pth, chargeable sans exécuter de code.
+2. Export (--export) à partir du state_dict, pour des répliques CPU à mémoire limitée :
+   - torchscript : modèle tracé et figé (.pt), chargeable sans torchvision
+   - int8        : quantification statique post-entraînement (convolutions et couche finale
+                   en int8, calibrée sur des images), enregistrée en TorchScript (_int8.pt)
+   - onnx        : export ONNX (.onnx), exécuté par onnxruntime s'il est installé
+   Chaque artefact est ensuite chargé dans un processus neuf, comme par l'application
+   (footprint_recognition.load_artifact), et comparé au modèle flottant : concordance des
+   classes prédites, écart des probabilités, latence par taille de batch, mémoire.
+
+Usage :
+    python convert_model.py
+    python convert_model.py --export torchscript,int8,onnx --images WildLens_img [--report rapport.json]
+    python convert_model.py --fit-temperature --images WildLens_img
+
+--fit-temperature ajuste la température de calibration des probabilités (MODEL_TEMPERATURE)
+sur des images rangées par espèce.
+
+--images accepte aussi un jeu de données en shards produit par l'ETL (ETL_OUTPUT=shards).
+
+L'application charge l'artefact désigné par MODEL_PATH (format déduit de l'extension,
+ou imposé par MODEL_FORMAT).
+"""
+import argparse
+import hashlib
+import inspect
+import json
+import multiprocessing as mp
 import os
+import statistics
+import sys
+import time
+
+import torch
+
+MODEL_PATH = 'animal_footprint_model.pth'
+SAFE_MODEL_PATH = 'animal_footprint_model_safe.pth'
+EXPORT_FORMATS = ('torchscript', 'int8', 'onnx')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def convert_to_state_dict(model_path=MODEL_PATH, safe_model_path=SAFE_MODEL_PATH):
+    """
+    Convertir un modèle picklé en state_dict
+
+    Args:
+        model_path (str): Modèle enregistré avec torch.save(model)
+        safe_model_path (str): Fichier state_dict à produire
+
+    Returns:
+        bool: True si la conversion a réussi
+    """
+    try:
+        print(f"Tentative de conversion du modèle : {model_path}")
+
+        # Charger le modèle en mode non sécurisé
+        model = torch.load(model_path, weights_only=False)
+
+        print("Modèle chargé avec succès!")
+
+        # Vérifier le type de modèle
+        if isinstance(model, dict):
+            print("Le modèle est un state_dict")
+            state_dict = model
+        elif hasattr(model, 'state_dict'):
+            print("Le modèle est une instance de modèle")
+            state_dict = model.state_dict()
+        else:
+            print(f"Type de modèle non reconnu: {type(model)}")
+            raise ValueError("Format de modèle non supporté")
+
+        # Enregistrer uniquement le state_dict
+        torch.save(state_dict, safe_model_path)
+
+        print(f"Modèle converti avec succès et enregistré sous: {safe_model_path}")
+
+        # Vérifier que le modèle peut être rechargé
+        try:
+            print("Tentative de recharger le modèle converti...")
+            torch.load(safe_model_path, weights_only=True)
+            print("Modèle rechargé avec succès!")
+        except Exception as e:
+            print(f"Erreur lors du rechargement: {e}")
+        return True
+
+    except Exception as e:
+        print(f"Erreur lors de la conversion: {e}")
+        return False
+
+
+def load_shard_images(folder, limit, class_names=None):
+    """
+    Prétraiter jusqu'à `limit` images d'un jeu de données en shards de l'ETL (voir dataset_shards)
+
+    Args:
+        folder (str): Dossier du jeu de données (index.json)
+        limit (int): Nombre maximal d'images
+        class_names (list, optional): Classes du modèle ; seules les images de ces espèces sont gardées
+
+    Returns:
+        tuple: (batch (N, 3, 224, 224), indices des classes (N,), -1 sans class_names)
+    """
+    from dataset_shards import ShardDataset
+    from image_utils import decode_to_tensor, pixels_to_tensor
+
+    dataset = ShardDataset(folder)
+    samples = []
+    for i, (_, _, sample) in enumerate(dataset.samples):
+        index = -1
+        if class_names is not None:
+            # Les noms de dossiers remplacent parfois les espaces par des '_'
+            label = sample["label"] if sample["label"] in class_names else sample["label"].replace('_', ' ')
+            if label not in class_names:
+                continue
+            index = class_names.index(label)
+        samples.append((sample["source"], i, index))
+    # Même échantillon stable que pour un dossier d'images
+    samples.sort(key=lambda sample: hashlib.md5(sample[0].encode()).hexdigest())
+    samples = samples[:limit]
+
+    to_tensor = pixels_to_tensor if dataset.format == "npy" else decode_to_tensor
+    batch = torch.empty((len(samples), 3, 224, 224), dtype=torch.float32)
+    for row, (_, i, _) in enumerate(samples):
+        to_tensor(dataset[i][0], out=batch[row])
+    return batch, torch.tensor([index for _, _, index in samples], dtype=torch.long)
+
+
+def load_images(folder, limit):
+    """
+    Prétraiter jusqu'à `limit` images d'un dossier (récursivement), comme l'application
+
+    Returns:
+        torch.Tensor: Batch (N, 3, 224, 224), vide si aucune image n'est trouvée
+    """
+    from dataset_shards import ShardDataset
+    from image_utils import decode_to_tensor
+
+    if ShardDataset.is_dataset(folder):
+        return load_shard_images(folder, limit)[0]
+
+    paths = []
+    for root, _, files in os.walk(folder or ''):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+    # Échantillon stable mais réparti sur toutes les espèces (dossiers)
+    paths.sort(key=lambda path: hashlib.md5(path.encode()).hexdigest())
+    paths = paths[:limit]
+
+    batch = torch.empty((len(paths), 3, 224, 224), dtype=torch.float32)
+    for i, path in enumerate(paths):
+        with open(path, 'rb') as f:
+            decode_to_tensor(f.read(), out=batch[i])
+    return batch
+
+
+def load_labeled_images(folder, class_names, limit):
+    """
+    Prétraiter des images rangées par espèce (<dossier>/<Espèce>/..., comme WildLens_img)
+
+    Returns:
+        tuple: (batch (N, 3, 224, 224), indices des classes (N,))
+    """
+    from dataset_shards import ShardDataset
+    from image_utils import decode_to_tensor
+
+    if ShardDataset.is_dataset(folder):
+        return load_shard_images(folder, limit, class_names)
+
+    samples = []
+    for index, name in enumerate(class_names):
+        # Les noms de dossiers remplacent parfois les espaces par des '_'
+        for directory in (os.path.join(folder, name), os.path.join(folder, name.replace(' ', '_'))):
+            if os.path.isdir(directory):
+                samples.extend((os.path.join(directory, file), index) for file in os.listdir(directory)
+                               if file.lower().endswith(IMAGE_EXTENSIONS))
+                break
+    samples.sort(key=lambda sample: hashlib.md5(sample[0].encode()).hexdigest())
+    samples = samples[:limit]
+
+    batch = torch.empty((len(samples), 3, 224, 224), dtype=torch.float32)
+    for i, (path, _) in enumerate(samples):
+        with open(path, 'rb') as f:
+            decode_to_tensor(f.read(), out=batch[i])
+    return batch, torch.tensor([index for _, index in samples], dtype=torch.long)
+
+
+def fit_temperature(logits, labels):
+    """
+    Mise à l'échelle de température : T minimisant la log-vraisemblance négative de
+    softmax(logits / T) sur des images étiquetées (ne change pas la classe prédite)
+
+    Returns:
+        float: Température (MODEL_TEMPERATURE)
+    """
+    log_temperature = torch.zeros(1, requires_grad=True)
+    optimizer = torch.optim.LBFGS([log_temperature], lr=0.1, max_iter=200)
+
+    def _closure():
+        optimizer.zero_grad()
+        loss = torch.nn.functional.cross_entropy(logits / log_temperature.exp(), labels)
+        loss.backward()
+        return loss
 
-# Importer toutes les classes possibles dont nous pourrions avoir besoin
-from torch.nn.modules.conv import Conv2d
-from torch.nn.modules.linear import Linear
-from torch.nn.modules.activation import ReLU
-from torch.nn.modules.pooling import MaxPool2d, AvgPool2d
-from torch.nn.modules.batchnorm import BatchNorm2d
-from torchvision.models.resnet import ResNet, Bottleneck, BasicBlock
+    optimizer.step(_closure)
+    return log_temperature.exp().item()
 
-try:
-    # Chemin vers votre modèle
-    model_path = 'animal_footprint_model.pth'
 
-    print(f"Tentative de conversion du modèle : {model_path}")
+def calibration_error(probabilities, labels, bins=15):
+    """Écart moyen entre confiance et exactitude, par tranche de confiance (ECE)."""
+    confidences, predictions = probabilities.max(dim=1)
+    error = 0.0
+    for lower in torch.linspace(0, 1, bins + 1)[:-1]:
+        mask = (confidences > lower) & (confidences <= lower + 1 / bins)
+        if mask.any():
+            accuracy = (predictions[mask] == labels[mask]).float().mean()
+            error += mask.float().mean().item() * (confidences[mask].mean() - accuracy).abs().item()
+    return error
 
-    # Charger le modèle en mode non sécurisé
-    model = torch.load(model_path, weights_only=False)
 
-    print("Modèle chargé avec succès!")
+def temperature_report(args):
+    """Ajuster la température du modèle flottant sur les images étiquetées de --images."""
+    from footprint_recognition import footprint_model, load_resnet
 
-    # Vérifier le type de modèle
-    if isinstance(model, dict):
-        print("Le modèle est un state_dict")
-        state_dict = model
-    elif hasattr(model, 'state_dict'):
-        print("Le modèle est une instance de modèle")
-        state_dict = model.state_dict()
-    else:
-        print(f"Type de modèle non reconnu: {type(model)}")
-        raise ValueError("Format de modèle non supporté")
+    images, labels = load_labeled_images(args.images, footprint_model.class_names, args.num_images * 4)
+    if images.shape[0] < 2:
+        raise ValueError(f"Aucune image étiquetée dans {args.images} (sous-dossiers attendus : une espèce par dossier)")
 
-    # Enregistrer uniquement le state_dict
-    safe_model_path = 'animal_footprint_model_safe.pth'
-    torch.save(state_dict, safe_model_path)
+    model, _ = load_resnet(args.output)
+    with torch.no_grad():
+        logits = torch.cat([model(images[start:start + 8]) for start in range(0, images.shape[0], 8)])
+    temperature = fit_temperature(logits, labels)
 
-    print(f"Modèle converti avec succès et enregistré sous: {safe_model_path}")
+    report = {"images": images.shape[0], "temperature": round(temperature, 4),
+              "accuracy": round((logits.argmax(dim=1) == labels).float().mean().item(), 4)}
+    for name, value in (("before", 1.0), ("after", temperature)):
+        scaled = logits / value
+        report[f"nll_{name}"] = round(torch.nn.functional.cross_entropy(scaled, labels).item(), 4)
+        report[f"ece_{name}"] = round(calibration_error(torch.softmax(scaled, dim=1), labels), 4)
 
-    # Vérifier que le modèle peut être rechargé
+    print(f"Température ajustée sur {report['images']} image(s) : ECE {report['ece_before']:.3f} -> "
+          f"{report['ece_after']:.3f}, NLL {report['nll_before']:.3f} -> {report['nll_after']:.3f}")
+    print(f"MODEL_TEMPERATURE={temperature:.4f}")
+    return report
+
+
+def synthetic_images(count):
+    """Images synthétiques (dégradés et bruit), à défaut d'images réelles."""
+    import io
+    import numpy as np
+    from PIL import Image
+    from image_utils import decode_to_tensor
+
+    rng = np.random.default_rng(0)
+    batch = torch.empty((count, 3, 224, 224), dtype=torch.float32)
+    for i in range(count):
+        x = np.linspace(0, 255, 320, dtype=np.float32)
+        y = np.linspace(0, 255, 240, dtype=np.float32)[:, None]
+        base = np.stack([x * rng.random() + 0 * y, y * rng.random() + 0 * x, (x + y) / 2], axis=-1)
+        pixels = np.clip(base + rng.normal(0, 40, size=(240, 320, 3)), 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format='JPEG')
+        decode_to_tensor(buffer.getvalue(), out=batch[i])
+    return batch
+
+
+def _metadata(state_dict, source_path, **extra):
+    with open(source_path, 'rb') as f:
+        source_version = hashlib.md5(f.read()).hexdigest()[:12]
+    return json.dumps({"num_classes": state_dict['fc.weight'].shape[0], "source_version": source_version, **extra})
+
+
+def export_torchscript(model, state_dict, source_path, output_path):
+    """Tracer et figer le modèle flottant, puis l'enregistrer en TorchScript."""
+    from footprint_recognition import TORCHSCRIPT_METADATA
+
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(model, torch.zeros(1, 3, 224, 224)))
+    traced.save(output_path, _extra_files={
+        TORCHSCRIPT_METADATA: _metadata(state_dict, source_path, format="torchscript")})
+    return output_path
+
+
+def quantize_static(state_dict, calibration, engine=None):
+    """
+    Quantification statique int8 : fusion conv+bn+relu, calibration des plages
+    d'activation sur des images réelles, puis conversion des poids en int8
+
+    Args:
+        state_dict (dict): Poids du modèle flottant
+        calibration (torch.Tensor): Images prétraitées (N, 3, 224, 224)
+        engine (str, optional): Moteur int8 (x86, fbgemm, qnnpack) ; défaut : celui de PyTorch
+
+    Returns:
+        tuple: (modèle quantifié, moteur utilisé)
+    """
+    from torch.ao.quantization import convert, get_default_qconfig, prepare
+    from torchvision.models.resnet import Bottleneck
+    from torchvision.models.quantization.resnet import (QuantizableBasicBlock, QuantizableBottleneck,
+                                                        QuantizableResNet)
+    from footprint_recognition import build_resnet
+
+    engine = engine or torch.backends.quantized.engine
+    torch.backends.quantized.engine = engine
+
+    # Même architecture que le modèle flottant, avec les points de quantification de torchvision
+    reference = build_resnet(state_dict)
+    block = QuantizableBottleneck if isinstance(reference.layer1[0], Bottleneck) else QuantizableBasicBlock
+    layers = [len(getattr(reference, f'layer{i}')) for i in range(1, 5)]
+    model = QuantizableResNet(block, layers, num_classes=reference.fc.out_features)
+    model.load_state_dict(state_dict)
+    model.eval()
+
+    model.fuse_model()
+    model.qconfig = get_default_qconfig(engine)
+    prepare(model, inplace=True)
+    with torch.no_grad():
+        for start in range(0, calibration.shape[0], 8):
+            model(calibration[start:start + 8])
+    convert(model, inplace=True)
+    return model, engine
+
+
+def export_int8(state_dict, source_path, calibration, output_path, engine=None):
+    """Quantifier le modèle en int8 et l'enregistrer en TorchScript."""
+    from footprint_recognition import TORCHSCRIPT_METADATA
+
+    model, engine = quantize_static(state_dict, calibration, engine)
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(model, torch.zeros(1, 3, 224, 224)))
+    traced.save(output_path, _extra_files={
+        TORCHSCRIPT_METADATA: _metadata(state_dict, source_path, format="torchscript-int8", quantized_engine=engine,
+                                        calibration_images=calibration.shape[0])})
+    return output_path
+
+
+def export_onnx(model, output_path, opset=17):
+    """Exporter le modèle flottant en ONNX, avec une taille de batch variable."""
+    options = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # Exporteur TorchScript : pas de dépendance à onnxscript
+        options['dynamo'] = False
+    torch.onnx.export(model, torch.zeros(1, 3, 224, 224), output_path, input_names=['input'],
+                      output_names=['logits'], dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+                      opset_version=opset, **options)
+    return output_path
+
+
+def _status_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def _measure(model_path, images, batch_sizes, repeats, threads, results):
+    """
+    Dans un processus neuf : charger l'artefact comme l'application, prédire les images
+    de référence et mesurer la latence par taille de batch et la mémoire
+    """
     try:
-        print("Tentative de recharger le modèle converti...")
-        reloaded_state_dict = torch.load(safe_model_path)
-        print("Modèle rechargé avec succès!")
+        torch.set_num_threads(threads)
+        from footprint_recognition import load_artifact, resolve_model_format
+
+        rss_before = _status_kb('VmRSS')
+        started = time.perf_counter()
+        model, version, _ = load_artifact(model_path)
+        load_s = time.perf_counter() - started
+        rss_loaded = _status_kb('VmRSS')
+
+        with torch.inference_mode():
+            probabilities = torch.cat([torch.softmax(model(images[start:start + 8]), dim=1)
+                                       for start in range(0, images.shape[0], 8)])
+            latency_ms = {}
+            for size in batch_sizes:
+                batch = images[:size].repeat((size + images.shape[0] - 1) // images.shape[0], 1, 1, 1)[:size]
+                model(batch)
+                timings = []
+                for _ in range(repeats):
+                    started = time.perf_counter()
+                    model(batch)
+                    timings.append((time.perf_counter() - started) * 1000)
+                latency_ms[str(size)] = round(statistics.median(timings), 2)
+
+        results.put({
+            "format": resolve_model_format(model_path),
+            "version": version,
+            "file_mb": round(os.path.getsize(model_path) / 2 ** 20, 2),
+            "load_s": round(load_s, 3),
+            "load_rss_mb": round((rss_loaded - rss_before) / 1024, 1),
+            "peak_rss_mb": round(_status_kb('VmHWM') / 1024, 1),
+            "latency_ms": latency_ms,
+            "probabilities": probabilities.numpy(),
+        })
     except Exception as e:
-        print(f"Erreur lors du rechargement: {e}")
+        results.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def measure(model_path, images, batch_sizes, repeats, threads):
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(model_path, images, batch_sizes, repeats, threads, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def parity(reference, candidate):
+    """Concordance des classes prédites et écart des probabilités avec le modèle flottant."""
+    reference, candidate = torch.from_numpy(reference), torch.from_numpy(candidate)
+    return {
+        "top1_agreement": round((reference.argmax(dim=1) == candidate.argmax(dim=1)).float().mean().item(), 4),
+        "max_abs_prob_diff": round((reference - candidate).abs().max().item(), 5),
+        "mean_abs_prob_diff": round((reference - candidate).abs().mean().item(), 6),
+    }
+
+
+def export_all(args):
+    from footprint_recognition import load_resnet
+
+    formats = [name.strip() for name in args.export.split(',') if name.strip()]
+    unknown = set(formats) - set(EXPORT_FORMATS)
+    if unknown:
+        raise ValueError(f"Format(s) d'export inconnu(s): {', '.join(sorted(unknown))}")
+
+    state_dict = torch.load(args.output, map_location='cpu', weights_only=True)
+    state_dict = {key.replace('module.', '', 1) if key.startswith('module.') else key: value
+                  for key, value in state_dict.items()}
+    model, _ = load_resnet(args.output)
+
+    images = load_images(args.images, args.num_images * 2)
+    if images.shape[0] < 2:
+        print("Aucune image réelle (--images) : calibration et comparaison sur des images synthétiques, "
+              "à valider sur de vraies empreintes avant mise en production.")
+        images = synthetic_images(args.num_images * 2)
+    # Images distinctes pour la calibration int8 et pour la comparaison
+    calibration, evaluation = images[0::2], images[1::2]
+    print(f"{calibration.shape[0]} image(s) de calibration, {evaluation.shape[0]} image(s) de comparaison")
+
+    base = os.path.splitext(args.output)[0].replace('_safe', '')
+    artifacts = {"state_dict": args.output}
+    for name in formats:
+        try:
+            if name == 'torchscript':
+                artifacts[name] = export_torchscript(model, state_dict, args.output, base + '.pt')
+            elif name == 'int8':
+                artifacts[name] = export_int8(state_dict, args.output, calibration, base + '_int8.pt', args.engine)
+            elif name == 'onnx':
+                artifacts[name] = export_onnx(model, base + '.onnx')
+            print(f"Export {name} enregistré sous: {artifacts[name]}")
+        except Exception as e:
+            print(f"Erreur lors de l'export {name}: {e}")
+
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+    report = {"threads": args.threads, "evaluation_images": evaluation.shape[0], "artifacts": {}}
+    reference = None
+    for name, path in artifacts.items():
+        result = measure(path, evaluation, batch_sizes, args.repeats, args.threads)
+        if "error" not in result:
+            probabilities = result.pop("probabilities")
+            if reference is None:
+                reference = probabilities
+            result.update(parity(reference, probabilities))
+            result["parity_ok"] = result["top1_agreement"] >= args.min_agreement
+        report["artifacts"][name] = {"path": path, **result}
+
+    print(f"\n{'Artefact':<12} {'Fichier':>9} {'Mémoire':>9} {'Concord.':>9} {'Écart max':>10}  Latence (ms) par batch")
+    for name, entry in report["artifacts"].items():
+        if "error" in entry:
+            print(f"{name:<12} ignoré : {entry['error']}")
+            continue
+        latency = ', '.join(f"{size}: {ms}" for size, ms in entry["latency_ms"].items())
+        print(f"{name:<12} {entry['file_mb']:>7}Mo {entry['load_rss_mb']:>7}Mo {entry['top1_agreement']:>9.2%} "
+              f"{entry['max_abs_prob_diff']:>10.4f}  {latency}")
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=MODEL_PATH, help="Modèle picklé à convertir")
+    parser.add_argument('--output', default=SAFE_MODEL_PATH, help="state_dict produit, source des exports")
+    parser.add_argument('--export', default='', help="Formats à exporter : torchscript,int8,onnx")
+    parser.add_argument('--images', help="Dossier d'images d'empreintes (ou jeu de données en shards de l'ETL) "
+                                         "pour la calibration et la comparaison")
+    parser.add_argument('--num-images', type=int, default=64, help="Images de calibration (autant pour la comparaison)")
+    parser.add_argument('--engine', help="Moteur int8 : x86, fbgemm (serveurs x86) ou qnnpack (ARM)")
+    parser.add_argument('--min-agreement', type=float, default=0.95,
+                        help="Concordance minimale des classes prédites avec le modèle flottant")
+    parser.add_argument('--threads', type=int, default=int(os.getenv('TORCH_NUM_THREADS', '1')))
+    parser.add_argument('--batch-sizes', default='1,8')
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--report', help="Fichier JSON du rapport d'export")
+    parser.add_argument('--fit-temperature', action='store_true',
+                        help="Ajuster MODEL_TEMPERATURE sur les images de --images, rangées par espèce")
+    args = parser.parse_args()
+
+    if os.path.exists(args.model) or not os.path.exists(args.output):
+        if not convert_to_state_dict(args.model, args.output):
+            sys.exit(1)
+    report = {}
+    if args.fit_temperature:
+        report["calibration"] = temperature_report(args)
+    if args.export:
+        report.update(export_all(args))
+    if args.report and report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if not all(entry.get("parity_ok", True) for entry in report.get("artifacts", {}).values()):
+        print(f"Concordance inférieure à {args.min_agreement:.0%} pour au moins un artefact")
+        sys.exit(1)
+
 
-except Exception as e:
-    print(f"Erreur lors de la conversion: {e}")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
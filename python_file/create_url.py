@@ -1,21 +1,23 @@
 import os
-from supabase import create_client, Client
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from supabase_conn import supabase, call
 
 load_dotenv()
-# Initialisation Supabase
+# Initialisation Supabase (client partagé de supabase_conn)
 supabase_url = os.getenv('SUPABASE_URL')
-supabase_key = os.getenv('SUPABASE_KEY')
-supabase: Client = create_client(supabase_url, supabase_key)
 
 # Configuration
 local_images_folder = "WildLens_img"
 bucket_name = "Dirty_Footprint"
+upload_concurrency = int(os.getenv('UPLOAD_CONCURRENCY', '8'))
+insert_batch_size = int(os.getenv('INSERT_BATCH_SIZE', '500'))
+image_extensions = ('.jpg', '.jpeg', '.png')
 
 
 def test_connection():
     try:
-        supabase.storage.from_(bucket_name).list()
+        call('storage.list', lambda: supabase.storage.from_(bucket_name).list())
         print("Connexion réussie et accès au bucket confirmé")
         return True
     except Exception as e:
@@ -28,79 +30,126 @@ def get_public_url(file_path):
     return f"{supabase_url}/storage/v1/object/public/{bucket_name}/{file_path}"
 
 
-def get_animal_id(espece):
-    """Récupère l'ID de l'animal depuis la base de données"""
+def get_animal_ids(especes):
+    """Récupère les IDs de plusieurs espèces en une seule requête"""
     try:
-        response = supabase.table('Animaux').select('id').eq('Espèce', espece).execute()
-        if response.data and len(response.data) > 0:
-            return response.data[0]['id']
-        return None
+        response = call('db.select', lambda: supabase.table('Animaux').select('id, Espèce')
+                        .in_('Espèce', list(especes)).execute())
+        return {row['Espèce']: row['id'] for row in response.data or []}
     except Exception as e:
-        print(f"Erreur lors de la récupération de l'ID pour {espece}: {str(e)}")
-        return None
-
-
-def update_database_urls():
+        print(f"Erreur lors de la récupération des IDs des animaux: {str(e)}")
+        return {}
+
+
+def iter_local_images(folder_path):
+    """Génère (dossier animal, chemin local, clé dans le bucket) pour chaque image locale"""
+    for animal_folder in sorted(os.listdir(folder_path)):
+        animal_path = os.path.join(folder_path, animal_folder)
+        if not os.path.isdir(animal_path):
+            continue
+        for file in sorted(os.listdir(animal_path)):
+            if file.lower().endswith(image_extensions):
+                file_key = f"{animal_folder}/{file}".replace(" ", "_")
+                yield animal_folder, os.path.join(animal_path, file), file_key
+
+
+def get_existing_urls(animal_ids, page_size=1000):
+    """Récupère les URLs déjà enregistrées dans Empreintes pour ces animaux (paginé)"""
+    existing = set()
+    if not animal_ids:
+        return existing
+    start = 0
+    while True:
+        response = call('db.select', lambda: supabase.table('Empreintes').select('image_url')
+                        .in_('animal_id', list(animal_ids))
+                        # Sans tri, PostgREST ne garantit aucun ordre : des lignes seraient sautées ou lues deux fois
+                        .order('id')
+                        # limit/offset plutôt que range() : la borne de fin de range() varie selon la version de postgrest
+                        .limit(page_size).offset(start)
+                        .execute())
+        rows = response.data or []
+        existing.update(row['image_url'] for row in rows)
+        if len(rows) < page_size:
+            return existing
+        start += page_size
+
+
+def update_database_urls(batch_size=None):
+    """
+    Enregistre dans Empreintes l'URL de chaque image locale.
+    Les IDs des espèces sont résolus en une requête, les URLs déjà présentes sont ignorées
+    (relance sans doublons) et les lignes sont insérées par lots de plusieurs lignes.
+    """
+    batch_size = batch_size or insert_batch_size
     try:
-        for animal_folder in os.listdir(local_images_folder):
-            animal_path = os.path.join(local_images_folder, animal_folder)
-
-            if os.path.isdir(animal_path):
-                # Récupérer l'ID de l'animal
-                animal_id = get_animal_id(animal_folder)
-
-                if animal_id is not None:
-                    # Pour chaque image dans le dossier
-                    for file in os.listdir(animal_path):
-                        if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                            file_path = f"{animal_folder}/{file}".replace(" ", "_")
-                            public_url = get_public_url(file_path)
-
-                            try:
-                                # Ajouter l'URL dans la table Empreintes
-                                result = supabase.table('Empreintes').insert({
-                                    "animal_id": animal_id,
-                                    "image_url": public_url
-                                }).execute()
-                                print(f"URL ajoutée pour {file_path}")
-
-                            except Exception as e:
-                                print(f"Erreur lors de l'ajout de l'URL pour {file_path}: {str(e)}")
-                else:
-                    print(f"Animal non trouvé dans la base de données: {animal_folder}")
+        images = list(iter_local_images(local_images_folder))
+        animal_ids = get_animal_ids({animal_folder for animal_folder, _, _ in images})
+
+        for animal_folder in sorted({animal_folder for animal_folder, _, _ in images} - set(animal_ids)):
+            print(f"Animal non trouvé dans la base de données: {animal_folder}")
+
+        existing_urls = get_existing_urls(set(animal_ids.values()))
+        rows = []
+        for animal_folder, _, file_key in images:
+            if animal_folder not in animal_ids:
+                continue
+            public_url = get_public_url(file_key)
+            if public_url in existing_urls:
+                continue
+            existing_urls.add(public_url)
+            rows.append({"animal_id": animal_ids[animal_folder], "image_url": public_url})
+
+        print(f"{len(rows)} URL(s) à ajouter, {len(images) - len(rows)} ignorée(s)")
+
+        inserted = 0
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            try:
+                # Ajouter les URLs dans la table Empreintes en une requête par lot
+                # (pas de nouvelle tentative : un lot inséré avant un délai dépassé le serait deux fois)
+                call('db.insert', lambda: supabase.table('Empreintes').insert(batch).execute(), retries=0)
+                inserted += len(batch)
+                print(f"{inserted}/{len(rows)} URL(s) ajoutée(s)")
+            except Exception as e:
+                print(f"Erreur lors de l'ajout du lot {start // batch_size + 1}: {str(e)}")
 
     except Exception as e:
         print(f"Erreur lors de la mise à jour de la base de données: {str(e)}")
 
 
-def upload_to_supabase(folder_path, bucket):
+def upload_file(local_file_path, file_key, bucket):
+    """Upload un fichier ; un fichier déjà présent dans le bucket est considéré comme uploadé"""
+    try:
+        with open(local_file_path, "rb") as file_data:
+            data = file_data.read()
+        call('storage.upload', lambda: supabase.storage.from_(bucket).upload(file_key, data))
+        return "uploaded"
+    except Exception as upload_error:
+        if 'Duplicate' in str(upload_error) or 'already exists' in str(upload_error):
+            return "existing"
+        print(f"Erreur lors de l'upload de {file_key}: {str(upload_error)}")
+        return "failed"
+
+
+def upload_to_supabase(folder_path, bucket, concurrency=None):
+    """Upload toutes les images locales avec un nombre borné d'uploads simultanés"""
     try:
         if not os.path.exists(folder_path):
             print(f"Le dossier {folder_path} n'existe pas")
             return
 
-        for animal_folder in os.listdir(folder_path):
-            animal_path = os.path.join(folder_path, animal_folder)
-
-            if os.path.isdir(animal_path):
-                print(f"Traitement du dossier: {animal_folder}")
-
-                for file in os.listdir(animal_path):
-                    if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                        try:
-                            local_file_path = os.path.join(animal_path, file)
-                            file_key = f"{animal_folder}/{file}".replace(" ", "_")
-
-                            with open(local_file_path, "rb") as file_data:
-                                try:
-                                    res = supabase.storage.from_(bucket).upload(file_key, file_data)
-                                    print(f"Fichier {file_key} uploadé avec succès")
-                                except Exception as upload_error:
-                                    print(f"Erreur lors de l'upload de {file_key}: {str(upload_error)}")
-
-                        except Exception as file_error:
-                            print(f"Erreur lors de la lecture de {file}: {str(file_error)}")
-                            continue
+        counts = {"uploaded": 0, "existing": 0, "failed": 0}
+        with ThreadPoolExecutor(max_workers=concurrency or upload_concurrency) as executor:
+            futures = {executor.submit(upload_file, local_file_path, file_key, bucket): file_key
+                       for _, local_file_path, file_key in iter_local_images(folder_path)}
+            for future in as_completed(futures):
+                status = future.result()
+                counts[status] += 1
+                if status == "uploaded":
+                    print(f"Fichier {futures[future]} uploadé avec succès")
+
+        print(f"Upload terminé: {counts['uploaded']} uploadé(s), {counts['existing']} déjà présent(s), "
+              f"{counts['failed']} échec(s)")
 
     except Exception as e:
         print(f"Erreur générale: {str(e)}")
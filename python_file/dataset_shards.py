@@ -0,0 +1,233 @@
+"""
+Jeu de données d'empreintes empaqueté en shards, produit par l'ETL (ETL_OUTPUT=shards).
+
+Au lieu de milliers de petits objets à télécharger un par un, les images nettoyées
+(224x224, taille d'entrée du modèle) et leurs espèces sont regroupées dans quelques
+gros fichiers lus séquentiellement, à la vitesse du disque. Deux formats :
+  - tar : archives de type WebDataset, une entrée <clé>.jpg (JPEG) et <clé>.txt (espèce)
+          par image ; lisibles par webdataset ou tarfile
+  - npy : tableaux NumPy uint8 (N, 224, 224, 3) RGB, ouverts par np.load(mmap_mode='r')
+          et utilisables sans décodage
+
+Un index (index.json) décrit chaque shard : nombre d'images et, pour chaque image, sa
+clé, son espèce, son fichier source et, pour tar, la position du JPEG dans l'archive
+(accès direct sans parcourir l'archive).
+"""
+import io
+import json
+import os
+import shutil
+import struct
+import tarfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+INDEX_FILE = "index.json"
+FORMATS = ("tar", "npy")
+
+# En-tête .npy de taille fixe (format 1.0) : réécrit avec le nombre d'images réel à la fermeture du shard
+NPY_HEADER_LENGTH = 128
+
+
+def _npy_header(shape):
+    header = repr({'descr': '|u1', 'fortran_order': False, 'shape': tuple(shape)})
+    prefix = np.lib.format.magic(1, 0) + struct.pack('<H', NPY_HEADER_LENGTH - 10)
+    return prefix + header.ljust(NPY_HEADER_LENGTH - 11).encode('latin1') + b'\n'
+
+
+class ShardWriter:
+    """
+    Écriture séquentielle d'un jeu de données en shards, par un seul thread.
+
+    Les shards sont écrits dans un dossier temporaire (<dossier>.partial) qui ne remplace
+    le dossier de destination qu'à la fermeture, index compris : un lecteur ne voit jamais
+    un jeu de données à moitié écrit.
+    """
+
+    def __init__(self, directory, image_format="tar", shard_size=1000, image_size=(224, 224)):
+        """
+        Args:
+            directory (str): Dossier du jeu de données
+            image_format (str): "tar" (JPEG) ou "npy" (pixels RGB)
+            shard_size (int): Nombre d'images par shard
+            image_size (tuple): Taille (largeur, hauteur) des images
+        """
+        if image_format not in FORMATS:
+            raise ValueError(f"Format de shard invalide: {image_format} (attendu : tar ou npy)")
+        self.directory = directory
+        self.format = image_format
+        self.shard_size = shard_size
+        self.image_size = image_size
+        self.partial_directory = f"{directory.rstrip(os.sep)}.partial"
+        shutil.rmtree(self.partial_directory, ignore_errors=True)
+        os.makedirs(self.partial_directory)
+
+        self.shards = []
+        self.count = 0
+        self.bytes = 0
+        self._file = None
+        self._tar = None
+        self._shard = None
+
+    def _open_shard(self):
+        path = f"shard-{len(self.shards):06d}.{self.format}"
+        self._file = open(os.path.join(self.partial_directory, path), 'wb')
+        if self.format == "tar":
+            self._tar = tarfile.open(fileobj=self._file, mode='w', format=tarfile.USTAR_FORMAT)
+        else:
+            width, height = self.image_size
+            self._file.write(_npy_header((self.shard_size, height, width, 3)))
+        self._shard = {"path": path, "count": 0, "samples": []}
+
+    def _close_shard(self):
+        if self.format == "tar":
+            self._tar.close()
+        else:
+            width, height = self.image_size
+            self._file.seek(0)
+            self._file.write(_npy_header((self._shard["count"], height, width, 3)))
+            self._file.seek(0, os.SEEK_END)
+        self._shard["bytes"] = self._file.tell()
+        self._file.close()
+        self.bytes += self._shard["bytes"]
+        self.shards.append(self._shard)
+        self._file = self._tar = self._shard = None
+
+    def _add_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        self._tar.addfile(info, io.BytesIO(data))
+        # Position du contenu : fin de l'archive moins le contenu, complété à un bloc de 512 octets
+        blocks = (len(data) + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE
+        return self._tar.offset - blocks * tarfile.BLOCKSIZE
+
+    def write(self, label, source, image):
+        """
+        Ajouter une image au shard courant
+
+        Args:
+            label (str): Espèce
+            source (str): Chemin de l'image d'origine
+            image: JPEG (bytes) pour tar, ou pixels RGB uint8 (hauteur, largeur, 3) pour npy
+        """
+        if self._shard is None:
+            self._open_shard()
+        key = f"{self.count:09d}"
+        sample = {"key": key, "label": label, "source": source}
+        if self.format == "tar":
+            sample["offset"] = self._add_member(f"{key}.jpg", image)
+            sample["size"] = len(image)
+            self._add_member(f"{key}.txt", label.encode('utf-8'))
+        else:
+            width, height = self.image_size
+            if image.shape != (height, width, 3) or image.dtype != np.uint8:
+                raise ValueError(f"Image {source} : {image.shape} {image.dtype}, "
+                                 f"attendu ({height}, {width}, 3) uint8")
+            self._file.write(np.ascontiguousarray(image).data)
+        self._shard["samples"].append(sample)
+        self._shard["count"] += 1
+        self.count += 1
+        if self._shard["count"] >= self.shard_size:
+            self._close_shard()
+
+    def close(self):
+        """
+        Fermer le dernier shard, écrire l'index et remplacer le dossier de destination
+
+        Returns:
+            dict: Index du jeu de données
+        """
+        if self._shard is not None:
+            self._close_shard()
+        labels = {}
+        for shard in self.shards:
+            for sample in shard["samples"]:
+                labels[sample["label"]] = labels.get(sample["label"], 0) + 1
+        index = {
+            "format": self.format,
+            "image_size": list(self.image_size),
+            "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "count": self.count,
+            "bytes": self.bytes,
+            "labels": dict(sorted(labels.items())),
+            "shards": self.shards,
+        }
+        with open(os.path.join(self.partial_directory, INDEX_FILE), 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+
+        previous = f"{self.directory.rstrip(os.sep)}.old"
+        shutil.rmtree(previous, ignore_errors=True)
+        if os.path.exists(self.directory):
+            os.replace(self.directory, previous)
+        os.replace(self.partial_directory, self.directory)
+        shutil.rmtree(previous, ignore_errors=True)
+        return index
+
+    def abort(self):
+        """Abandonner l'écriture : le dossier de destination reste inchangé."""
+        if self._file is not None:
+            self._file.close()
+            self._file = self._tar = self._shard = None
+        shutil.rmtree(self.partial_directory, ignore_errors=True)
+
+
+class ShardDataset:
+    """
+    Lecture d'un jeu de données en shards : parcours séquentiel (itération) ou accès
+    direct à une image (indexation), sans extraire les archives.
+
+    Les images sont renvoyées en JPEG (bytes) pour tar, et en vue sur les pixels RGB
+    du tableau ouvert en mémoire (np.memmap) pour npy.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE), encoding='utf-8') as f:
+            self.index = json.load(f)
+        self.format = self.index["format"]
+        self.labels = list(self.index["labels"])
+        # (shard, rang dans le shard, description) de chaque image
+        self.samples = [(shard, position, sample) for shard in self.index["shards"]
+                        for position, sample in enumerate(shard["samples"])]
+        self._maps = {}
+
+    @staticmethod
+    def is_dataset(directory):
+        """Vrai si le dossier contient un jeu de données en shards (index présent)."""
+        return bool(directory) and os.path.isfile(os.path.join(directory, INDEX_FILE))
+
+    def __len__(self):
+        return len(self.samples)
+
+    def _map(self, shard):
+        # Shard ouvert en mémoire une fois : lectures concurrentes sans verrou ni déplacement dans le fichier
+        data = self._maps.get(shard["path"])
+        if data is None:
+            path = os.path.join(self.directory, shard["path"])
+            data = np.load(path, mmap_mode='r') if self.format == "npy" else np.memmap(path, dtype=np.uint8, mode='r')
+            self._maps[shard["path"]] = data
+        return data
+
+    def _image(self, shard, position, sample):
+        data = self._map(shard)
+        if self.format == "npy":
+            return data[position]
+        return data[sample["offset"]:sample["offset"] + sample["size"]].tobytes()
+
+    def __getitem__(self, i):
+        """
+        Returns:
+            tuple: (image, espèce)
+        """
+        shard, position, sample = self.samples[i]
+        return self._image(shard, position, sample), sample["label"]
+
+    def __iter__(self):
+        """Parcourir les images dans l'ordre des shards, chaque shard lu séquentiellement."""
+        for shard in self.index["shards"]:
+            for position, sample in enumerate(shard["samples"]):
+                yield self._image(shard, position, sample), sample["label"]
@@ -1,9 +1,15 @@
 import cv2
 import numpy as np
-from supabase import create_client
-from typing import Dict, List
+from supabase_conn import call, get_supabase
+from image_utils import encode_image, resize_image
+from dataset_shards import ShardWriter
+from typing import Dict, Iterator, List, Optional, Tuple
 from datetime import datetime
+import hashlib
+import json
 import os
+import queue
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,164 +24,551 @@ class Colors:
     ENDC = '\033[0m'
     BOLD = '\033[1m'
 
+class ETLManifest:
+    """
+    Manifeste de contenu de l'ETL : pour chaque fichier source traité, sa taille et
+    son etag au moment du traitement, le chemin de destination et le hash du JPEG produit.
+    Il permet de ne retraiter que les images nouvelles ou modifiées, et de reprendre
+    une exécution interrompue. Il est sauvegardé régulièrement (écriture atomique).
+    """
+
+    def __init__(self, path: str, flush_every: int = 50):
+        self.path = path
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.files: Dict[str, Dict] = {}
+
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self.files = json.load(f).get("files", {})
+                print(f"{Colors.BLUE}Manifeste chargé: {len(self.files)} fichiers déjà traités{Colors.ENDC}")
+            except Exception as e:
+                print(f"{Colors.WARNING}⚠️  Manifeste illisible {path}: {str(e)}{Colors.ENDC}")
+
+    def get(self, source_path: str) -> Optional[Dict]:
+        with self._lock:
+            return self.files.get(source_path)
+
+    def is_unchanged(self, source_path: str, fingerprint: Dict) -> bool:
+        """Vrai si le fichier source a déjà été traité avec la même taille et le même etag."""
+        entry = self.get(source_path)
+        if entry is None:
+            return False
+        return all(entry.get(key) == fingerprint.get(key) for key in ("size", "etag"))
+
+    def record(self, source_path: str, fingerprint: Dict, destination_path: str,
+               output_hash: Optional[str]):
+        with self._lock:
+            self.files[source_path] = {
+                "size": fingerprint.get("size"),
+                "etag": fingerprint.get("etag"),
+                "destination": destination_path,
+                "output_hash": output_hash,
+                "processed_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            self._pending += 1
+            if self._pending >= self.flush_every:
+                self._save_locked()
+
+    def save(self):
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"files": self.files}, f)
+        os.replace(tmp_path, self.path)
+        self._pending = 0
+
+
 class FootprintETL:
-    def __init__(self, supabase_url: str, supabase_key: str):
-        """Initialise l'ETL avec les credentials Supabase."""
-        self.supabase = create_client(supabase_url, supabase_key)
+    def __init__(self, download_workers: Optional[int] = None,
+                 transform_workers: Optional[int] = None,
+                 upload_workers: Optional[int] = None,
+                 queue_size: Optional[int] = None,
+                 manifest_path: Optional[str] = None,
+                 incremental: Optional[bool] = None,
+                 output: Optional[str] = None,
+                 shard_dir: Optional[str] = None,
+                 shard_format: Optional[str] = None,
+                 shard_size: Optional[int] = None):
+        """Initialise l'ETL (credentials Supabase lus dans SUPABASE_URL / SUPABASE_KEY)."""
+        # Client partagé du processus (pool de connexions keep-alive), utilisé par tous les threads du pipeline
+        self.supabase = get_supabase()
 
         # Constantes
         self.SOURCE_BUCKET = "Dirty_Footprint"
         self.DESTINATION_BUCKET = "Empreintes"
         self.TARGET_SIZE = (224, 224)
 
-        # Récupération de la structure des dossiers
-        self.source_structure = self._get_bucket_structure(self.SOURCE_BUCKET)
-        print(f"\nStructure du bucket source: {self.source_structure}\n")
-
-    def _get_bucket_structure(self, bucket_name: str) -> Dict[str, List[str]]:
+        # Parallélisme du pipeline : téléchargement -> transformation -> upload
+        self.download_workers = download_workers or int(os.getenv('ETL_DOWNLOAD_WORKERS', '8'))
+        self.transform_workers = transform_workers or int(os.getenv('ETL_TRANSFORM_WORKERS', str(os.cpu_count() or 1)))
+        self.upload_workers = upload_workers or int(os.getenv('ETL_UPLOAD_WORKERS', '8'))
+        self.queue_size = queue_size or int(os.getenv('ETL_QUEUE_SIZE', '32'))
+        self.manifest_path = manifest_path or os.getenv('ETL_MANIFEST_PATH', 'etl_manifest.json')
+
+        # Mode incrémental : seules les images nouvelles ou modifiées sont retraitées.
+        # Sinon, toutes les images sont retraitées et réécrites si leur résultat a changé.
+        self.incremental = incremental if incremental is not None else \
+            os.getenv('ETL_INCREMENTAL', 'true').lower() == 'true'
+
+        # Sortie : bucket de destination (une image par objet), ou jeu de données local en shards
+        # (gros fichiers séquentiels + index) pour l'entraînement et l'évaluation
+        self.output = (output or os.getenv('ETL_OUTPUT', 'bucket')).lower()
+        if self.output not in ('bucket', 'shards'):
+            raise ValueError(f"ETL_OUTPUT invalide: {self.output} (attendu : bucket ou shards)")
+        self.shard_dir = shard_dir or os.getenv('ETL_SHARD_DIR', 'etl_dataset')
+        self.shard_format = (shard_format or os.getenv('ETL_SHARD_FORMAT', 'tar')).lower()
+        self.shard_size = shard_size or int(os.getenv('ETL_SHARD_SIZE', '1000'))
+
+        # Listing du bucket source : pagination et dossiers listés en parallèle
+        self.list_page_size = int(os.getenv('ETL_LIST_PAGE_SIZE', '100'))
+        self.list_workers = int(os.getenv('ETL_LIST_WORKERS', '4'))
+
+    def _list_paginated(self, bucket_name: str, folder: Optional[str] = None) -> Iterator[Dict]:
+        """Parcourt le contenu d'un dossier page par page."""
+        offset = 0
+        while True:
+            page = call('storage.list', lambda: self.supabase.storage.from_(bucket_name).list(folder, {
+                "limit": self.list_page_size,
+                "offset": offset,
+                "sortBy": {"column": "name", "order": "asc"},
+            }))
+            for item in page:
+                yield item
+            if len(page) < self.list_page_size:
+                return
+            offset += self.list_page_size
+
+    def _list_folders(self, bucket_name: str) -> List[str]:
+        """Liste les dossiers à la racine d'un bucket."""
+        folders = []
+        for item in self._list_paginated(bucket_name):
+            folder_name = None
+            if isinstance(item, dict):
+                if 'name' in item and '/' in item['name']:
+                    folder_name = item['name'].split('/')[0]
+                elif 'name' in item:
+                    folder_name = item['name']
+            if folder_name and folder_name not in folders:
+                folders.append(folder_name)
+        return folders
+
+    def iter_bucket_files(self, bucket_name: str) -> Iterator[Tuple[str, str, Dict]]:
         """
-        Récupère la structure complète d'un bucket.
+        Génère (dossier, chemin, empreinte taille/etag) pour chaque fichier d'un bucket.
+        Les dossiers sont listés en parallèle et les fichiers sont produits au fil de l'eau,
+        via une file bornée : le traitement commence avant la fin du listing et la mémoire
+        reste constante quelle que soit la taille du bucket.
         """
         try:
-            structure = {}
-            root_contents = self.supabase.storage.from_(bucket_name).list()
             print(f"{Colors.BLUE}Lecture du bucket {bucket_name}...{Colors.ENDC}")
+            folders = self._list_folders(bucket_name)
+        except Exception as e:
+            print(f"{Colors.FAIL}❌ Erreur lecture bucket {bucket_name}: {str(e)}{Colors.ENDC}")
+            return
+
+        if not folders:
+            return
+
+        items: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        folders_queue: queue.Queue = queue.Queue()
+        for folder_name in folders:
+            folders_queue.put(folder_name)
+        stop = threading.Event()
+        done = object()
+
+        def _put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    items.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
 
-            for item in root_contents:
-                folder_name = None
-                if isinstance(item, dict):
-                    if 'name' in item and '/' in item['name']:
-                        folder_name = item['name'].split('/')[0]
-                    elif 'name' in item:
-                        folder_name = item['name']
+        def _lister():
+            while not stop.is_set():
+                try:
+                    folder_name = folders_queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    print(f"{Colors.BLUE}Dossier trouvé: {folder_name}{Colors.ENDC}")
+                    for file_item in self._list_paginated(bucket_name, folder_name):
+                        if not isinstance(file_item, dict) or 'name' not in file_item:
+                            continue
+                        if file_item['name'] == '.emptyFolderPlaceholder':
+                            continue
+                        full_path = f"{folder_name}/{file_item['name']}"
+                        if not _put((folder_name, full_path, self._fingerprint(file_item))):
+                            return
+                except Exception as e:
+                    print(f"{Colors.WARNING}⚠️  Erreur lecture dossier {folder_name}: {str(e)}{Colors.ENDC}")
+            _put(done)
+
+        n_listers = max(1, min(self.list_workers, len(folders)))
+        for i in range(n_listers):
+            threading.Thread(target=_lister, name=f"etl-list-{i}", daemon=True).start()
 
-                if folder_name:
-                    try:
-                        folder_contents = self.supabase.storage.from_(bucket_name).list(folder_name)
-                        print(f"{Colors.BLUE}Dossier trouvé: {folder_name}{Colors.ENDC}")
+        try:
+            finished = 0
+            while finished < n_listers:
+                item = items.get()
+                if item is done:
+                    finished += 1
+                else:
+                    yield item
+        finally:
+            stop.set()
 
-                        structure[folder_name] = []
-                        for file_item in folder_contents:
-                            if isinstance(file_item, dict) and 'name' in file_item:
-                                full_path = f"{folder_name}/{file_item['name']}"
-                                structure[folder_name].append(full_path)
-                    except Exception as e:
-                        print(f"{Colors.WARNING}⚠️  Erreur lecture dossier {folder_name}: {str(e)}{Colors.ENDC}")
+    def _get_bucket_structure(self, bucket_name: str) -> Dict[str, List[str]]:
+        """
+        Récupère la structure complète d'un bucket.
+        """
+        structure: Dict[str, List[str]] = {}
+        for folder_name, full_path, _ in self.iter_bucket_files(bucket_name):
+            structure.setdefault(folder_name, []).append(full_path)
+        return structure
 
-            return structure
+    def get_source_structure(self) -> Dict[str, List[str]]:
+        """
+        Structure complète du bucket source (dossier -> chemins), en mémoire.
+        Chaque appel relit tout le bucket : run_etl() n'en a pas besoin et traite les fichiers au fil du listing.
+        """
+        return self._get_bucket_structure(self.SOURCE_BUCKET)
+
+    @staticmethod
+    def _fingerprint(file_item: Dict) -> Dict:
+        """Taille et etag d'un fichier, tels que renvoyés par storage.list()."""
+        metadata = file_item.get('metadata') or {}
+        return {
+            "size": metadata.get('size'),
+            "etag": metadata.get('eTag') or file_item.get('updated_at'),
+        }
 
+    def _download(self, source_path: str) -> Optional[bytes]:
+        """Télécharge une image du bucket source."""
+        try:
+            image_bytes = call('storage.download',
+                               lambda: self.supabase.storage.from_(self.SOURCE_BUCKET).download(source_path))
+            if not image_bytes:
+                raise Exception("Données d'image vides")
+            return image_bytes
         except Exception as e:
-            print(f"{Colors.FAIL}❌ Erreur lecture bucket {bucket_name}: {str(e)}{Colors.ENDC}")
-            return {}
+            print(f"{Colors.FAIL}❌ Erreur téléchargement {source_path}: {str(e)}{Colors.ENDC}")
+            return None
+
+    def _resize(self, source_path: str, image_bytes: bytes) -> Optional[np.ndarray]:
+        """Décode et redimensionne une image (pixels BGR à la taille d'entrée du modèle)."""
+        # Conversion et traitement
+        img_array = np.frombuffer(image_bytes, np.uint8)
+        img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+        if img is None:
+            print(f"{Colors.FAIL}❌ Erreur décodage {source_path}{Colors.ENDC}")
+            return None
+
+        # Redimensionnement
+        return resize_image(img, self.TARGET_SIZE)
+
+    def _transform(self, source_path: str, image_bytes: bytes) -> Optional[bytes]:
+        """Décode, redimensionne et réencode une image en JPEG."""
+        cleaned_img = self._resize(source_path, image_bytes)
+        if cleaned_img is None:
+            return None
+
+        # Préparation pour upload
+        data = encode_image(cleaned_img, 'jpeg', quality=95)
+
+        if data is None:
+            print(f"{Colors.FAIL}❌ Erreur conversion {source_path}{Colors.ENDC}")
+        return data
+
+    def _upload(self, destination_path: str, data: bytes, overwrite: bool = False) -> bool:
+        """Upload une image traitée dans le bucket de destination."""
+        file_options = {"content-type": "image/jpeg"}
+        if overwrite:
+            # storage3 envoie file_options tels quels en en-têtes, après son x-upsert: false par défaut
+            file_options["x-upsert"] = "true"
+        try:
+            # Sans upsert, une nouvelle tentative après un délai dépassé échouerait en doublon
+            call('storage.upload', lambda: self.supabase.storage.from_(self.DESTINATION_BUCKET).upload(
+                destination_path,
+                data,
+                file_options
+            ), retries=None if overwrite else 0)
+            print(f"{Colors.GREEN}✅ Succès: {destination_path}{Colors.ENDC}")
+            return True
+        except Exception as e:
+            print(f"{Colors.FAIL}❌ Erreur upload {destination_path}: {str(e)}{Colors.ENDC}")
+            return False
+
+    @staticmethod
+    def _destination_path(source_path: str, animal_folder: str) -> str:
+        return f"{animal_folder}/{os.path.basename(source_path)}"
 
     def process_single_footprint(self, source_path: str, animal_folder: str) -> bool:
         """Traite une seule image d'empreinte."""
         try:
             print(f"{Colors.BLUE}🔄 Traitement: {source_path}{Colors.ENDC}", end='\r')
 
-            # Lecture de l'image
-            try:
-                image_bytes = self.supabase.storage.from_(self.SOURCE_BUCKET).download(source_path)
-                if not image_bytes:
-                    raise Exception("Données d'image vides")
-            except Exception as e:
-                print(f"{Colors.FAIL}❌ Erreur téléchargement {source_path}: {str(e)}{Colors.ENDC}")
+            image_bytes = self._download(source_path)
+            if image_bytes is None:
                 return False
 
-            # Conversion et traitement
-            img_array = np.frombuffer(image_bytes, np.uint8)
-            img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-            if img is None:
-                print(f"{Colors.FAIL}❌ Erreur décodage {source_path}{Colors.ENDC}")
+            data = self._transform(source_path, image_bytes)
+            if data is None:
                 return False
 
-            # Redimensionnement
-            cleaned_img = cv2.resize(img, self.TARGET_SIZE, interpolation=cv2.INTER_AREA)
-
-            # Préparation pour upload
-            is_success, buffer = cv2.imencode(".jpg", cleaned_img, [
-                cv2.IMWRITE_JPEG_QUALITY, 95,
-                cv2.IMWRITE_JPEG_OPTIMIZE, 1
-            ])
-
-            if not is_success:
-                print(f"{Colors.FAIL}❌ Erreur conversion {source_path}{Colors.ENDC}")
-                return False
-
-            # Upload
-            destination_path = f"{animal_folder}/{os.path.basename(source_path)}"
-            try:
-                self.supabase.storage.from_(self.DESTINATION_BUCKET).upload(
-                    destination_path,
-                    buffer.tobytes(),
-                    {"content-type": "image/jpeg"}
-                )
-                print(f"{Colors.GREEN}✅ Succès: {destination_path}{Colors.ENDC}")
-                return True
-            except Exception as e:
-                print(f"{Colors.FAIL}❌ Erreur upload {destination_path}: {str(e)}{Colors.ENDC}")
-                return False
+            return self._upload(self._destination_path(source_path, animal_folder), data)
 
         except Exception as e:
             print(f"{Colors.FAIL}❌ Erreur générale {source_path}: {str(e)}{Colors.ENDC}")
             return False
 
+    def _list_destination(self, animal_folder: str) -> set:
+        """Noms des fichiers déjà présents dans le dossier du bucket de destination."""
+        try:
+            return {item['name'] for item in self._list_paginated(self.DESTINATION_BUCKET, animal_folder)
+                    if isinstance(item, dict) and 'name' in item}
+        except Exception as e:
+            print(f"{Colors.WARNING}⚠️  Erreur lecture destination {animal_folder}: {str(e)}{Colors.ENDC}")
+            return set()
+
+    def _start_stage(self, name: str, n_workers: int, handler, in_queue: queue.Queue,
+                     out_queue: Optional[queue.Queue], out_workers: int,
+                     results: queue.Queue) -> List[threading.Thread]:
+        """
+        Démarre les threads d'une étape du pipeline. Chaque élément est passé à handler,
+        qui renvoie l'élément pour l'étape suivante ou un tuple résultat (folder, succès).
+        Le dernier thread à terminer propage l'arrêt à l'étape suivante.
+        """
+        remaining = [n_workers]
+        lock = threading.Lock()
+
+        def _worker():
+            while True:
+                item = in_queue.get()
+                if item is None:
+                    break
+                try:
+                    output = handler(item)
+                except Exception as e:
+                    print(f"{Colors.FAIL}❌ Erreur générale {item[1]}: {str(e)}{Colors.ENDC}")
+                    output = None
+                if output is None:
+                    results.put((item[0], False))
+                elif out_queue is None:
+                    results.put((item[0], output))
+                else:
+                    out_queue.put(output)
+
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and out_queue is not None:
+                for _ in range(out_workers):
+                    out_queue.put(None)
+
+        threads = [threading.Thread(target=_worker, name=f"etl-{name}-{i}", daemon=True)
+                   for i in range(n_workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
     def run_etl(self) -> Dict:
-        """Execute l'ETL complet."""
+        """
+        Execute l'ETL complet sous forme de pipeline : listing, téléchargements,
+        transformations et uploads s'exécutent en parallèle, reliés par des files bornées.
+        Le traitement des premières images commence pendant que le listing se poursuit.
+        En mode incrémental, seules les images absentes du manifeste ou dont la taille/etag
+        a changé sont retraitées ; les images déjà présentes dans le bucket de destination
+        mais inconnues du manifeste y sont ajoutées sans être retraitées.
+        Avec la sortie en shards (ETL_OUTPUT=shards), toutes les images sont retraitées et
+        empaquetées dans un nouveau jeu de données local, sans écrire dans le bucket ni le manifeste.
+        """
         stats = {
             "date_execution": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             "total_processed": 0,
             "total_success": 0,
             "total_failed": 0,
+            "total_skipped": 0,
+            "skipped_by_reason": {"unchanged": 0, "already_in_destination": 0, "identical_output": 0},
             "by_folder": {}
         }
 
+        writer = None
         try:
-            print(f"\n{Colors.HEADER}=== Démarrage de l'ETL ==={Colors.ENDC}")
+            if self.output == "shards":
+                writer = ShardWriter(self.shard_dir, self.shard_format, self.shard_size, self.TARGET_SIZE)
+                mode = f"shards {self.shard_format} dans {self.shard_dir}"
+            else:
+                mode = "incrémental" if self.incremental else "complet"
+            print(f"\n{Colors.HEADER}=== Démarrage de l'ETL (mode {mode}) ==={Colors.ENDC}")
+
+            manifest = ETLManifest(self.manifest_path) if writer is None else None
+            results: queue.Queue = queue.Queue()
+            download_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+            transform_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+            upload_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+
+            def _download_step(item):
+                folder, source_path, fingerprint = item
+                image_bytes = self._download(source_path)
+                return None if image_bytes is None else (folder, source_path, fingerprint, image_bytes)
+
+            def _transform_step(item):
+                folder, source_path, fingerprint, image_bytes = item
+                if writer is not None and writer.format == "npy":
+                    # Shards npy : pixels RGB sans compression, utilisables sans décodage
+                    pixels = self._resize(source_path, image_bytes)
+                    data = None if pixels is None else cv2.cvtColor(pixels, cv2.COLOR_BGR2RGB)
+                else:
+                    data = self._transform(source_path, image_bytes)
+                return None if data is None else (folder, source_path, fingerprint, data)
+
+            def _upload_step(item):
+                folder, source_path, fingerprint, data = item
+                destination_path = self._destination_path(source_path, folder)
+                output_hash = hashlib.md5(data).hexdigest()
+                previous = manifest.get(source_path)
+
+                # Source modifiée mais résultat identique : rien à uploader
+                if previous is not None and previous.get("output_hash") == output_hash:
+                    manifest.record(source_path, fingerprint, destination_path, output_hash)
+                    return "identical_output"
+
+                if not self._upload(destination_path, data, overwrite=previous is not None or not self.incremental):
+                    return None
+                manifest.record(source_path, fingerprint, destination_path, output_hash)
+                return True
 
-            if not self.source_structure:
-                print(f"{Colors.WARNING}⚠️ Aucun dossier trouvé dans le bucket source{Colors.ENDC}")
-                return stats
+            def _pack_step(item):
+                folder, source_path, fingerprint, data = item
+                writer.write(folder, source_path, data)
+                return True
 
-            # Traitement par dossier
-            for folder, files in self.source_structure.items():
-                print(f"\n{Colors.BOLD}--- Traitement du dossier {folder} ---{Colors.ENDC}")
-                stats["by_folder"][folder] = {"processed": 0, "success": 0, "failed": 0}
+            # Les shards sont écrits séquentiellement, par un seul thread
+            output_workers = self.upload_workers if writer is None else 1
+            threads = (
+                self._start_stage("download", self.download_workers, _download_step,
+                                  download_queue, transform_queue, self.transform_workers, results)
+                + self._start_stage("transform", self.transform_workers, _transform_step,
+                                    transform_queue, upload_queue, output_workers, results)
+                + (self._start_stage("upload", self.upload_workers, _upload_step, upload_queue, None, 0, results)
+                   if writer is None else
+                   self._start_stage("pack", 1, _pack_step, upload_queue, None, 0, results))
+            )
+
+            def _record_result(folder, success):
+                if success == "identical_output":
+                    stats["total_skipped"] += 1
+                    stats["skipped_by_reason"]["identical_output"] += 1
+                    stats["by_folder"][folder]["skipped"] += 1
+                    return
+                stats["total_processed"] += 1
+                stats["by_folder"][folder]["processed"] += 1
+                if success:
+                    stats["total_success"] += 1
+                    stats["by_folder"][folder]["success"] += 1
+                else:
+                    stats["total_failed"] += 1
+                    stats["by_folder"][folder]["failed"] += 1
+
+            # Alimentation du pipeline au fil du listing
+            submitted = 0
+            received = 0
+            existing_by_folder: Dict[str, set] = {}
+            for folder, file_path, fingerprint in self.iter_bucket_files(self.SOURCE_BUCKET):
+                if folder not in stats["by_folder"]:
+                    print(f"\n{Colors.BOLD}--- Traitement du dossier {folder} ---{Colors.ENDC}")
+                    stats["by_folder"][folder] = {"processed": 0, "success": 0, "failed": 0, "skipped": 0}
+
+                reason = None
+                if self.incremental and writer is None:
+                    if manifest.is_unchanged(file_path, fingerprint):
+                        reason = "unchanged"
+                    elif manifest.get(file_path) is None:
+                        if folder not in existing_by_folder:
+                            existing_by_folder[folder] = self._list_destination(folder)
+                        if os.path.basename(file_path) in existing_by_folder[folder]:
+                            # Déjà traité avant l'existence du manifeste : on l'adopte tel quel
+                            manifest.record(file_path, fingerprint,
+                                            self._destination_path(file_path, folder), None)
+                            reason = "already_in_destination"
+
+                if reason is not None:
+                    stats["total_skipped"] += 1
+                    stats["skipped_by_reason"][reason] += 1
+                    stats["by_folder"][folder]["skipped"] += 1
+                    continue
+
+                download_queue.put((folder, file_path, fingerprint))
+                submitted += 1
+
+                # Agrégation des résultats déjà disponibles
+                while True:
+                    try:
+                        _record_result(*results.get_nowait())
+                        received += 1
+                    except queue.Empty:
+                        break
 
-                for file_path in files:
-                    stats["total_processed"] += 1
-                    stats["by_folder"][folder]["processed"] += 1
+            for _ in range(self.download_workers):
+                download_queue.put(None)
 
-                    if self.process_single_footprint(file_path, folder):
-                        stats["total_success"] += 1
-                        stats["by_folder"][folder]["success"] += 1
-                    else:
-                        stats["total_failed"] += 1
-                        stats["by_folder"][folder]["failed"] += 1
+            if not stats["by_folder"]:
+                print(f"{Colors.WARNING}⚠️ Aucun dossier trouvé dans le bucket source{Colors.ENDC}")
 
-                # Affichage des stats du dossier
+            # Agrégation des résultats restants
+            for _ in range(submitted - received):
+                _record_result(*results.get())
+
+            for thread in threads:
+                thread.join()
+            if writer is None:
+                manifest.save()
+            else:
+                index = writer.close()
+                writer = None
+                stats["shards"] = {"directory": self.shard_dir, "format": index["format"],
+                                   "count": len(index["shards"]), "images": index["count"], "bytes": index["bytes"]}
+
+            # Affichage des stats par dossier
+            for folder, folder_stats in stats["by_folder"].items():
                 print(f"\n{Colors.BOLD}Résultats {folder}:{Colors.ENDC}")
-                print(f"  Traités: {stats['by_folder'][folder]['processed']}")
-                print(f"  Succès: {Colors.GREEN}{stats['by_folder'][folder]['success']}{Colors.ENDC}")
-                print(f"  Échecs: {Colors.FAIL}{stats['by_folder'][folder]['failed']}{Colors.ENDC}")
+                print(f"  Traités: {folder_stats['processed']}")
+                print(f"  Succès: {Colors.GREEN}{folder_stats['success']}{Colors.ENDC}")
+                print(f"  Échecs: {Colors.FAIL}{folder_stats['failed']}{Colors.ENDC}")
+                print(f"  Ignorés: {folder_stats['skipped']}")
 
             # Stats finales
             print(f"\n{Colors.HEADER}=== Fin de l'ETL ==={Colors.ENDC}")
             print(f"Total traité: {stats['total_processed']}")
             print(f"Succès: {Colors.GREEN}{stats['total_success']}{Colors.ENDC}")
             print(f"Échecs: {Colors.FAIL}{stats['total_failed']}{Colors.ENDC}")
+            print(f"Ignorés: {stats['total_skipped']} "
+                  f"(inchangés: {stats['skipped_by_reason']['unchanged']}, "
+                  f"déjà présents: {stats['skipped_by_reason']['already_in_destination']}, "
+                  f"résultat identique: {stats['skipped_by_reason']['identical_output']})")
+            if "shards" in stats:
+                print(f"Shards: {stats['shards']['count']} ({stats['shards']['images']} images, "
+                      f"{stats['shards']['bytes'] / 1e6:.1f} Mo) dans {self.shard_dir}")
 
             return stats
 
         except Exception as e:
             print(f"{Colors.FAIL}❌ Erreur critique: {str(e)}{Colors.ENDC}")
+            if writer is not None:
+                writer.abort()
             return stats
 
 # Exemple d'utilisation
 if __name__ == "__main__":
 
-    supabase_url = os.getenv('SUPABASE_URL')
-    supabase_key = os.getenv('SUPABASE_KEY')
-
-    etl = FootprintETL(supabase_url, supabase_key)
+    etl = FootprintETL()
     stats = etl.run_etl()
\ No newline at end of file
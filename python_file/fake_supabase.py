@@ -0,0 +1,276 @@
+"""
+Supabase local de substitution, pour les benchmarks et les essais hors ligne.
+
+Serveur HTTP qui répond comme Supabase aux seuls appels faits par l'application, de
+sorte que le vrai client (supabase-py, httpx, keep-alive, délais) soit exercé :
+  - auth     POST /auth/v1/token?grant_type=password|refresh_token, /auth/v1/signup, /auth/v1/logout,
+             GET /auth/v1/user, /auth/v1/.well-known/jwks.json (aucune clé : jetons HS256)
+  - storage  POST|PUT /storage/v1/object/<bucket>/<chemin> (doublon refusé sans x-upsert)
+  - tables   GET /rest/v1/Animaux (13 espèces), GET|POST /rest/v1/<table> (en mémoire ; filtres
+             eq/lt/gt/in, order, limit, offset et upsert sur on_conflict, comme PostgREST)
+
+Les jetons sont des JWT HS256 signés avec --jwt-secret (SUPABASE_JWT_SECRET de l'application),
+valables --token-ttl secondes ; un refresh token n'est utilisable qu'une fois. Une latence
+réseau peut être simulée.
+
+Usage :
+    python fake_supabase.py [--port 54321] [--latency-ms 20]
+    SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_KEY=<clé affichée> python app.py
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+SPECIES = ["Renard", "Loup", "Raton laveur", "Lynx", "Ours", "Castor", "Chat", "Chien",
+           "Coyote", "Ecureuil", "Lapin", "Puma", "Rat"]
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def make_jwt(payload, secret):
+    """Signer un JWT HS256 (format des jetons Supabase)."""
+    header = _b64(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
+    body = _b64(json.dumps(payload).encode())
+    signature = hmac.new(secret.encode(), f"{header}.{body}".encode(), hashlib.sha256).digest()
+    return f"{header}.{body}.{_b64(signature)}"
+
+
+class FakeSupabase:
+    """État en mémoire du substitut : utilisateurs, objets stockés et tables."""
+
+    def __init__(self, jwt_secret="fake-supabase-secret", latency_ms=0.0, token_ttl=3600):
+        self.jwt_secret = jwt_secret
+        self.latency = latency_ms / 1000
+        self.token_ttl = token_ttl
+        self.anon_key = make_jwt({"role": "anon", "iss": "supabase"}, jwt_secret)
+        self.users = {}
+        self.refresh_tokens = {}
+        self.objects = {}
+        self.tables = {"Animaux": [
+            {"id": i + 1, "Espèce": name, "Card": f"https://cards.example/{name}.png",
+             "Fun fact": f"Le {name} laisse des empreintes reconnaissables."}
+            for i, name in enumerate(SPECIES)
+        ]}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def user(self, email):
+        with self.lock:
+            if email not in self.users:
+                self.users[email] = {
+                    "id": str(uuid.uuid5(uuid.NAMESPACE_URL, email)), "aud": "authenticated",
+                    "role": "authenticated", "email": email, "app_metadata": {"provider": "email"},
+                    "user_metadata": {}, "created_at": datetime.now(timezone.utc).isoformat(),
+                }
+            return self.users[email]
+
+    def session(self, user):
+        now = int(time.time())
+        token = make_jwt({"sub": user["id"], "email": user["email"], "aud": "authenticated",
+                          "role": "authenticated", "iat": now, "exp": now + self.token_ttl}, self.jwt_secret)
+        refresh_token = uuid.uuid4().hex
+        with self.lock:
+            self.refresh_tokens[refresh_token] = user["email"]
+        return {"access_token": token, "token_type": "bearer", "expires_in": self.token_ttl,
+                "expires_at": now + self.token_ttl, "refresh_token": refresh_token, "user": user}
+
+    def verify(self, token):
+        """Utilisateur d'un jeton d'accès signé par ce substitut et non expiré, sinon None."""
+        try:
+            header, body, signature = token.split('.')
+            expected = hmac.new(self.jwt_secret.encode(), f"{header}.{body}".encode(), hashlib.sha256).digest()
+            payload = json.loads(base64.urlsafe_b64decode(body + '=' * (-len(body) % 4)))
+        except ValueError:
+            return None
+        if not hmac.compare_digest(_b64(expected), signature) or payload.get('exp', 0) < time.time():
+            return None
+        return self.users.get(payload.get('email'))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=None):
+        data = b'' if body is None else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _handle(self, method):
+        state = self.state
+        with state.lock:
+            state.requests += 1
+        if state.latency:
+            time.sleep(state.latency)
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = unquote(url.path)
+        # Toujours lire le corps (postgrest en envoie un même en GET) : la connexion reste réutilisable
+        body = self._body()
+
+        if path.startswith('/auth/v1/'):
+            return self._auth(path[len('/auth/v1/'):], query, body)
+        if path.startswith('/storage/v1/object/') and method in ('POST', 'PUT'):
+            return self._store(path[len('/storage/v1/object/'):], body, method)
+        if path.startswith('/rest/v1/'):
+            return self._table(path[len('/rest/v1/'):], method, query, body)
+        return self._reply(404, {"message": f"Route inconnue: {method} {path}"})
+
+    def _auth(self, route, query, body):
+        state = self.state
+        payload = json.loads(body or b'{}')
+        if route == 'token' and query.get('grant_type') == ['password']:
+            if not payload.get('password'):
+                return self._reply(400, {"error": "invalid_grant", "error_description": "Invalid login credentials"})
+            return self._reply(200, state.session(state.user(payload['email'])))
+        if route == 'token' and query.get('grant_type') == ['refresh_token']:
+            with state.lock:
+                email = state.refresh_tokens.pop(payload.get('refresh_token'), None)
+            if email is None:
+                return self._reply(400, {"error": "invalid_grant",
+                                         "error_description": "Invalid Refresh Token: Already Used"})
+            return self._reply(200, state.session(state.user(email)))
+        if route == 'user':
+            user = state.verify(self.headers.get('Authorization', '').removeprefix('Bearer '))
+            if user is None:
+                return self._reply(401, {"code": 401, "msg": "invalid JWT"})
+            return self._reply(200, user)
+        if route == '.well-known/jwks.json':
+            return self._reply(200, {"keys": []})
+        if route == 'signup':
+            return self._reply(200, state.session(state.user(payload['email'])))
+        if route == 'logout':
+            return self._reply(204)
+        return self._reply(404, {"message": f"Route auth inconnue: {route}"})
+
+    def _store(self, key, body, method):
+        state = self.state
+        upsert = method == 'PUT' or self.headers.get('x-upsert', '').lower() == 'true'
+        with state.lock:
+            if key in state.objects and not upsert:
+                return self._reply(400, {"statusCode": "409", "error": "Duplicate",
+                                         "message": "The resource already exists"})
+            # Seule la taille est conservée : le substitut ne doit pas grossir pendant un benchmark
+            state.objects[key] = len(body)
+        return self._reply(200, {"Key": key})
+
+    @staticmethod
+    def _select(rows, query):
+        """Appliquer les filtres PostgREST simples : col=eq.v, col=lt.v, col=gt.v, col=in.(a,b), order=col.desc, limit=n, offset=n."""
+        tests = {'eq': lambda a, b: a == b, 'lt': lambda a, b: a < b, 'gt': lambda a, b: a > b}
+        for column, values in query.items():
+            if column in ('select', 'order', 'limit', 'offset', 'on_conflict'):
+                continue
+            operator, _, value = values[0].partition('.')
+            if operator == 'in':
+                accepted = {item.strip('"') for item in value.strip('()').split(',')}
+                rows = [row for row in rows if str(row.get(column)) in accepted]
+            elif operator in tests:
+                rows = [row for row in rows
+                        if row.get(column) is not None and tests[operator](str(row.get(column)), value)]
+        for order in reversed(query.get('order', [''])[0].split(',')):
+            if order:
+                column, _, direction = order.partition('.')
+                rows = sorted(rows, key=lambda row: str(row.get(column)), reverse=direction.startswith('desc'))
+        if 'offset' in query:
+            rows = rows[int(query['offset'][0]):]
+        if 'limit' in query:
+            rows = rows[:int(query['limit'][0])]
+        return rows
+
+    def _table(self, table, method, query, body):
+        state = self.state
+        with state.lock:
+            rows = state.tables.setdefault(table, [])
+            if method == 'GET':
+                return self._reply(200, self._select(list(rows), query))
+            if method == 'POST':
+                inserted = json.loads(body or b'[]')
+                inserted = inserted if isinstance(inserted, list) else [inserted]
+                if 'on_conflict' in query and 'ignore-duplicates' in self.headers.get('Prefer', ''):
+                    column = query['on_conflict'][0]
+                    known = {row.get(column) for row in rows}
+                    inserted = [row for row in inserted if row.get(column) not in known]
+                rows.extend(inserted)
+                if 'return=minimal' in self.headers.get('Prefer', ''):
+                    return self._reply(201)
+                return self._reply(201, inserted)
+        return self._reply(405, {"message": f"Méthode non supportée: {method}"})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Connexions keep-alive fermées par l'application à son arrêt : rien à signaler
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(port=54321, host='127.0.0.1', jwt_secret="fake-supabase-secret", latency_ms=0.0, token_ttl=3600):
+    """
+    Créer le serveur du substitut (à démarrer avec serve_forever)
+
+    Returns:
+        tuple: (ThreadingHTTPServer, FakeSupabase)
+    """
+    state = FakeSupabase(jwt_secret=jwt_secret, latency_ms=latency_ms, token_ttl=token_ttl)
+    handler = type('FakeSupabaseHandler', (_Handler,), {'state': state})
+    server = _Server((host, port), handler)
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Latence ajoutée à chaque requête")
+    parser.add_argument('--jwt-secret', default="fake-supabase-secret")
+    parser.add_argument('--token-ttl', type=int, default=3600, help="Durée de validité des jetons d'accès (s)")
+    args = parser.parse_args()
+
+    server, state = serve(args.port, args.host, args.jwt_secret, args.latency_ms, args.token_ttl)
+    print(f"Supabase de substitution sur http://{args.host}:{server.server_port}", flush=True)
+    print(f"SUPABASE_KEY={state.anon_key}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
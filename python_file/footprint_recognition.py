@@ -1,30 +1,40 @@
-import torch
-import torch.nn as nn
-import torchvision.transforms as transforms
-from PIL import Image
 import io
+import json
 import os
+import threading
 from supabase_conn import supabase
+from species_catalog import SpeciesCatalog
+from image_utils import INPUT_SIZE, decode_to_tensor, open_image
+from metrics import INFERENCE_BATCH_SIZE, SCAN_ERRORS, SCAN_STAGE_SECONDS
 import random
 import hashlib
 
+# torch et torchvision (plusieurs secondes d'import) ne sont importés qu'au chargement
+# du modèle ou au premier prétraitement : importer ce module reste rapide
+
 
 class FootprintRecognition:
     def __init__(self):
         """
-        Initialiser le modèle de reconnaissance de traces sans dépendance au fichier .pth
+        Initialiser le modèle de reconnaissance de traces.
+        Tant qu'aucun fichier .pth n'est chargé (load_model), les prédictions sont simulées.
+        L'évènement `ready` est levé par warm_up(), une fois le modèle chargé et échauffé.
         """
         self.class_names = self._load_class_names()
-        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.device = 'cpu'
+        self.model = None
+        self.model_version = "simulation"
+        self.model_format = None
+        self.pool = None
+        self.ready = threading.Event()
 
-        # Définir les transformations d'image standard pour PyTorch
-        self.transform = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
+        # Sortie : les k espèces les plus probables, probabilités calibrées par mise à l'échelle
+        # de température (softmax(logits / T), T ajustée par convert_model.py --fit-temperature)
+        self.top_k = max(1, int(os.getenv('PREDICTION_TOP_K', '3')))
+        self.temperature = float(os.getenv('MODEL_TEMPERATURE', '1.0'))
 
-        print("Modèle factice initialisé avec succès.")
+        # Catalogue des espèces en mémoire (évite une requête Supabase par prédiction)
+        self.catalog = SpeciesCatalog(supabase)
 
     def _load_class_names(self):
         """
@@ -51,120 +61,504 @@ class FootprintRecognition:
             "Rat"
         ]
 
-    def preprocess_image(self, image_bytes):
+    @staticmethod
+    def _configure_threads():
         """
-        Prétraiter l'image pour qu'elle soit compatible avec le modèle
+        Fixer le nombre de threads utilisés par PyTorch sur CPU.
+        TORCH_NUM_THREADS (défaut : nombre de CPU) règle le parallélisme intra-opération,
+        TORCH_INTEROP_THREADS (défaut : 1) le parallélisme entre opérations.
+        """
+        import torch
+
+        num_threads = int(os.getenv('TORCH_NUM_THREADS', str(os.cpu_count() or 1)))
+        interop_threads = int(os.getenv('TORCH_INTEROP_THREADS', '1'))
+        torch.set_num_threads(num_threads)
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # Ne peut être appelé qu'une fois, avant tout travail parallèle
+            pass
+
+    def load_model(self, model_path, model_format=None):
+        """
+        Charger le modèle une seule fois, en mode évaluation : state_dict (.pth), TorchScript
+        (.pt, dont la variante int8) ou ONNX (.onnx), produits par convert_model.py
 
         Args:
-            image_bytes (bytes): Image en format bytes
+            model_path (str): Chemin vers le fichier du modèle
+            model_format (str, optional): Format du fichier (MODEL_FORMAT, déduit de l'extension par défaut)
 
         Returns:
-            torch.Tensor: Image prétraitée
+            bool: True si le modèle a été chargé, False si on reste en mode simulé
+        """
+        if not model_path or not os.path.exists(model_path):
+            print(f"Fichier modèle introuvable ({model_path}), utilisation du modèle factice.")
+            return False
+
+        import torch
+
+        self._configure_threads()
+
+        model_format = resolve_model_format(model_path, model_format)
+        model, self.model_version, num_classes = load_artifact(model_path, model_format)
+        if num_classes != len(self.class_names):
+            raise ValueError(f"Le modèle prédit {num_classes} classes, {len(self.class_names)} attendues")
+        # Seul le state_dict peut être placé sur GPU ; les artefacts exportés sont faits pour le CPU
+        if model_format == 'state_dict' and torch.cuda.is_available():
+            self.device = torch.device('cuda')
+        else:
+            self.device = torch.device('cpu')
+        self.model = model.to(self.device)
+        self.model_format = model_format
+
+        print(f"Modèle {model_format} chargé depuis {model_path} (version {self.model_version}).")
+        return True
+
+    def attach_pool(self, pool):
+        """
+        Déléguer les passes avant à un pool de processus d'inférence (voir inference_pool.py)
+
+        Args:
+            pool (InferencePool): Pool démarré, ou None pour revenir à l'inférence en processus
+        """
+        self.pool = pool
+
+    def _image_to_tensor(self, image_bytes, out=None):
+        """
+        Décoder et transformer une image en tenseur (3, 224, 224)
+
+        Args:
+            image_bytes (bytes | file): Image en format bytes, ou flux binaire positionné au début
+            out (torch.Tensor, optional): Emplacement préalloué à remplir (ligne d'un batch)
+
+        Returns:
+            torch.Tensor: Image prétraitée, sans dimension de batch
         """
         try:
-            img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-            img_tensor = self.transform(img)
-            img_tensor = img_tensor.unsqueeze(0)  # Ajouter dimension de batch
-            return img_tensor.to(self.device)
+            return decode_to_tensor(image_bytes, out=out)
         except Exception as e:
             print(f"Erreur lors du prétraitement de l'image: {e}")
+            SCAN_ERRORS.inc(stage='preprocess')
             # Retourner un tenseur vide en cas d'erreur
-            return torch.zeros((1, 3, 224, 224)).to(self.device)
+            if out is None:
+                import torch
 
-    def predict(self, image_bytes):
+                return torch.zeros((3, 224, 224))
+            return out.zero_()
+
+    def _preprocess_batch(self, images, failed=None):
         """
-        Simuler une prédiction d'animal à partir de l'image de trace
+        Prétraiter toutes les images directement dans un unique tenseur (N, 3, 224, 224)
 
         Args:
-            image_bytes (bytes): Image de la trace
+            images (list): Images en format bytes, ou flux binaires positionnés au début
+            failed (list, optional): Reçoit les indices des images non décodables (laissées à zéro)
+        """
+        import torch
+
+        batch = torch.empty((len(images), 3, 224, 224), dtype=torch.float32)
+        for i, image_bytes in enumerate(images):
+            try:
+                decode_to_tensor(image_bytes, out=batch[i])
+            except Exception as e:
+                # Une image illisible n'empêche pas l'analyse des autres images du batch
+                print(f"Erreur lors du prétraitement de l'image: {e}")
+                SCAN_ERRORS.inc(stage='preprocess')
+                batch[i].zero_()
+                if failed is not None:
+                    failed.append(i)
+        return batch
+
+    def _simulate_batch(self, images, failed=None):
+        """
+        Prédictions simulées d'un batch ; chaque image est d'abord décodée, comme avec le modèle
+
+        Args:
+            images (list): Images en format bytes, ou flux binaires positionnés au début
+            failed (list, optional): Reçoit les indices des images non décodables
+        """
+        predictions = []
+        for i, image_bytes in enumerate(images):
+            try:
+                open_image(image_bytes)
+            except Exception as e:
+                # Une image corrompue est refusée même sans modèle : pas de résultat inventé
+                print(f"Erreur lors du prétraitement de l'image: {e}")
+                SCAN_ERRORS.inc(stage='preprocess')
+                if failed is not None:
+                    failed.append(i)
+            if hasattr(image_bytes, 'seek'):
+                image_bytes.seek(0)
+            predictions.append(self._simulate_prediction(image_bytes))
+        return predictions
+
+    def preprocess_image(self, image_bytes):
+        """
+        Prétraiter l'image pour qu'elle soit compatible avec le modèle
+
+        Args:
+            image_bytes (bytes): Image en format bytes
 
         Returns:
-            dict: Résultat de la prédiction avec animal, confiance et info
+            torch.Tensor: Image prétraitée
         """
-        try:
-            # Générer un index basé sur le hash de l'image pour obtenir une prédiction stable
+        img_tensor = self._image_to_tensor(image_bytes)
+        img_tensor = img_tensor.unsqueeze(0)  # Ajouter dimension de batch
+        return img_tensor.to(self.device)
+
+    def _simulate_prediction(self, image_bytes):
+        """
+        Prédiction simulée, stable pour une même image (utilisée sans fichier modèle)
+
+        Returns:
+            tuple: (indices des k classes, probabilités), par probabilité décroissante
+        """
+        # Générer un index basé sur le hash de l'image pour obtenir une prédiction stable
+        if hasattr(image_bytes, 'read'):
+            # Flux d'un upload : hash par blocs, sans charger l'image en mémoire
+            hash_obj = hashlib.md5()
+            for chunk in iter(lambda: image_bytes.read(64 * 1024), b''):
+                hash_obj.update(chunk)
+        else:
             hash_obj = hashlib.md5(image_bytes)
-            hash_val = int(hash_obj.hexdigest(), 16)
-            random.seed(hash_val)
+        hash_val = int(hash_obj.hexdigest(), 16)
+        rng = random.Random(hash_val)
 
-            # Choisir un animal basé sur le hash
-            predicted_class_index = hash_val % len(self.class_names)
-            confidence = 0.7 + (hash_val % 300) / 1000  # Entre 0.7 et 1.0
+        # Choisir un animal basé sur le hash, puis répartir le reste entre d'autres espèces
+        predicted_class_index = hash_val % len(self.class_names)
+        confidence = 0.7 + (hash_val % 300) / 1000  # Entre 0.7 et 1.0
+        others = rng.sample([i for i in range(len(self.class_names)) if i != predicted_class_index],
+                            min(self.top_k, len(self.class_names)) - 1)
+        remaining = 1 - confidence
+        confidences = [confidence]
+        for _ in others:
+            remaining /= 2
+            confidences.append(remaining)
+        return [predicted_class_index] + others, confidences
 
-            # Récupérer le nom de l'animal
-            animal_name = self.class_names[predicted_class_index]
+    def _top_k(self, logits):
+        """
+        Probabilités calibrées et k meilleures classes de chaque image, en une opération pour tout le batch
 
-            # Récupérer les informations de l'animal depuis Supabase
-            animal_info = self._get_animal_info(animal_name)
+        Args:
+            logits (torch.Tensor): Sorties du modèle (N, nombre de classes)
 
-            return {
-                "animal": animal_name,
-                "confidence": confidence,
-                "card_url": animal_info.get("Card", ""),
-                "fun_fact": animal_info.get("Fun fact", "")
-            }
-        except Exception as e:
-            print(f"Erreur lors de la prédiction: {e}")
-            # En cas d'erreur, retourner une valeur par défaut
-            return {
-                "animal": "Renard",  # Animal par défaut
-                "confidence": 0.7,
-                "card_url": "",
-                "fun_fact": "Impossible d'analyser cette trace, mais les renards sont connus pour leur intelligence et leur adaptabilité."
-            }
+        Returns:
+            list: Pour chaque image, tuple (indices des k classes, probabilités)
+        """
+        import torch
 
-    def _get_animal_info(self, animal_name):
+        probabilities = torch.softmax(logits.float() / self.temperature, dim=1)
+        confidences, indices = probabilities.topk(min(self.top_k, probabilities.shape[1]), dim=1)
+        return list(zip(indices.tolist(), confidences.tolist()))
+
+    def _run_model(self, batch):
         """
-        Récupérer les informations de l'animal depuis Supabase
+        Une seule passe avant pour tout le batch
 
         Args:
-            animal_name (str): Nom de l'animal
+            batch (torch.Tensor): Tenseur (N, 3, 224, 224)
 
         Returns:
-            dict: Informations de l'animal
+            torch.Tensor: Logits (N, nombre de classes), sur CPU
         """
-        try:
-            print(f"Tentative de récupération des informations pour l'animal: {animal_name}")
+        import torch
+
+        with torch.inference_mode():
+            return self.model(batch.to(self.device)).cpu()
+
+    def _build_results(self, predictions):
+        """
+        Construire les résultats d'un batch : les fiches de toutes les espèces proposées
+        sont lues en un seul accès au catalogue
+
+        Args:
+            predictions (list): Pour chaque image, tuple (indices des k classes, probabilités)
+
+        Returns:
+            list: Un dictionnaire de résultat par image
+        """
+        names = {self.class_names[index] for indices, _ in predictions for index in indices}
+        infos = self.catalog.get_many(names)
+
+        results = []
+        for indices, confidences in predictions:
+            candidates = []
+            for index, confidence in zip(indices, confidences):
+                animal_name = self.class_names[index]
+                animal_info = self._animal_info(animal_name, infos.get(animal_name))
+                candidates.append({
+                    "animal": animal_name,
+                    "confidence": confidence,
+                    "card_url": animal_info.get("Card", ""),
+                    "fun_fact": animal_info.get("Fun fact", "")
+                })
+            # L'espèce la plus probable reste au premier niveau ; "predictions" donne les k propositions
+            results.append({**candidates[0], "predictions": candidates})
+        return results
+
+    @staticmethod
+    def _default_result(error=None):
+        # En cas d'erreur, retourner une valeur par défaut (avec la cause dans "error")
+        result = {
+            "animal": "Renard",  # Animal par défaut
+            "confidence": 0.7,
+            "card_url": "",
+            "fun_fact": "Impossible d'analyser cette trace, mais les renards sont connus pour leur intelligence et leur adaptabilité."
+        }
+        return {**result, "predictions": [result], "error": error or "Analyse impossible"}
+
+    def predict_batch(self, images):
+        """
+        Prédire l'animal pour plusieurs images en une seule passe avant
 
-            # Recherche exacte par nom d'espèce
-            response = supabase.table("Animaux").select("*").eq("Espèce", animal_name).execute()
+        Args:
+            images (list): Liste d'images en format bytes, ou de flux binaires positionnés au début
 
-            if response.data and len(response.data) > 0:
-                print(f"Animal trouvé dans la base de données: {response.data[0]['Espèce']}")
-                return response.data[0]
+        Returns:
+            list: Un dictionnaire de résultat par image, dans le même ordre ; résultat par défaut,
+            avec la cause dans "error", pour une image non décodable ou si la prédiction échoue
+        """
+        if not images:
+            return []
+        INFERENCE_BATCH_SIZE.observe(len(images))
+        failed = []
+        try:
+            if self.model is None and self.pool is None:
+                with SCAN_STAGE_SECONDS.time(stage='inference'):
+                    predictions = self._simulate_batch(images, failed)
             else:
-                print(f"Animal '{animal_name}' non trouvé, utilisation d'un animal par défaut")
+                with SCAN_STAGE_SECONDS.time(stage='preprocess'):
+                    batch = self._preprocess_batch(images, failed)
+                with SCAN_STAGE_SECONDS.time(stage='inference'):
+                    logits = self.pool.run(batch) if self.pool is not None else self._run_model(batch)
+                    predictions = self._top_k(logits)
 
-                # Récupérer n'importe quel animal comme fallback
-                response = supabase.table("Animaux").select("*").limit(1).execute()
-                if response.data and len(response.data) > 0:
-                    return response.data[0]
+            with SCAN_STAGE_SECONDS.time(stage='species_lookup'):
+                results = self._build_results(predictions)
+        except Exception as e:
+            print(f"Erreur lors de la prédiction: {e}")
+            SCAN_ERRORS.inc(len(images), stage='inference')
+            return [self._default_result() for _ in images]
+        for i in failed:
+            results[i] = self._default_result("Image illisible")
+        return results
+
+    def warm_up(self):
+        """
+        Faire passer une image factice par tout le chemin de prédiction (import de torch,
+        décodeur JPEG, allocations, première passe avant), puis lever `ready`.
+        Sans modèle chargé, rien n'est à échauffer : seul `ready` est levé.
+        """
+        try:
+            if self.model is not None or self.pool is not None:
+                from PIL import Image
+
+                buffer = io.BytesIO()
+                Image.new('RGB', INPUT_SIZE).save(buffer, format='JPEG')
+                batch = self._preprocess_batch([buffer.getvalue()])
+                if self.pool is not None:
+                    self.pool.run(batch)
                 else:
-                    return {
-                        "Card": "",
-                        "Fun fact": f"Le {animal_name} est un animal fascinant que l'on peut rencontrer dans nos forêts."
-                    }
+                    self._run_model(batch)
         except Exception as e:
-            print(f"Erreur lors de la récupération des infos de l'animal: {e}")
+            print(f"Erreur lors de l'échauffement du modèle: {e}")
+        finally:
+            self.ready.set()
+
+    def predict(self, image_bytes):
+        """
+        Prédire l'animal à partir de l'image de trace
+
+        Args:
+            image_bytes (bytes): Image de la trace
+
+        Returns:
+            dict: Résultat de la prédiction avec animal, confiance et info, et les k
+            espèces les plus probables dans "predictions"
+        """
+        return self.predict_batch([image_bytes])[0]
+
+    @staticmethod
+    def _animal_info(animal_name, animal_info):
+        """
+        Informations de l'animal lues dans le catalogue, ou fiche générique
+
+        Args:
+            animal_name (str): Nom de l'animal
+            animal_info (dict | None): Fiche du catalogue
+
+        Returns:
+            dict: Informations de l'animal
+        """
+        if animal_info is None:
             return {
                 "Card": "",
                 "Fun fact": f"Le {animal_name} est un animal fascinant que l'on peut rencontrer dans nos forêts."
             }
+        return animal_info
+
+
+def build_resnet(state_dict):
+    """
+    Reconstruire l'architecture ResNet correspondant à un state_dict
+    (type de bloc, nombre de blocs par couche et nombre de classes)
+
+    Args:
+        state_dict (dict): Poids produits par convert_model.py
+
+    Returns:
+        ResNet: Modèle non initialisé de la bonne forme
+    """
+    from torchvision.models.resnet import ResNet, Bottleneck, BasicBlock
+
+    block = Bottleneck if any(key.startswith('layer1.0.conv3.') for key in state_dict) else BasicBlock
+    layers = []
+    for i in range(1, 5):
+        prefix = f'layer{i}.'
+        block_ids = {key[len(prefix):].split('.')[0] for key in state_dict if key.startswith(prefix)}
+        layers.append(len(block_ids))
+    num_classes = state_dict['fc.weight'].shape[0]
+    return ResNet(block, layers, num_classes=num_classes)
+
+
+def load_resnet(model_path):
+    """
+    Charger un state_dict sur CPU et construire le modèle en mode évaluation
+
+    Args:
+        model_path (str): Chemin vers le fichier .pth
+
+    Returns:
+        tuple: (modèle, version du modèle dérivée du contenu du fichier)
+    """
+    import torch
+
+    state_dict = torch.load(model_path, map_location='cpu', weights_only=True)
+    # Les modèles entraînés avec DataParallel préfixent les clés par 'module.'
+    state_dict = {key.replace('module.', '', 1) if key.startswith('module.') else key: value
+                  for key, value in state_dict.items()}
+
+    model = build_resnet(state_dict)
+    model.load_state_dict(state_dict)
+    model.eval()
+    for param in model.parameters():
+        param.requires_grad_(False)
+
+    with open(model_path, 'rb') as f:
+        version = hashlib.md5(f.read()).hexdigest()[:12]
+    return model, version
+
+
+MODEL_FORMATS = ('state_dict', 'torchscript', 'onnx')
+_EXTENSION_FORMATS = {'.pth': 'state_dict', '.pt': 'torchscript', '.ts': 'torchscript', '.onnx': 'onnx'}
+
+# Métadonnées enregistrées par convert_model.py dans les archives TorchScript
+TORCHSCRIPT_METADATA = 'wildaware.json'
+
+
+def resolve_model_format(model_path, model_format=None):
+    """
+    Format d'un fichier modèle : argument, puis MODEL_FORMAT, puis extension du fichier
+
+    Returns:
+        str: 'state_dict', 'torchscript' ou 'onnx'
+    """
+    model_format = (model_format or os.getenv('MODEL_FORMAT', 'auto')).lower()
+    if model_format == 'auto':
+        model_format = _EXTENSION_FORMATS.get(os.path.splitext(model_path)[1].lower(), 'state_dict')
+    if model_format not in MODEL_FORMATS:
+        raise ValueError(f"Format de modèle inconnu: {model_format} (attendu : auto, {', '.join(MODEL_FORMATS)})")
+    return model_format
+
+
+class OnnxModel:
+    """Session ONNX Runtime appelable comme un module PyTorch : batch (N, 3, 224, 224) -> logits."""
+
+    def __init__(self, model_path):
+        import torch
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("Le format onnx nécessite le paquet onnxruntime (pip install onnxruntime)")
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.num_classes = self.session.get_outputs()[0].shape[-1]
+
+    def to(self, device):
+        return self
+
+    def __call__(self, batch):
+        import torch
+
+        logits = self.session.run(None, {self.input_name: batch.detach().cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+def load_artifact(model_path, model_format=None):
+    """
+    Charger un modèle sur CPU, quel que soit son format, prêt pour l'inférence
+
+    Args:
+        model_path (str): Chemin vers le fichier du modèle
+        model_format (str, optional): Format du fichier (voir resolve_model_format)
+
+    Returns:
+        tuple: (modèle appelable, version du modèle, nombre de classes)
+    """
+    import torch
+
+    model_format = resolve_model_format(model_path, model_format)
+    if model_format == 'state_dict':
+        model, version = load_resnet(model_path)
+        return model, version, model.fc.out_features
+
+    with open(model_path, 'rb') as f:
+        version = hashlib.md5(f.read()).hexdigest()[:12]
+
+    if model_format == 'onnx':
+        model = OnnxModel(model_path)
+        return model, version, model.num_classes
+
+    # TorchScript : torchvision n'est pas nécessaire pour charger le modèle
+    extra_files = {TORCHSCRIPT_METADATA: ''}
+    model = torch.jit.load(model_path, map_location='cpu', _extra_files=extra_files)
+    metadata = json.loads(extra_files[TORCHSCRIPT_METADATA] or '{}')
+    if metadata.get('quantized_engine'):
+        # Les poids int8 sont empaquetés pour un moteur précis (x86, fbgemm, qnnpack)
+        torch.backends.quantized.engine = metadata['quantized_engine']
+    model.eval()
+    num_classes = metadata.get('num_classes')
+    if num_classes is None:
+        with torch.inference_mode():
+            num_classes = model(torch.zeros((1, 3) + INPUT_SIZE)).shape[1]
+    return model, version, num_classes
 
 
 # Créer directement une instance globale, sans dépendre du chargement du modèle
 footprint_model = FootprintRecognition()
 
 
-def initialize_model(model_path=None):
+def initialize_model(model_path=None, start_refresh=True):
     """
-    Fonction fictive pour maintenir la compatibilité avec le reste du code
-    Retourne simplement l'instance déjà créée
+    Charger les poids du modèle s'ils sont disponibles, précharger le catalogue
+    des espèces et démarrer son rafraîchissement en arrière-plan.
+    L'échauffement (warm_up) est fait à part, dans le processus qui servira les requêtes.
 
     Args:
-        model_path (str, optional): Ignoré
+        model_path (str, optional): Chemin vers le modèle (animal_footprint_model_safe.pth ou artefact exporté)
+        start_refresh (bool): Démarrer le thread de rafraîchissement du catalogue ;
+            False lorsqu'il doit être démarré après un fork (gunicorn preload_app)
     """
+    try:
+        footprint_model.load_model(model_path)
+    except Exception as e:
+        print(f"Erreur lors du chargement du modèle ({e}), utilisation du modèle factice.")
+    footprint_model.catalog.warm()
+    if start_refresh:
+        footprint_model.catalog.start_background_refresh()
     return footprint_model
-    # Le modèle est déjà initialisé, donc on ne fait rien ici
-    print(f"L'initialisation du modèle a été ignorée, utilisation du modèle factice.")
-    return footprint_model
\ No newline at end of file
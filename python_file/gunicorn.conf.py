@@ -0,0 +1,100 @@
+"""
+Configuration gunicorn de production.
+
+L'application est préchargée dans le processus maître (preload_app). Avec plusieurs
+workers, le modèle PyTorch et le catalogue des espèces y sont chargés une seule fois
+(when_ready), puis partagés par copie sur écriture entre les workers ; avec un seul worker,
+le modèle est chargé en arrière-plan par le worker, qui sert les pages sans attendre
+(WILDAWARE_PRELOAD_MODEL pour forcer l'un ou l'autre). Les threads d'arrière-plan sont
+démarrés après le fork, dans chaque worker (post_fork).
+
+Avec plusieurs workers, /metrics agrège les métriques de tous les workers via un dossier
+partagé (METRICS_DIR, par défaut un dossier temporaire propre à ce maître, vidé au
+démarrage et supprimé à l'arrêt) : une collecte Prometheus n'atteint qu'un worker.
+
+Rechargement sans coupure :
+    kill -HUP <pid maître>   relance les workers avec la configuration relue
+    kill -USR2 <pid maître>  démarre un nouveau maître avec le nouveau code
+                             (puis kill -TERM sur l'ancien une fois le nouveau prêt)
+"""
+import gc
+import os
+import shutil
+import tempfile
+
+
+def _available_cpus():
+    """CPU réellement disponibles, en tenant compte du quota cgroup (limite cpus de docker-compose)."""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return max(1, int(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+
+
+# Les modules de l'application sont importés à plat depuis python_file/
+pythonpath = os.path.dirname(os.path.abspath(__file__))
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', str(_available_cpus())))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+preload_app = True
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '0'))
+accesslog = '-'
+
+# Lus par app.py au chargement, avant le fork
+os.environ.setdefault('WILDAWARE_DEFER_SERVICES', 'true')
+# Charger le modèle dans le maître seulement s'il est partagé par plusieurs workers
+preload_model = os.getenv('WILDAWARE_PRELOAD_MODEL', 'true' if workers > 1 else 'false').lower() == 'true'
+# Répartir les CPU entre workers plutôt que de laisser chaque worker utiliser tous les cœurs
+os.environ.setdefault('TORCH_NUM_THREADS', str(max(1, _available_cpus() // workers)))
+# Métriques agrégées entre workers (voir metrics.MultiProcessExporter)
+# Dossier par défaut propre à ce maître (supprimé à l'arrêt) ; un METRICS_DIR fourni est conservé
+temporary_metrics_dir = workers > 1 and 'METRICS_DIR' not in os.environ
+if temporary_metrics_dir:
+    os.environ['METRICS_DIR'] = os.path.join(tempfile.gettempdir(), f"wildaware-metrics-{os.getpid()}")
+
+
+def on_starting(server):
+    # Les instantanés d'une exécution précédente ne décrivent pas ces workers
+    metrics_dir = os.getenv('METRICS_DIR')
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir)
+
+
+def on_exit(server):
+    if temporary_metrics_dir:
+        shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+
+def when_ready(server):
+    if preload_model:
+        from app import preload_model as load
+        load()
+
+
+def pre_fork(server, worker):
+    # Sortir les objets du maître du suivi du GC : les collectes des workers ne
+    # réécrivent plus leurs en-têtes, les pages restent partagées
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import sys
+    from app import start_background_services
+
+    # Modèle préchargé par le maître : torch est déjà importé, fixer ses threads dans le worker.
+    # Sinon torch est importé et configuré par le chargement en arrière-plan du worker
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(int(os.environ['TORCH_NUM_THREADS']))
+    start_background_services()
+    server.log.info(f"Worker {worker.pid}: services d'arrière-plan démarrés")
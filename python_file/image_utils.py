@@ -0,0 +1,181 @@
+import io
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# Taille d'entrée du modèle et normalisation ImageNet
+INPUT_SIZE = (224, 224)
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+@lru_cache(maxsize=1)
+def _normalization():
+    """
+    (x / 255 - mean) / std  ==  x * scale - shift : une multiplication et une soustraction en place.
+    torch n'est importé qu'au premier prétraitement, pas à l'import du module.
+    """
+    import torch
+
+    scale = torch.tensor([1 / (255 * s) for s in STD], dtype=torch.float32).view(3, 1, 1)
+    shift = torch.tensor([m / s for m, s in zip(MEAN, STD)], dtype=torch.float32).view(3, 1, 1)
+    return scale, shift
+
+
+def open_image(image, size=INPUT_SIZE):
+    """
+    Ouvrir une image en ne décodant que la résolution nécessaire
+
+    Pour un JPEG, le mode draft demande au décodeur une réduction 1/2, 1/4 ou 1/8
+    tant que l'image reste au moins aussi grande que `size` : une photo de téléphone
+    de 12 Mpx n'est jamais décodée en pleine résolution. L'orientation EXIF est appliquée.
+    Un flux (fichier temporaire d'un upload) est décodé directement, sans copie en bytes.
+
+    Args:
+        image (bytes | file): Image encodée, ou flux binaire positionné au début de l'image
+        size (tuple): Taille minimale (largeur, hauteur) à conserver
+
+    Returns:
+        PIL.Image.Image: Image RGB orientée
+    """
+    img = Image.open(image if hasattr(image, 'read') else io.BytesIO(image))
+    img.draft('RGB', size)
+    img = ImageOps.exif_transpose(img)
+    return img.convert('RGB')
+
+
+def decode_to_tensor(image, out=None, size=INPUT_SIZE):
+    """
+    Décoder, redimensionner et normaliser une image directement dans un tenseur
+
+    Args:
+        image (bytes | file): Image encodée, ou flux binaire (voir open_image)
+        out (torch.Tensor, optional): Tenseur (3, H, W) préalloué à remplir, par ex. une ligne du batch
+        size (tuple): Taille (largeur, hauteur) d'entrée du modèle
+
+    Returns:
+        torch.Tensor: Tenseur float32 (3, H, W) normalisé
+    """
+    img = open_image(image, size).resize(size, Image.BILINEAR)
+    return pixels_to_tensor(np.array(img), out=out)
+
+
+def pixels_to_tensor(pixels, out=None):
+    """
+    Normaliser des pixels RGB déjà à la taille d'entrée du modèle (ex. shard npy de l'ETL)
+
+    Args:
+        pixels (numpy.ndarray): Image RGB uint8 (H, W, 3)
+        out (torch.Tensor, optional): Tenseur (3, H, W) préalloué à remplir
+
+    Returns:
+        torch.Tensor: Tenseur float32 (3, H, W) normalisé
+    """
+    import torch
+
+    scale, shift = _normalization()
+    if out is None:
+        out = torch.empty((3, pixels.shape[0], pixels.shape[1]), dtype=torch.float32)
+    if not pixels.flags.writeable:
+        # torch.from_numpy émet un avertissement pour un tableau en lecture seule (np.memmap d'un shard)
+        pixels = np.array(pixels)
+    out.copy_(torch.from_numpy(pixels).permute(2, 0, 1))
+    out.mul_(scale).sub_(shift)
+    return out
+
+
+# Formats de stockage des images d'utilisateurs : (extension, type MIME)
+STORAGE_FORMATS = {'jpeg': ('.jpg', 'image/jpeg'), 'webp': ('.webp', 'image/webp')}
+
+
+def resize_image(pixels, size):
+    """
+    Redimensionner une image OpenCV (BGR) avec INTER_AREA, adapté aux réductions
+
+    Args:
+        pixels (numpy.ndarray): Image (H, W, 3)
+        size (tuple): Taille (largeur, hauteur) cible
+
+    Returns:
+        numpy.ndarray: Image redimensionnée
+    """
+    import cv2
+
+    return cv2.resize(pixels, size, interpolation=cv2.INTER_AREA)
+
+
+def encode_image(pixels, image_format='jpeg', quality=95, progressive=False):
+    """
+    Encoder une image OpenCV (BGR) ; aucune métadonnée (EXIF, GPS...) n'est écrite
+
+    Args:
+        pixels (numpy.ndarray): Image (H, W, 3)
+        image_format (str): 'jpeg' ou 'webp'
+        quality (int): Qualité de compression (0-100)
+        progressive (bool): JPEG progressif (affichage par passes successives)
+
+    Returns:
+        bytes: Image encodée, ou None si l'encodage échoue
+    """
+    import cv2
+
+    if image_format == 'webp':
+        is_success, buffer = cv2.imencode('.webp', pixels, [cv2.IMWRITE_WEBP_QUALITY, quality])
+    else:
+        is_success, buffer = cv2.imencode('.jpg', pixels, [
+            cv2.IMWRITE_JPEG_QUALITY, quality,
+            cv2.IMWRITE_JPEG_OPTIMIZE, 1,
+            cv2.IMWRITE_JPEG_PROGRESSIVE, int(progressive)
+        ])
+    return buffer.tobytes() if is_success else None
+
+
+def fit_within(size, max_side):
+    """Taille (largeur, hauteur) réduite pour que le plus grand côté ne dépasse pas max_side."""
+    width, height = size
+    ratio = min(1.0, max_side / max(width, height))
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+
+def normalize_image(image, max_side=1600, image_format='jpeg', quality=85, thumbnail_side=0):
+    """
+    Préparer une photo pour le stockage : orientation EXIF appliquée, plus grand côté borné,
+    réencodage (JPEG progressif ou WebP) sans métadonnées, miniature optionnelle
+
+    Le décodage JPEG est réduit (mode draft) à la plus petite échelle couvrant max_side.
+
+    Args:
+        image (bytes | file): Image encodée, ou flux binaire positionné au début
+        max_side (int): Plus grand côté de l'image stockée, en pixels
+        image_format (str): 'jpeg' ou 'webp' (voir STORAGE_FORMATS)
+        quality (int): Qualité de compression (0-100)
+        thumbnail_side (int): Plus grand côté de la miniature ; 0 pour ne pas en produire
+
+    Returns:
+        dict: {"data": bytes, "thumbnail": bytes | None, "content_type": str, "size": (largeur, hauteur)}
+    """
+    import cv2
+
+    if hasattr(image, 'read'):
+        image.seek(0)
+    with Image.open(image if hasattr(image, 'read') else io.BytesIO(image)) as header:
+        # Taille utile, dans l'orientation du fichier (avant rotation EXIF)
+        target = fit_within(header.size, max_side)
+    if hasattr(image, 'read'):
+        image.seek(0)
+    img = open_image(image, target)
+
+    pixels = cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR)
+    size = fit_within(img.size, max_side)
+    if size != img.size:
+        pixels = resize_image(pixels, size)
+    data = encode_image(pixels, image_format, quality, progressive=True)
+    if data is None:
+        raise ValueError(f"Échec de l'encodage {image_format}")
+
+    thumbnail = None
+    if thumbnail_side:
+        thumbnail = encode_image(resize_image(pixels, fit_within(size, thumbnail_side)), image_format, quality,
+                                 progressive=True)
+    return {"data": data, "thumbnail": thumbnail, "content_type": STORAGE_FORMATS[image_format][1], "size": size}
@@ -0,0 +1,274 @@
+import atexit
+import multiprocessing as mp
+import os
+import queue
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+
+IMAGE_SHAPE = (3, 224, 224)
+
+
+def _worker_main(model_path, shm_name, max_batch_size, num_threads, conn):
+    """
+    Boucle d'un processus d'inférence : attache la mémoire partagée, charge le modèle
+    une fois, puis traite les batchs annoncés sur le pipe jusqu'à recevoir None.
+    """
+    torch.set_num_threads(num_threads)
+    from footprint_recognition import load_artifact
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        buffer = np.ndarray((max_batch_size,) + IMAGE_SHAPE, dtype=np.float32, buffer=shm.buf)
+        model, _, _ = load_artifact(model_path)
+        conn.send("ready")
+
+        while True:
+            size = conn.recv()
+            if size is None:
+                break
+            try:
+                # Le tenseur partage la mémoire du buffer : aucune copie ni sérialisation
+                batch = torch.from_numpy(buffer[:size])
+                with torch.inference_mode():
+                    logits = model(batch)
+                conn.send(logits.numpy().copy())
+            except Exception as e:
+                conn.send(e)
+    finally:
+        del buffer
+        shm.close()
+        conn.close()
+
+
+class _Worker:
+    def __init__(self, ctx, model_path, max_batch_size, num_threads):
+        self.stopped = False
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=int(np.prod((max_batch_size,) + IMAGE_SHAPE)) * 4)
+        self.buffer = np.ndarray((max_batch_size,) + IMAGE_SHAPE, dtype=np.float32, buffer=self.shm.buf)
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(model_path, self.shm.name, max_batch_size, num_threads, child_conn),
+            daemon=True)
+        try:
+            self.process.start()
+        except Exception:
+            child_conn.close()
+            self._release()
+            raise
+        child_conn.close()
+
+    def wait_ready(self, timeout):
+        """
+        Attendre que le processus ait chargé le modèle
+
+        Raises:
+            RuntimeError: Le processus ne répond pas dans le délai ou s'est arrêté pendant le chargement ;
+                il est alors arrêté et son segment de mémoire partagée libéré
+        """
+        try:
+            ready = self.conn.poll(timeout) and self.conn.recv() == "ready"
+        except (EOFError, OSError):
+            # Processus mort pendant le chargement (pipe fermé) : attendre sa fin pour lire son code de sortie
+            ready = False
+            self.process.join(timeout=5)
+        if not ready:
+            pid, exitcode = self.process.pid, self.process.exitcode
+            self.stop()
+            cause = "délai dépassé" if exitcode is None else f"code de sortie {exitcode}"
+            raise RuntimeError(f"Le processus d'inférence {pid} n'a pas démarré ({cause})")
+
+    def _release(self):
+        self.conn.close()
+        del self.buffer
+        self.shm.close()
+        self.shm.unlink()
+
+    def stop(self):
+        """Arrêter le processus et libérer sa mémoire partagée (sans effet s'il est déjà arrêté)."""
+        if self.stopped:
+            return
+        self.stopped = True
+        try:
+            if self.process.is_alive():
+                self.conn.send(None)
+                self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join(timeout=5)
+        except (BrokenPipeError, OSError):
+            pass
+        finally:
+            self._release()
+
+
+class InferencePool:
+    """
+    Pool de processus d'inférence de longue durée, chacun avec sa propre copie du modèle.
+
+    Chaque processus possède un segment de mémoire partagée de max_batch_size images :
+    le processus appelant y écrit les tenseurs prétraités et n'échange sur le pipe que
+    la taille du batch et les logits. Un processus mort est redémarré au
+    prochain batch qui lui est attribué, ou par la surveillance périodique. Si son
+    remplaçant ne démarre pas, l'emplacement reste vacant (None dans la file des
+    processus libres) jusqu'à la tentative suivante.
+    """
+
+    def __init__(self, model_path, num_workers=None, max_batch_size=None, threads_per_worker=None,
+                 start_timeout=120, restart_interval=None):
+        """
+        Args:
+            model_path (str): Chemin vers le modèle chargé par chaque processus (voir load_artifact)
+            num_workers (int, optional): Nombre de processus (INFERENCE_WORKERS)
+            max_batch_size (int, optional): Capacité du segment partagé, en images
+            threads_per_worker (int, optional): Threads PyTorch par processus (INFERENCE_WORKER_THREADS)
+            start_timeout (float): Délai maximal de chargement du modèle par processus, en secondes
+            restart_interval (float, optional): Période de redémarrage des processus morts et des
+                emplacements vacants, en secondes (INFERENCE_RESTART_INTERVAL, 0 : désactivé)
+        """
+        self.model_path = model_path
+        self.num_workers = num_workers or int(os.getenv('INFERENCE_WORKERS', '1'))
+        self.max_batch_size = max_batch_size or int(os.getenv('INFERENCE_MAX_BATCH_SIZE', '8'))
+        self.threads_per_worker = threads_per_worker or int(os.getenv('INFERENCE_WORKER_THREADS', '1'))
+        self.start_timeout = start_timeout
+        self.restart_interval = (restart_interval if restart_interval is not None
+                                 else float(os.getenv('INFERENCE_RESTART_INTERVAL', '30')))
+        self.restarts = 0
+        self.failed_starts = 0
+
+        # 'spawn' évite d'hériter de l'état des threads OpenMP du processus parent
+        self._ctx = mp.get_context('spawn')
+        self._lock = threading.Lock()
+        self._idle = queue.Queue()
+        self._workers = []
+        self._closed = threading.Event()
+        try:
+            for _ in range(self.num_workers):
+                worker = self._start_worker()
+                self._workers.append(worker)
+                self._idle.put(worker)
+        except Exception:
+            self.close()
+            raise
+
+        atexit.register(self.close)
+        if self.restart_interval > 0:
+            threading.Thread(target=self._supervise, name="inference-pool-supervisor", daemon=True).start()
+        print(f"Pool d'inférence démarré: {self.num_workers} processus")
+
+    def _start_worker(self):
+        worker = _Worker(self._ctx, self.model_path, self.max_batch_size, self.threads_per_worker)
+        worker.wait_ready(self.start_timeout)
+        return worker
+
+    def _replace(self, worker):
+        """
+        Arrêter un processus et en démarrer un autre à sa place
+
+        Args:
+            worker (_Worker | None): Processus à remplacer, ou None pour un emplacement vacant
+
+        Raises:
+            RuntimeError: Le remplaçant n'a pas démarré ; l'ancien processus est arrêté et retiré du pool
+        """
+        with self._lock:
+            if worker is not None:
+                print(f"Processus d'inférence {worker.process.pid} arrêté, redémarrage")
+                worker.stop()
+                if worker in self._workers:
+                    self._workers.remove(worker)
+            try:
+                replacement = self._start_worker()
+            except Exception as e:
+                self.failed_starts += 1
+                raise RuntimeError(f"Redémarrage du processus d'inférence impossible: {e}") from e
+            self._workers.append(replacement)
+            self.restarts += 1
+            return replacement
+
+    def _run_chunk(self, worker, chunk):
+        size = chunk.shape[0]
+        np.copyto(worker.buffer[:size], chunk.numpy())
+        worker.conn.send(size)
+        result = worker.conn.recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def run(self, batch):
+        """
+        Exécuter une passe avant sur un processus libre
+
+        Args:
+            batch (torch.Tensor): Tenseur (N, 3, 224, 224)
+
+        Returns:
+            torch.Tensor: Logits (N, nombre de classes)
+        """
+        batch = batch.detach().to('cpu', torch.float32).contiguous()
+        worker = self._idle.get()
+        try:
+            if worker is None or not worker.process.is_alive():
+                # Si le remplacement échoue, l'emplacement est rendu vacant (None), jamais l'ancien processus
+                dead, worker = worker, None
+                worker = self._replace(dead)
+
+            outputs = []
+            for start in range(0, batch.shape[0], self.max_batch_size):
+                chunk = batch[start:start + self.max_batch_size]
+                try:
+                    outputs.append(self._run_chunk(worker, chunk))
+                except (EOFError, BrokenPipeError, ConnectionResetError):
+                    # Le processus est mort pendant le batch : on le remplace et on réessaie une fois
+                    dead, worker = worker, None
+                    worker = self._replace(dead)
+                    outputs.append(self._run_chunk(worker, chunk))
+        finally:
+            self._idle.put(worker)
+
+        return torch.from_numpy(np.concatenate(outputs))
+
+    def restart_dead_workers(self):
+        """Redémarrer les processus morts qui ne sont pas en cours d'utilisation."""
+        idle = []
+        while True:
+            try:
+                idle.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for worker in idle:
+            if worker is not None and worker.process.is_alive():
+                self._idle.put(worker)
+                continue
+            try:
+                self._idle.put(self._replace(worker))
+            except RuntimeError as e:
+                print(e)
+                self._idle.put(None)
+
+    def _supervise(self):
+        while not self._closed.wait(self.restart_interval):
+            self.restart_dead_workers()
+
+    def stats(self):
+        # Sans verrou : un redémarrage en cours ne doit pas bloquer /health
+        workers = list(self._workers)
+        return {
+            "workers": self.num_workers,
+            "alive": sum(worker.process.is_alive() for worker in workers),
+            "vacant": self.num_workers - len(workers),
+            "idle": self._idle.qsize(),
+            "restarts": self.restarts,
+            "failed_starts": self.failed_starts,
+        }
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.stop()
@@ -0,0 +1,456 @@
+"""
+Métriques au format texte Prometheus, sans dépendance.
+
+Compteurs, jauges et histogrammes avec labels, enregistrés dans un registre global et
+exposés par /metrics (voir app.py). Chaque processus a ses propres métriques. Avec
+plusieurs workers gunicorn, une collecte n'atteint qu'un worker au hasard : METRICS_DIR
+active alors le mode multiprocessus (voir MultiProcessExporter), où chaque worker écrit
+ses métriques dans ce dossier partagé et /metrics exporte l'agrégat de tous les workers.
+"""
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Bornes des histogrammes de durée (secondes) : de la milliseconde au délai d'inférence
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: labels attendus {self.labelnames}, reçus {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def snapshot(self):
+        """Valeurs courantes par clé de labels, copiées (voir MultiProcessExporter)."""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, key, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """Compteur croissant (requêtes, erreurs, accès au cache...)."""
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            return [('_total', key, (), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """Valeur instantanée, fixée directement ou lue à l'export par une fonction."""
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn, **labels):
+        """Lire la valeur au moment de l'export (profondeur de file, état du modèle...)."""
+        self._functions[self._key(labels)] = fn
+
+    @contextmanager
+    def track_in_progress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def snapshot(self):
+        values = super().snapshot()
+        for key, fn in self._functions.items():
+            try:
+                values[key] = fn()
+            except Exception:
+                continue
+        return values
+
+    def _samples(self):
+        return [('', key, (), value) for key, value in sorted(self.snapshot().items())]
+
+
+class Histogram(_Metric):
+    """Distribution de durées (ou de tailles) par intervalles cumulés."""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+            entry["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            entry["sum"] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {key: {"counts": list(entry["counts"]), "sum": entry["sum"]}
+                    for key, entry in self._values.items()}
+
+    @contextmanager
+    def time(self, **labels):
+        """Mesurer la durée du bloc `with`, même s'il lève une exception."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), entry["counts"]):
+                    cumulative += count
+                    samples.append(('_bucket', key, (('le', _format_value(bound)),), cumulative))
+                samples.append(('_sum', key, (), entry["sum"]))
+                samples.append(('_count', key, (), cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Métrique déjà enregistrée: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self):
+        """
+        Exporter toutes les métriques au format texte Prometheus (version 0.0.4)
+
+        Returns:
+            str: Corps de la réponse /metrics
+        """
+        return '\n'.join(metric.render() for metric in self.metrics()) + '\n'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MultiProcessExporter:
+    """
+    Métriques de tous les workers gunicorn, agrégées par le worker qui répond à /metrics.
+
+    Chaque worker écrit périodiquement (et à chaque collecte qu'il sert) un instantané de
+    son registre dans <dossier>/<pid>.json. À l'export, sous verrou de fichier :
+      - compteurs et histogrammes sont additionnés sur tous les processus, y compris ceux
+        qui se sont arrêtés : leurs valeurs sont reportées dans archive.json, les totaux
+        ne reculent donc jamais (redémarrage de worker, max_requests) ;
+      - les jauges ne sont exportées que pour les workers vivants, avec le label `pid`.
+    Les valeurs des autres workers ont au plus `interval` secondes de retard.
+    """
+
+    ARCHIVE_FILE = 'archive.json'
+    LOCK_FILE = '.lock'
+
+    def __init__(self, registry, directory, interval=None):
+        """
+        Args:
+            registry (Registry): Registre du processus
+            directory (str): Dossier partagé par les workers (METRICS_DIR), vidé au démarrage du maître
+            interval (float, optional): Période d'écriture de l'instantané, en secondes (METRICS_FLUSH_INTERVAL)
+        """
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval if interval is not None else float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+        self._thread = None
+        self._flush_lock = threading.Lock()
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"{pid}.json")
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.directory, self.LOCK_FILE), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def start(self):
+        """Écrire l'instantané de ce processus en continu (une fois par worker, après le fork)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self._locked():
+            # Fichier laissé par un processus arrêté qui avait le même pid
+            self._archive([self._path(os.getpid())])
+        self.flush()
+        self._thread = threading.Thread(target=self._run, name="metrics-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Écriture des métriques impossible ({self.directory}): {e}")
+
+    def flush(self):
+        """Écrire l'instantané du registre de ce processus (remplacement atomique)."""
+        snapshot = {metric.name: {"type": metric.type_name,
+                                  "values": [[list(key), value] for key, value in metric.snapshot().items()]}
+                    for metric in self.registry.metrics()}
+        path = self._path(os.getpid())
+        tmp_path = f"{path}.tmp"
+        # Écrit par le thread périodique et par les requêtes /metrics de ce processus
+        with self._flush_lock:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            print(f"Instantané de métriques illisible ({path}): {e}")
+            return None
+
+    @staticmethod
+    def _add(totals, snapshot):
+        """Additionner les compteurs et histogrammes d'un instantané dans totals (jauges ignorées)."""
+        for name, metric in snapshot.items():
+            if metric["type"] == 'gauge':
+                continue
+            values = totals.setdefault(name, {"type": metric["type"], "values": {}})["values"]
+            for key, value in metric["values"]:
+                key = tuple(key)
+                if metric["type"] == 'counter':
+                    values[key] = values.get(key, 0) + value
+                else:
+                    entry = values.setdefault(key, {"counts": [0] * len(value["counts"]), "sum": 0.0})
+                    entry["counts"] = [a + b for a, b in zip(entry["counts"], value["counts"])]
+                    entry["sum"] += value["sum"]
+
+    def _archive(self, paths):
+        """Reporter dans l'archive les compteurs et histogrammes de processus arrêtés (verrou pris)."""
+        snapshots = [(path, self._read(path)) for path in paths if os.path.exists(path)]
+        if not snapshots:
+            return
+        archive_path = os.path.join(self.directory, self.ARCHIVE_FILE)
+        totals = {}
+        archived = self._read(archive_path)
+        if archived:
+            self._add(totals, archived)
+        for _, snapshot in snapshots:
+            if snapshot:
+                self._add(totals, snapshot)
+        tmp_path = f"{archive_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._encode(totals), f)
+        os.replace(tmp_path, archive_path)
+        for path, _ in snapshots:
+            os.remove(path)
+
+    @staticmethod
+    def _encode(totals):
+        return {name: {"type": metric["type"], "values": [[list(key), value] for key, value in metric["values"].items()]}
+                for name, metric in totals.items()}
+
+    def render(self):
+        """
+        Exporter l'agrégat des métriques de tous les workers au format texte Prometheus
+
+        Returns:
+            str: Corps de la réponse /metrics
+        """
+        self.flush()
+        totals = {}
+        gauges = {}
+        with self._locked():
+            snapshots = {}
+            for name in os.listdir(self.directory):
+                stem, extension = os.path.splitext(name)
+                if extension == '.json' and stem.isdigit():
+                    snapshots[int(stem)] = os.path.join(self.directory, name)
+            self._archive([path for pid, path in snapshots.items() if not _pid_alive(pid)])
+            archived = self._read(os.path.join(self.directory, self.ARCHIVE_FILE))
+            if archived:
+                self._add(totals, archived)
+            for pid, path in sorted(snapshots.items()):
+                snapshot = self._read(path) if os.path.exists(path) else None
+                if not snapshot:
+                    continue
+                self._add(totals, snapshot)
+                for name, metric in snapshot.items():
+                    if metric["type"] == 'gauge':
+                        gauges.setdefault(name, []).append((pid, metric["values"]))
+
+        # Mise en forme par des métriques temporaires, hors du registre du processus
+        scratch = Registry()
+        lines = []
+        for metric in self.registry.metrics():
+            if isinstance(metric, Gauge):
+                per_pid = 'pid' not in metric.labelnames
+                merged = Gauge(metric.name, metric.documentation,
+                               metric.labelnames + (('pid',) if per_pid else ()), registry=scratch)
+                for pid, values in gauges.get(metric.name, []):
+                    for key, value in values:
+                        merged._values[tuple(key) + ((str(pid),) if per_pid else ())] = value
+            else:
+                if isinstance(metric, Histogram):
+                    merged = Histogram(metric.name, metric.documentation, metric.labelnames,
+                                       buckets=metric.buckets, registry=scratch)
+                else:
+                    merged = Counter(metric.name, metric.documentation, metric.labelnames, registry=scratch)
+                merged._values = dict(totals.get(metric.name, {}).get("values", {}))
+            lines.append(merged.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Mode multiprocessus (plusieurs workers gunicorn) : voir MultiProcessExporter
+EXPORTER = MultiProcessExporter(REGISTRY, os.getenv('METRICS_DIR')) if os.getenv('METRICS_DIR') else None
+
+
+def start_export():
+    """Démarrer l'écriture des métriques du processus dans METRICS_DIR (sans effet sinon)."""
+    if EXPORTER is not None:
+        EXPORTER.start()
+
+
+def render_metrics():
+    """Corps de /metrics : agrégat de tous les workers si METRICS_DIR est défini, sinon ce processus."""
+    return EXPORTER.render() if EXPORTER is not None else REGISTRY.render()
+
+# Processus qui exporte les métriques (un par worker gunicorn)
+PROCESS_INFO = Gauge('wildaware_process_info', "Processus ayant produit ces métriques", ['pid'])
+PROCESS_INFO.set_function(lambda: 1, pid=os.getpid())
+
+
+# Parcours d'une analyse (/upload-image) : read, cache_lookup, storage_enqueue, prediction_wait, total
+# côté requête ; preprocess, inference, species_lookup par batch ; storage_normalize et storage_upload
+# en arrière-plan
+SCAN_STAGE_SECONDS = Histogram('wildaware_scan_stage_seconds', "Durée de chaque étape d'une analyse", ['stage'])
+SCAN_REQUESTS = Counter('wildaware_scan_requests', "Analyses demandées, par issue", ['outcome'])
+SCAN_ERRORS = Counter('wildaware_scan_errors', "Erreurs d'analyse, par étape", ['stage'])
+SCAN_IN_FLIGHT = Gauge('wildaware_scan_in_flight', "Analyses en cours de traitement")
+PREDICTION_CACHE = Counter('wildaware_prediction_cache', "Accès au cache de prédictions", ['result'])
+INFERENCE_BATCH_SIZE = Histogram('wildaware_inference_batch_size', "Nombre d'images par passe avant",
+                                 buckets=(1, 2, 4, 8, 16, 32, 64))
+
+# Appels Supabase (voir supabase_conn.call), file d'upload et historique des analyses
+SUPABASE_CALL_SECONDS = Histogram('wildaware_supabase_call_seconds', "Durée des appels Supabase", ['operation'])
+SUPABASE_CALL_ERRORS = Counter('wildaware_supabase_call_errors',
+                               "Appels Supabase en erreur (transient, client ou rejected par le disjoncteur)",
+                               ['operation', 'reason'])
+UPLOAD_JOBS = Counter('wildaware_upload_jobs', "Uploads traités par la file, par issue", ['result'])
+SCAN_HISTORY_WRITES = Counter('wildaware_scan_history_writes',
+                              "Analyses écrites dans l'historique (written, retried ou dropped)", ['result'])
+
+# Authentification (voir auth_tokens.py) : vérification locale des jetons et appels à Supabase Auth
+AUTH_VERIFICATIONS = Counter('wildaware_auth_verifications',
+                             "Jetons d'accès vérifiés, par méthode (hs256, jwks, remote) et résultat", ['method', 'result'])
+AUTH_OPERATIONS = Counter('wildaware_auth_operations',
+                          "Appels à Supabase Auth (sign_in, sign_up, refresh, sign_out), par résultat", ['operation', 'result'])
+AUTH_SECONDS = Histogram('wildaware_auth_seconds', "Durée des vérifications de jetons et des appels à Supabase Auth",
+                         ['operation'])
+
+# Toutes les requêtes HTTP
+HTTP_REQUEST_SECONDS = Histogram('wildaware_http_request_seconds', "Durée des requêtes HTTP",
+                                 ['endpoint', 'method', 'status'])
+HTTP_IN_FLIGHT = Gauge('wildaware_http_requests_in_flight', "Requêtes HTTP en cours")
+
+
+def _reset_after_fork():
+    # Les métriques héritées du maître ne décrivent pas ce worker
+    for metric in list(REGISTRY._metrics.values()):
+        metric._lock = threading.Lock()
+        metric._values.clear()
+    PROCESS_INFO._functions.clear()
+    PROCESS_INFO.set_function(lambda: 1, pid=os.getpid())
+    if EXPORTER is not None:
+        EXPORTER._flush_lock = threading.Lock()
+        EXPORTER._thread = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
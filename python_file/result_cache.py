@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalCacheBackend:
+    """Cache LRU en mémoire, borné en nombre d'entrées, avec expiration (TTL)."""
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    """
+    Cache partagé entre répliques, stocké dans Redis (nécessite le paquet redis).
+    L'expiration est confiée à Redis ; l'éviction LRU dépend de sa politique maxmemory.
+    """
+
+    def __init__(self, url, ttl=3600, prefix="wildaware:prediction:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(self.ttl))
+
+
+class ResultCache:
+    """
+    Cache des résultats de prédiction, indexé par le hash du contenu de l'image
+    et la version du modèle : une image déjà analysée n'est ni décodée ni inférée à nouveau.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def key_for_digest(digest, model_version):
+        """Clé d'une image dont le MD5 a été calculé au fil de la lecture (voir UploadQueue.stage)."""
+        return f"{model_version}:{digest}"
+
+    def get(self, key):
+        """
+        Returns:
+            dict | None: Résultat en cache, ou None si absent (ou backend indisponible)
+        """
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            self.errors += 1
+            print(f"Erreur de lecture du cache de prédictions: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            self.errors += 1
+            print(f"Erreur d'écriture dans le cache de prédictions: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def create_result_cache():
+    """
+    Construire le cache selon la configuration :
+    RESULT_CACHE_URL (redis://...) pour un cache partagé, sinon un cache local
+    de RESULT_CACHE_SIZE entrées ; RESULT_CACHE_TTL fixe la durée de vie en secondes.
+    """
+    ttl = float(os.getenv('RESULT_CACHE_TTL', '86400'))
+    url = os.getenv('RESULT_CACHE_URL')
+    if url:
+        try:
+            return ResultCache(RedisCacheBackend(url, ttl=ttl))
+        except Exception as e:
+            print(f"Cache partagé indisponible ({e}), utilisation d'un cache local")
+    return ResultCache(LocalCacheBackend(max_entries=int(os.getenv('RESULT_CACHE_SIZE', '1024')), ttl=ttl))
@@ -0,0 +1,340 @@
+"""
+Historique des analyses de chaque utilisateur.
+
+Chaque analyse est ajoutée à une file en mémoire, puis écrite par lots par un thread
+d'arrière-plan : l'insertion n'ajoute aucune latence à /upload-image. L'identifiant
+d'une analyse est généré à l'enregistrement et croît avec le temps (horodatage en tête) :
+une nouvelle tentative d'écriture ne crée pas de doublon, et les pages de l'historique
+sont lues par clé (id < curseur) sur l'index (user_id, id), sans OFFSET, en temps
+constant quelle que soit la profondeur de la page.
+
+Deux stockages :
+  - SupabaseHistoryBackend : table Supabase (SCAN_HISTORY_TABLE), créée par la migration
+                             supabase/migrations/20261018000000_create_scans.sql
+  - SQLiteHistoryBackend   : base SQLite locale (SCAN_HISTORY_DB), pour le développement
+                             et les essais hors ligne
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from metrics import SCAN_HISTORY_WRITES
+from supabase_conn import SupabaseUnavailable, _is_transient, call
+
+# Colonnes renvoyées par l'API d'historique
+COLUMNS = ("id", "user_id", "image_path", "thumbnail_path", "animal", "confidence", "model_version",
+           "scanned_at", "recorded_at")
+
+SQLITE_SCHEMA = """
+create table if not exists scans (
+    id text primary key,
+    user_id text not null,
+    image_path text not null,
+    thumbnail_path text,
+    animal text not null,
+    confidence real not null,
+    model_version text,
+    scanned_at text not null,
+    recorded_at text not null default (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+) without rowid;
+create index if not exists scans_user_id_id on scans (user_id, id desc);
+"""
+
+
+def new_scan_id():
+    """
+    Identifiant d'analyse triable par date : microsecondes (14 chiffres hexadécimaux)
+    suivies de 18 chiffres aléatoires
+    """
+    return f"{time.time_ns() // 1000:014x}{uuid.uuid4().hex[:18]}"
+
+
+class SQLiteHistoryBackend:
+    """Historique dans une base SQLite locale (une connexion par thread, mode WAL)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        if path == ':memory:':
+            # Une base en mémoire n'existe que dans sa connexion : elle est partagée par les threads
+            self._shared = sqlite3.connect(path, check_same_thread=False)
+            self._shared_lock = threading.Lock()
+        else:
+            self._shared = None
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        with self._transaction() as connection:
+            connection.executescript(SQLITE_SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        """Connexion du thread courant, dans une transaction validée à la sortie (annulée sur exception)."""
+        if self._shared is not None:
+            with self._shared_lock, self._shared:
+                yield self._shared
+            return
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute('pragma journal_mode=wal')
+            connection.execute('pragma synchronous=normal')
+            self._local.connection = connection
+        with connection:
+            yield connection
+
+    def insert_many(self, records):
+        rows = [tuple(record.get(column) for column in COLUMNS[:-1]) for record in records]
+        with self._transaction() as connection:
+            connection.executemany(
+                f"insert or ignore into scans ({', '.join(COLUMNS[:-1])}) "
+                f"values ({', '.join('?' * (len(COLUMNS) - 1))})", rows)
+
+    def page(self, user_id, limit, before=None):
+        query = f"select {', '.join(COLUMNS)} from scans where user_id = ?"
+        params = [user_id]
+        if before:
+            query += " and id < ?"
+            params.append(before)
+        query += " order by id desc limit ?"
+        params.append(limit)
+        with self._transaction() as connection:
+            rows = connection.execute(query, params).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+
+class SupabaseHistoryBackend:
+    """Historique dans une table Supabase (voir supabase/migrations)."""
+
+    def __init__(self, client, table="Scans"):
+        self.client = client
+        self.table = table
+
+    def insert_many(self, records):
+        # Une seule requête par lot ; un id déjà présent (lot déjà écrit puis retenté) est ignoré
+        call('db.insert', lambda: self.client.table(self.table).upsert(
+            records, ignore_duplicates=True, on_conflict="id", returning="minimal").execute(), retries=0)
+
+    def page(self, user_id, limit, before=None):
+        def _select():
+            query = self.client.table(self.table).select(','.join(COLUMNS)).eq("user_id", user_id)
+            if before:
+                query = query.lt("id", before)
+            return query.order("id", desc=True).limit(limit).execute()
+
+        return call('db.select', _select).data
+
+
+class ScanHistory:
+    """
+    File d'écriture par lots de l'historique des analyses, et lecture paginée par utilisateur.
+
+    Les analyses en attente d'écriture sont gardées en mémoire (au plus `max_pending`,
+    les plus anciennes sont abandonnées au-delà) et restent visibles dans la première
+    page de l'historique de leur utilisateur jusqu'à leur écriture. Un lot en échec
+    transitoire (réseau, 429, 5xx, base verrouillée) est retenté avec un délai exponentiel,
+    au plus `max_attempts` fois ; un lot refusé (table absente, donnée invalide...) ou
+    épuisé est abandonné et recopié dans le fichier `dead_letter`. La file est vidée à
+    l'arrêt du processus.
+    """
+
+    def __init__(self, backend, batch_size=None, flush_interval=None, max_pending=None, retry_delay=None,
+                 max_attempts=None, dead_letter=None, autostart=True):
+        """
+        Args:
+            backend: SupabaseHistoryBackend ou SQLiteHistoryBackend
+            batch_size (int, optional): Nombre maximal d'analyses par écriture (SCAN_HISTORY_BATCH_SIZE)
+            flush_interval (float, optional): Attente maximale avant l'écriture d'un lot incomplet,
+                en secondes (SCAN_HISTORY_FLUSH_INTERVAL)
+            max_pending (int, optional): Nombre maximal d'analyses en attente (SCAN_HISTORY_MAX_PENDING)
+            retry_delay (float, optional): Délai avant la première nouvelle tentative, en secondes
+            max_attempts (int, optional): Nombre maximal d'écritures d'un lot (SCAN_HISTORY_MAX_ATTEMPTS)
+            dead_letter (str, optional): Fichier JSONL des analyses abandonnées (SCAN_HISTORY_DEAD_LETTER)
+            autostart (bool): Démarrer immédiatement ; sinon, appeler start() (après un fork)
+        """
+        self.backend = backend
+        self.batch_size = batch_size or int(os.getenv('SCAN_HISTORY_BATCH_SIZE', '100'))
+        self.flush_interval = (flush_interval if flush_interval is not None
+                               else float(os.getenv('SCAN_HISTORY_FLUSH_INTERVAL', '1')))
+        self.max_pending = max_pending or int(os.getenv('SCAN_HISTORY_MAX_PENDING', '10000'))
+        self.retry_delay = retry_delay if retry_delay is not None else float(os.getenv('SCAN_HISTORY_RETRY_DELAY', '1'))
+        self.max_attempts = max_attempts or int(os.getenv('SCAN_HISTORY_MAX_ATTEMPTS', '8'))
+        self.dead_letter = dead_letter or os.getenv('SCAN_HISTORY_DEAD_LETTER', 'spool/scan_history_failed.jsonl')
+
+        self._pending = deque()
+        self._writing = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+
+        if autostart:
+            self.start()
+
+    def start(self):
+        """Démarrer le thread d'écriture (une fois par processus)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._writer, name="scan-history", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, user_id, image_path, animal, confidence, model_version=None, thumbnail_path=None):
+        """
+        Ajouter une analyse à la file d'écriture, sans attendre
+
+        Returns:
+            dict: Analyse enregistrée (avec son id)
+        """
+        record = {
+            "id": new_scan_id(), "user_id": user_id, "image_path": image_path,
+            "thumbnail_path": thumbnail_path, "animal": animal, "confidence": float(confidence),
+            "model_version": model_version,
+            "scanned_at": datetime.now(timezone.utc).isoformat(timespec='microseconds'),
+        }
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                self._pending.popleft()
+                self.dropped += 1
+                SCAN_HISTORY_WRITES.inc(result='dropped')
+            self._pending.append(record)
+            if len(self._pending) in (1, self.batch_size):
+                self._cond.notify()
+        return record
+
+    def page(self, user_id, limit=20, cursor=None):
+        """
+        Page de l'historique d'un utilisateur, de la plus récente à la plus ancienne analyse
+
+        Args:
+            user_id (str): Identifiant de l'utilisateur
+            limit (int): Nombre d'analyses par page
+            cursor (str, optional): next_cursor de la page précédente
+
+        Returns:
+            dict: {"items": [...], "next_cursor": str | None}
+        """
+        # Une ligne de plus que demandé : indique s'il existe une page suivante
+        items = self.backend.page(user_id, limit + 1, before=cursor)
+        with self._cond:
+            unwritten = [dict(record, recorded_at=None) for record in (*self._writing, *self._pending)
+                         if record["user_id"] == user_id and (cursor is None or record["id"] < cursor)]
+        if unwritten:
+            known = {item["id"] for item in items}
+            items = sorted(items + [record for record in unwritten if record["id"] not in known],
+                           key=lambda item: item["id"], reverse=True)
+        has_more = len(items) > limit
+        items = items[:limit]
+        return {"items": items, "next_cursor": items[-1]["id"] if has_more else None}
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending and not self._stopping:
+                self._cond.wait()
+            # Laisser au lot le temps de se remplir, sans retarder la première analyse de plus de flush_interval
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._pending) < self.batch_size and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            self._writing = batch
+            return batch
+
+    @staticmethod
+    def _is_retryable(error):
+        """Échec passager : réseau, 429, 5xx, disjoncteur ouvert, ou base SQLite verrouillée."""
+        if isinstance(error, SupabaseUnavailable):
+            return True
+        if isinstance(error, sqlite3.OperationalError):
+            return 'locked' in str(error) or 'busy' in str(error)
+        return _is_transient(error)
+
+    def _drop(self, batch, reason):
+        """Abandonner un lot : compté dans dropped et recopié dans le fichier dead_letter."""
+        print(f"Historique des analyses : {len(batch)} analyse(s) abandonnée(s) ({reason})")
+        self.dropped += len(batch)
+        SCAN_HISTORY_WRITES.inc(len(batch), result='dropped')
+        if not self.dead_letter:
+            return
+        try:
+            directory = os.path.dirname(self.dead_letter)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.dead_letter, 'a', encoding='utf-8') as f:
+                for record in batch:
+                    f.write(json.dumps(dict(record, error=str(reason))) + '\n')
+        except OSError as e:
+            print(f"Écriture de {self.dead_letter} impossible: {e}")
+
+    def _write(self, batch):
+        attempt = 0
+        while True:
+            try:
+                self.backend.insert_many(batch)
+                self.written += len(batch)
+                SCAN_HISTORY_WRITES.inc(len(batch), result='written')
+                break
+            except Exception as e:
+                self.failed_batches += 1
+                attempt += 1
+                if not self._is_retryable(e):
+                    # Une nouvelle tentative échouerait de même (table absente, droits, donnée invalide)
+                    self._drop(batch, f"erreur non transitoire: {e}")
+                    break
+                if self._stopping or attempt >= self.max_attempts:
+                    self._drop(batch, f"{attempt} tentative(s), dernière erreur: {e}")
+                    break
+                delay = min(self.retry_delay * (2 ** (attempt - 1)), 60)
+                print(f"Échec d'écriture de {len(batch)} analyse(s) dans l'historique ({e}), "
+                      f"nouvelle tentative dans {delay:.0f}s")
+                SCAN_HISTORY_WRITES.inc(len(batch), result='retried')
+                time.sleep(delay)
+        with self._cond:
+            self._writing = []
+
+    def _writer(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+            elif self._stopping:
+                return
+
+    def close(self, timeout=5.0):
+        """Écrire les analyses en attente puis arrêter le thread d'écriture."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending) + len(self._writing)
+        return {"backend": type(self.backend).__name__, "pending": pending, "written": self.written,
+                "dropped": self.dropped, "failed_batches": self.failed_batches}
+
+
+def create_scan_history(client, autostart=True):
+    """
+    Construire l'historique selon la configuration : base SQLite locale si SCAN_HISTORY_DB
+    est défini (chemin du fichier, ou :memory:), sinon table Supabase SCAN_HISTORY_TABLE
+    """
+    path = os.getenv('SCAN_HISTORY_DB')
+    if path:
+        backend = SQLiteHistoryBackend(path)
+    else:
+        backend = SupabaseHistoryBackend(client, table=os.getenv('SCAN_HISTORY_TABLE', 'Scans'))
+    return ScanHistory(backend, autostart=autostart)
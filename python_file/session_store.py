@@ -0,0 +1,230 @@
+"""
+Sessions Flask stockées côté serveur.
+
+Le cookie ne contient plus qu'un identifiant opaque (256 bits aléatoires) au lieu de
+toute la session signée (utilisateur, URL de l'image, résultat de l'analyse...) : les
+requêtes sont plus légères et la session n'est plus sérialisée ni signée à chaque
+réponse. Les données restent sur le serveur, soit dans un cache LRU du processus,
+soit dans Redis pour les partager entre workers et répliques.
+"""
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+
+
+class LocalSessionBackend:
+    """Sessions en mémoire du processus, LRU bornée en nombre d'entrées, avec expiration."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at < time.monotonic():
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return dict(data)
+
+    def set(self, sid, data, ttl):
+        with self._lock:
+            self._entries[sid] = (time.monotonic() + ttl, dict(data))
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def touch(self, sid, ttl):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is not None:
+                self._entries[sid] = (time.monotonic() + ttl, entry[1])
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisSessionBackend:
+    """
+    Sessions partagées entre workers et répliques, stockées dans Redis (nécessite le paquet redis).
+    L'expiration est confiée à Redis. La connexion est vérifiée à la construction : from_url()
+    ne se connecte pas, un Redis injoignable ne serait sinon découvert qu'aux requêtes.
+    """
+
+    def __init__(self, url, prefix="wildaware:session:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.client.ping()
+        self.prefix = prefix
+        # Même sérialisation que les cookies Flask (tuples, bytes, dates...)
+        self.serializer = TaggedJSONSerializer()
+
+    def get(self, sid):
+        value = self.client.get(self.prefix + sid)
+        return self.serializer.loads(value) if value is not None else None
+
+    def set(self, sid, data, ttl):
+        self.client.set(self.prefix + sid, self.serializer.dumps(dict(data)), ex=int(ttl))
+
+    def touch(self, sid, ttl):
+        self.client.expire(self.prefix + sid, int(ttl))
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+
+class ServerSideSession(SecureCookieSession):
+    """Session dont seules les données restent sur le serveur, identifiée par `sid`."""
+
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.previous_sid = None
+
+    def regenerate(self):
+        """Changer d'identifiant en gardant les données (à la connexion : pas de fixation de session)."""
+        if self.sid is not None and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Interface de session Flask : le cookie porte l'identifiant, le backend les données.
+
+    Les données ne sont réécrites que si la session a été modifiée ; sinon, seule leur
+    expiration est prolongée (SESSION_REFRESH_EACH_REQUEST). Elles expirent avec le
+    cookie (PERMANENT_SESSION_LIFETIME). Si le backend est indisponible, la requête est
+    servie avec une session vide plutôt qu'en erreur.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def _valid_sid(sid):
+        return sid is not None and len(sid) == 43 and sid.replace('-', '').replace('_', '').isalnum()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not self._valid_sid(sid):
+            return ServerSideSession()
+        try:
+            data = self.backend.get(sid)
+        except Exception as e:
+            self.errors += 1
+            print(f"Erreur de lecture de la session: {e}")
+            data = None
+        if data is None:
+            self.misses += 1
+            return ServerSideSession()
+        self.hits += 1
+        return ServerSideSession(data, sid=sid)
+
+    def _delete(self, sid):
+        try:
+            self.backend.delete(sid)
+        except Exception as e:
+            self.errors += 1
+            print(f"Erreur de suppression de la session: {e}")
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if session.previous_sid is not None:
+            self._delete(session.previous_sid)
+
+        # Session vidée (déconnexion) : données et cookie supprimés
+        if not session:
+            if session.modified:
+                if session.sid is not None:
+                    self._delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+                response.vary.add("Cookie")
+            return
+
+        if not self.should_set_cookie(app, session):
+            return
+
+        ttl = app.permanent_session_lifetime.total_seconds()
+        try:
+            if session.sid is None:
+                session.sid = secrets.token_urlsafe(32)
+                self.backend.set(session.sid, session, ttl)
+            elif session.modified:
+                self.backend.set(session.sid, session, ttl)
+            else:
+                self.backend.touch(session.sid, ttl)
+        except Exception as e:
+            self.errors += 1
+            print(f"Erreur d'écriture de la session: {e}")
+            return
+
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=httponly, domain=domain, path=path, secure=secure, samesite=samesite)
+        response.vary.add("Cookie")
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
+
+
+def create_session_interface():
+    """
+    Construire l'interface de session selon la configuration :
+    SESSION_STORE_URL (redis://...) pour des sessions partagées, SESSION_STORE=memory pour
+    un cache local de SESSION_STORE_SIZE sessions (un seul worker), sinon None (cookie signé Flask)
+
+    Raises:
+        RuntimeError: Stockage Redis demandé mais inutilisable (URL absente, paquet redis manquant,
+            Redis injoignable ou refusant la connexion) :
+            un stockage local perdrait les sessions d'un worker gunicorn à l'autre
+    """
+    store = os.getenv('SESSION_STORE', 'redis' if os.getenv('SESSION_STORE_URL') else 'cookie').lower()
+    if store == 'redis':
+        url = os.getenv('SESSION_STORE_URL')
+        if not url:
+            raise RuntimeError("SESSION_STORE=redis nécessite SESSION_STORE_URL (ex. redis://redis:6379/0)")
+        try:
+            return ServerSideSessionInterface(RedisSessionBackend(url))
+        except ImportError as e:
+            raise RuntimeError("SESSION_STORE=redis nécessite le paquet redis (pip install redis)") from e
+        except Exception as e:
+            raise RuntimeError(f"Stockage des sessions Redis inutilisable (SESSION_STORE_URL): {e}") from e
+    if store == 'memory':
+        return ServerSideSessionInterface(LocalSessionBackend(max_entries=int(os.getenv('SESSION_STORE_SIZE', '10000'))))
+    if store != 'cookie':
+        raise ValueError(f"SESSION_STORE invalide: {store} (attendu : cookie, memory ou redis)")
+    return None
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from supabase_conn import call
+
+
+class SpeciesCatalog:
+    """
+    Catalogue en mémoire des espèces de la table Animaux.
+
+    Le catalogue est chargé en une seule requête, puis servi depuis la mémoire.
+    Il est invalidé après un TTL ou manuellement (invalidate) et rafraîchi en
+    arrière-plan, de sorte que le chemin /upload-image ne dépende jamais d'un
+    aller-retour réseau vers Supabase.
+    """
+
+    def __init__(self, client, table="Animaux", key_column="Espèce", ttl=None, refresh_interval=None):
+        """
+        Args:
+            client: Client Supabase utilisé pour charger la table
+            table (str): Nom de la table des espèces
+            key_column (str): Colonne servant de clé au catalogue
+            ttl (float, optional): Durée de validité du catalogue en secondes
+            refresh_interval (float, optional): Période du rafraîchissement en arrière-plan
+        """
+        self.client = client
+        self.table = table
+        self.key_column = key_column
+        self.ttl = ttl if ttl is not None else float(os.getenv('SPECIES_CACHE_TTL', '3600'))
+        self.refresh_interval = refresh_interval if refresh_interval is not None else float(
+            os.getenv('SPECIES_REFRESH_INTERVAL', str(self.ttl / 2)))
+
+        self._entries = {}
+        self._default_entry = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def version(self):
+        """Empreinte du contenu actuel du catalogue (None tant qu'il n'est pas chargé)."""
+        return self._version
+
+    @property
+    def is_loaded(self):
+        return self._version is not None
+
+    def is_stale(self):
+        return not self.is_loaded or (time.monotonic() - self._loaded_at) > self.ttl
+
+    def load(self):
+        """
+        Charger toute la table en une requête et remplacer le catalogue.
+        En cas d'erreur, l'ancien catalogue reste en place.
+
+        Returns:
+            bool: True si le chargement a réussi
+        """
+        try:
+            response = call('db.select', lambda: self.client.table(self.table).select("*").execute())
+            rows = response.data or []
+            entries = {row[self.key_column]: row for row in rows if self.key_column in row}
+            version = hashlib.md5(
+                json.dumps(rows, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+            with self._lock:
+                if version != self._version:
+                    print(f"Catalogue des espèces chargé: {len(entries)} espèces (version {version[:8]})")
+                self._entries = entries
+                self._default_entry = rows[0] if rows else None
+                self._version = version
+                self._loaded_at = time.monotonic()
+            return True
+        except Exception as e:
+            print(f"Erreur lors du chargement du catalogue des espèces: {e}")
+            return False
+
+    def warm(self):
+        """Charger le catalogue de façon synchrone (au démarrage)."""
+        return self.load()
+
+    def invalidate(self):
+        """Marquer le catalogue comme périmé : il sera rechargé en arrière-plan au prochain accès."""
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def refresh_async(self):
+        """Lancer un rechargement en arrière-plan s'il n'y en a pas déjà un en cours."""
+        if self._refreshing.is_set():
+            return
+        self._refreshing.set()
+
+        def _run():
+            try:
+                self.load()
+            finally:
+                self._refreshing.clear()
+
+        threading.Thread(target=_run, name="species-catalog-refresh", daemon=True).start()
+
+    def start_background_refresh(self):
+        """Démarrer le thread qui recharge périodiquement le catalogue."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        def _loop():
+            while not self._stop.wait(self.refresh_interval):
+                self.load()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=_loop, name="species-catalog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def get(self, name):
+        """
+        Récupérer la fiche d'une espèce sans jamais bloquer sur le réseau.
+
+        Args:
+            name (str): Nom de l'espèce
+
+        Returns:
+            dict | None: Fiche de l'espèce, une fiche par défaut si l'espèce est inconnue,
+            ou None si le catalogue n'a jamais pu être chargé
+        """
+        return self.get_many([name])[name]
+
+    def get_many(self, names):
+        """
+        Récupérer les fiches de plusieurs espèces en un seul accès à l'index en mémoire
+        (par exemple les k espèces proposées pour toutes les images d'un batch).
+
+        Args:
+            names (iterable): Noms des espèces
+
+        Returns:
+            dict: Fiche de chaque espèce (voir get), indexée par nom
+        """
+        if self.is_stale():
+            self.refresh_async()
+
+        with self._lock:
+            return {name: self._entries.get(name, self._default_entry) for name in names}
@@ -1,9 +1,143 @@
+"""
+Client Supabase partagé par l'application, l'ETL et les scripts.
+
+Un seul client (donc un seul pool de connexions HTTP keep-alive par service) est créé
+par processus, au premier accès. Les appels passent par call(), qui mesure leur latence,
+retente les erreurs transitoires avec un délai exponentiel et coupe un service après
+plusieurs échecs consécutifs (disjoncteur) : tant qu'il est ouvert, les appels échouent
+immédiatement au lieu d'immobiliser des threads Flask sur un Supabase lent.
+"""
 import os
-from supabase import create_client, Client
+import random
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
+from metrics import SUPABASE_CALL_SECONDS, SUPABASE_CALL_ERRORS
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+# Les réglages ci-dessous peuvent venir du fichier .env, lu avant l'application
+load_dotenv()
+
+# Délais maximaux par requête HTTP, par service (secondes)
+DB_TIMEOUT = float(os.getenv('SUPABASE_DB_TIMEOUT', '10'))
+STORAGE_TIMEOUT = float(os.getenv('SUPABASE_STORAGE_TIMEOUT', '30'))
+AUTH_TIMEOUT = float(os.getenv('SUPABASE_AUTH_TIMEOUT', '10'))
+
+# Nouvelles tentatives sur erreur transitoire (réseau, délai dépassé, 429, 5xx)
+RETRIES = int(os.getenv('SUPABASE_RETRIES', '2'))
+RETRY_DELAY = float(os.getenv('SUPABASE_RETRY_DELAY', '0.2'))
+
+# Disjoncteur : ouvert après N échecs transitoires consécutifs, pendant RESET secondes
+BREAKER_THRESHOLD = int(os.getenv('SUPABASE_BREAKER_THRESHOLD', '5'))
+BREAKER_RESET = float(os.getenv('SUPABASE_BREAKER_RESET', '30'))
+
+
+class SupabaseUnavailable(Exception):
+    """Levée sans appel réseau tant que le disjoncteur d'un service est ouvert."""
+
+
+class CircuitBreaker:
+    """
+    Disjoncteur d'un service Supabase (db, storage, auth).
+
+    Fermé, il laisse passer les appels. Après `threshold` échecs transitoires consécutifs,
+    il s'ouvre et refuse les appels pendant `reset_timeout` secondes, puis laisse passer
+    un seul appel d'essai (semi-ouvert) : un succès le referme, un échec le rouvre.
+    """
+
+    def __init__(self, name, threshold=None, reset_timeout=None):
+        self.name = name
+        self.threshold = threshold or BREAKER_THRESHOLD
+        self.reset_timeout = reset_timeout if reset_timeout is not None else BREAKER_RESET
+        self.state = "closed"
+        self.opened = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Un seul appel d'essai à la fois
+                self.state = "half_open"
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.threshold:
+                if self.state != "open":
+                    self.opened += 1
+                    print(f"Supabase {self.name}: disjoncteur ouvert pour {self.reset_timeout:.0f}s "
+                          f"après {self._failures} échec(s)")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
 
+# APIError de postgrest : connexion PostgREST -> Postgres perdue (PGRST000-003), et classes SQLSTATE
+# passagères (connexion, ressources, arrêt du serveur ou délai, conflit de transaction)
+TRANSIENT_SQLSTATES = ('PGRST000', 'PGRST001', 'PGRST002', 'PGRST003', '08', '53', '57', '40')
 
-def init_supabase() -> Client:
+
+def _is_transient(error):
+    """Erreur réseau, délai dépassé, 429 ou 5xx : l'appel peut être retenté."""
+    import httpx
+    from gotrue.errors import AuthRetryableError
+
+    if isinstance(error, (httpx.TransportError, AuthRetryableError)):
+        return True
+    status = getattr(error, 'status', None)
+    if status is None and isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+    if status is None and error.args and isinstance(error.args[0], dict):
+        # StorageException de storage3 : {"statusCode": ..., "error": ..., "message": ...}
+        status = error.args[0].get('statusCode')
+    code = getattr(error, 'code', None)
+    if status is None and isinstance(code, int):
+        # APIError de postgrest sur une réponse non JSON (passerelle) : code = statut HTTP
+        status = code
+    elif status is None and isinstance(code, str) and code.startswith(TRANSIENT_SQLSTATES):
+        return True
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return False
+    return status == 429 or status >= 500
+
+
+def create_supabase_client(supabase_url, supabase_key) -> "Client":
+    """
+    Créer un client Supabase avec des délais maximaux par service
+
+    Args:
+        supabase_url (str): URL du projet Supabase
+        supabase_key (str): Clé API
+
+    Returns:
+        Client: Client Supabase
+    """
+    # Import différé : le paquet supabase n'est chargé qu'à la création du client
+    from supabase import create_client
+    from supabase.lib.client_options import ClientOptions
+
+    # Options propres à chaque client : create_client() modifie les en-têtes de ses options
+    options = ClientOptions(postgrest_client_timeout=DB_TIMEOUT, storage_client_timeout=STORAGE_TIMEOUT)
+    return create_client(supabase_url, supabase_key, options)
+
+
+def _credentials():
     # Chargement des variables d'environnement
     load_dotenv(dotenv_path='.env')
 
@@ -14,10 +148,189 @@ def init_supabase() -> Client:
     # Vérification des credentials
     if not supabase_url or not supabase_key:
         raise ValueError("Credentials Supabase manquants dans le fichier .env")
+    return supabase_url, supabase_key
+
 
+def init_supabase() -> "Client":
     # Création et retour du client
-    return create_client(supabase_url, supabase_key)
+    return create_supabase_client(*_credentials())
+
+
+_client = None
+_auth_client = None
+_client_lock = threading.Lock()
+_breakers = {}
+_operations = {}
+_stats_lock = threading.Lock()
+
+
+def get_supabase() -> "Client":
+    """
+    Client Supabase partagé par toute l'application, créé au premier appel
+
+    Returns:
+        Client: Client Supabase
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = init_supabase()
+    return _client
+
+
+def get_auth_client():
+    """
+    Client d'authentification des utilisateurs, séparé du client partagé
+
+    Une connexion sur le client partagé y réinitialise les clients base de données et
+    stockage (et donc leurs connexions keep-alive) : les connexions des utilisateurs
+    passent par ce client GoTrue, sans session persistée ni rafraîchissement automatique.
+
+    Returns:
+        SyncGoTrueClient: Client GoTrue
+    """
+    global _auth_client
+    if _auth_client is None:
+        with _client_lock:
+            if _auth_client is None:
+                from gotrue import SyncGoTrueClient
+                from gotrue.http_clients import SyncClient
+
+                supabase_url, supabase_key = _credentials()
+                _auth_client = SyncGoTrueClient(
+                    url=f"{supabase_url}/auth/v1",
+                    headers={"apiKey": supabase_key, "Authorization": f"Bearer {supabase_key}"},
+                    auto_refresh_token=False,
+                    persist_session=False,
+                    http_client=SyncClient(timeout=AUTH_TIMEOUT),
+                )
+    return _auth_client
+
+
+def _breaker(service):
+    with _stats_lock:
+        if service not in _breakers:
+            _breakers[service] = CircuitBreaker(service)
+        return _breakers[service]
+
+
+def _record(operation, elapsed=None, error=False, rejected=False):
+    with _stats_lock:
+        entry = _operations.get(operation)
+        if entry is None:
+            entry = _operations[operation] = {"calls": 0, "errors": 0, "rejected": 0,
+                                              "latencies": deque(maxlen=1000)}
+        entry["calls"] += 1
+        entry["errors"] += error
+        entry["rejected"] += rejected
+        if elapsed is not None:
+            entry["latencies"].append(elapsed)
+
+
+def call(operation, fn, retries=None):
+    """
+    Exécuter un appel Supabase avec mesure de latence, nouvelles tentatives et disjoncteur
+
+    Args:
+        operation (str): Nom de l'opération, préfixé par le service : 'db.select',
+            'storage.upload', 'auth.sign_in'... (un disjoncteur par service)
+        fn (callable): Appel à exécuter, sans argument
+        retries (int, optional): Nouvelles tentatives sur erreur transitoire (SUPABASE_RETRIES) ;
+            0 pour un appel non idempotent ou déjà retenté par l'appelant
+
+    Returns:
+        Le résultat de fn()
+
+    Raises:
+        SupabaseUnavailable: Si le disjoncteur du service est ouvert
+    """
+    breaker = _breaker(operation.split('.')[0])
+    retries = RETRIES if retries is None else retries
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            _record(operation, error=True, rejected=True)
+            SUPABASE_CALL_ERRORS.inc(operation=operation, reason='rejected')
+            raise SupabaseUnavailable(f"Supabase {breaker.name} indisponible (disjoncteur ouvert)")
+
+        started = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            elapsed = time.perf_counter() - started
+            _record(operation, elapsed, error=True)
+            SUPABASE_CALL_SECONDS.observe(elapsed, operation=operation)
+            if not _is_transient(e):
+                # Le service a répondu (erreur 4xx, donnée invalide...) : il est disponible
+                SUPABASE_CALL_ERRORS.inc(operation=operation, reason='client')
+                breaker.record_success()
+                raise
+            SUPABASE_CALL_ERRORS.inc(operation=operation, reason='transient')
+            breaker.record_failure()
+            if attempt >= retries:
+                raise
+            # Délai exponentiel avec gigue, pour ne pas retenter tous en même temps
+            time.sleep(RETRY_DELAY * (2 ** attempt) * (1 + random.random()))
+            attempt += 1
+            continue
+
+        elapsed = time.perf_counter() - started
+        _record(operation, elapsed)
+        SUPABASE_CALL_SECONDS.observe(elapsed, operation=operation)
+        breaker.record_success()
+        return result
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def _at(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+
+    return {"p50": _at(0.50), "p95": _at(0.95), "p99": _at(0.99), "max": round(ordered[-1] * 1000, 3)}
+
+
+def stats():
+    """
+    Latences (ms) et erreurs par opération, état des disjoncteurs
+
+    Returns:
+        dict: {"operations": {...}, "breakers": {...}}
+    """
+    with _stats_lock:
+        return {
+            "operations": {
+                operation: {"calls": s["calls"], "errors": s["errors"], "rejected": s["rejected"],
+                            "latency_ms": _percentiles(s["latencies"])}
+                for operation, s in sorted(_operations.items())
+            },
+            "breakers": {name: {"state": b.state, "opened": b.opened} for name, b in _breakers.items()},
+        }
+
+
+def _reset_after_fork():
+    # Un worker gunicorn ne doit pas réutiliser les sockets keep-alive ouvertes par le maître
+    global _client, _auth_client, _client_lock, _stats_lock
+    _client = None
+    _auth_client = None
+    _client_lock = threading.Lock()
+    _stats_lock = threading.Lock()
+    _breakers.clear()
+    _operations.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class _LazySupabase:
+    """Relais vers le client partagé : importer `supabase` ne crée pas encore de client."""
+
+    def __getattr__(self, name):
+        return getattr(get_supabase(), name)
 
 
-# Initialisation du client Supabase
-supabase = init_supabase()
\ No newline at end of file
+# Initialisation du client Supabase (différée jusqu'au premier accès : table, storage, auth...)
+supabase = _LazySupabase()
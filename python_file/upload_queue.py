@@ -0,0 +1,372 @@
+import heapq
+import json
+import os
+import threading
+import time
+import uuid
+
+from image_utils import normalize_image
+from metrics import SCAN_STAGE_SECONDS, UPLOAD_JOBS
+from supabase_conn import call
+
+# Taille des blocs copiés d'un flux vers le spool
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadConflict(Exception):
+    """Le chemin de destination existe déjà et n'a pas été écrit par cet upload : inutile de réessayer."""
+
+
+def copy_stream(source, destination, on_chunk=None, chunk_size=CHUNK_SIZE):
+    """
+    Copier un flux par blocs, dans un tampon unique réutilisé
+
+    Args:
+        source: Flux binaire lisible (fichier, SpooledTemporaryFile de Werkzeug...)
+        destination: Fichier binaire ouvert en écriture
+        on_chunk (callable, optional): Appelé sur chaque bloc (memoryview), ex. hash incrémental
+        chunk_size (int): Taille des blocs, en octets
+
+    Returns:
+        int: Nombre d'octets copiés
+    """
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    # SpooledTemporaryFile n'a readinto() qu'à partir de Python 3.11
+    readinto = getattr(source, 'readinto', None)
+    total = 0
+    while True:
+        if readinto is not None:
+            size = readinto(buffer)
+            chunk = view[:size]
+        else:
+            chunk = source.read(chunk_size)
+            size = len(chunk)
+        if not size:
+            return total
+        if on_chunk is not None:
+            on_chunk(chunk)
+        destination.write(chunk)
+        total += size
+
+
+class UploadQueue:
+    """
+    File d'upload Supabase Storage persistante, traitée en arrière-plan.
+
+    Chaque upload est d'abord écrit dans un dossier de spool (données + métadonnées),
+    ce qui permet de répondre à l'utilisateur sans attendre le stockage. Les échecs
+    sont retentés avec un délai exponentiel ; les uploads encore en attente au
+    redémarrage de l'application sont rechargés depuis le spool.
+
+    Chaque processus écrit dans son propre sous-dossier (identifié par son pid) : avec
+    plusieurs workers gunicorn, seuls les uploads d'un processus arrêté sont repris.
+    """
+
+    def __init__(self, client, spool_dir=None, workers=None, max_attempts=None, base_delay=None,
+                 autostart=True):
+        """
+        Args:
+            client: Client Supabase
+            spool_dir (str, optional): Dossier de persistance des uploads en attente (UPLOAD_SPOOL_DIR)
+            workers (int, optional): Nombre de threads d'upload (UPLOAD_WORKERS)
+            max_attempts (int, optional): Nombre maximal de tentatives par fichier (UPLOAD_MAX_ATTEMPTS)
+            base_delay (float, optional): Délai avant la première nouvelle tentative, en secondes
+            autostart (bool): Démarrer immédiatement ; sinon, appeler start() (après un fork)
+        """
+        self.client = client
+        self.spool_dir = spool_dir or os.getenv('UPLOAD_SPOOL_DIR', 'spool/uploads')
+        self.failed_dir = os.path.join(self.spool_dir, 'failed')
+        self.max_attempts = max_attempts or int(os.getenv('UPLOAD_MAX_ATTEMPTS', '8'))
+        self.base_delay = base_delay if base_delay is not None else float(os.getenv('UPLOAD_RETRY_DELAY', '2'))
+        self.workers = workers or int(os.getenv('UPLOAD_WORKERS', '2'))
+        self.process_dir = None
+
+        self._heap = []
+        self._cond = threading.Condition()
+        self._start_lock = threading.Lock()
+        self._threads = []
+        self.uploaded = 0
+        self.retried = 0
+        self.failed = 0
+
+        if autostart:
+            self.start()
+
+    @property
+    def started(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        """
+        Reprendre les uploads orphelins puis démarrer les threads d'upload (une fois par processus).
+
+        Appelé par stage() si nécessaire : une requête servie avant start_background_services
+        démarre la file au lieu d'échouer.
+        """
+        with self._start_lock:
+            if self.started:
+                return
+            process_dir = os.path.join(self.spool_dir, str(os.getpid()))
+            os.makedirs(self.failed_dir, exist_ok=True)
+            os.makedirs(process_dir, exist_ok=True)
+
+            # Aucun stage() de ce processus n'a encore écrit dans process_dir (verrou de démarrage) :
+            # un .bin sans .json y est forcément orphelin
+            self._recover(process_dir)
+            self.process_dir = process_dir
+            self._threads = [threading.Thread(target=self._worker, name=f"upload-queue-{i}", daemon=True)
+                             for i in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+
+    def _paths(self, job_id):
+        return (os.path.join(self.process_dir, f"{job_id}.bin"),
+                os.path.join(self.process_dir, f"{job_id}.json"))
+
+    @staticmethod
+    def _pid_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _adopt(self, directory, process_dir):
+        """Déplacer dans le dossier de ce processus les fichiers d'un dossier orphelin."""
+        for name in os.listdir(directory):
+            if name.endswith(('.bin', '.json')):
+                try:
+                    os.replace(os.path.join(directory, name), os.path.join(process_dir, name))
+                except FileNotFoundError:
+                    # Déjà repris par un autre processus
+                    pass
+
+    def _recover(self, process_dir):
+        """
+        Recharger les uploads laissés en attente par ce pid ou par un processus arrêté, et
+        supprimer les fichiers jamais confiés ni abandonnés (arrêt entre stage() et submit())
+        """
+        self._adopt(self.spool_dir, process_dir)
+        for name in os.listdir(self.spool_dir):
+            directory = os.path.join(self.spool_dir, name)
+            if not name.isdigit() or directory == process_dir or self._pid_alive(int(name)):
+                continue
+            self._adopt(directory, process_dir)
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+
+        recovered = 0
+        names = os.listdir(process_dir)
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(process_dir, name), encoding='utf-8') as f:
+                    job = json.load(f)
+                self._schedule(job, delay=0)
+                recovered += 1
+            except Exception as e:
+                print(f"Upload en attente illisible ({name}): {e}")
+        if recovered:
+            print(f"{recovered} upload(s) en attente rechargé(s) depuis {self.spool_dir}")
+
+        orphans = 0
+        for name in names:
+            stem, extension = os.path.splitext(name)
+            if (extension == '.bin' and f"{stem}.json" not in names) or name.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(process_dir, name))
+                    orphans += 1
+                except FileNotFoundError:
+                    pass
+        if orphans:
+            print(f"{orphans} fichier(s) orphelin(s) supprimé(s) du spool {self.spool_dir}")
+
+    def _schedule(self, job, delay):
+        with self._cond:
+            heapq.heappush(self._heap, (time.time() + delay, job['id'], job))
+            self._cond.notify()
+
+    def _save(self, job):
+        _, meta_path = self._paths(job['id'])
+        tmp_path = f"{meta_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, meta_path)
+
+    def stage(self, bucket, path, source, content_type="image/jpeg", on_chunk=None, normalize=None):
+        """
+        Écrire un fichier à uploader dans le spool, sans encore le confier aux threads d'upload
+
+        Args:
+            bucket (str): Bucket de destination
+            path (str): Chemin du fichier dans le bucket
+            source (bytes | file): Contenu du fichier, ou flux binaire lu par blocs jusqu'à la fin
+                (une seule lecture, sans copie complète en mémoire)
+            content_type (str): Type MIME du fichier
+            on_chunk (callable, optional): Appelé sur chaque bloc écrit, ex. hash incrémental
+            normalize (dict, optional): Réencoder l'image avant l'upload (voir image_utils.normalize_image) :
+                max_side, image_format, quality, thumbnail_side, et thumbnail_path (chemin de la miniature)
+
+        Returns:
+            dict: Upload à confier avec submit() ou à abandonner avec cancel()
+        """
+        if not self.started:
+            self.start()
+        job = {"id": uuid.uuid4().hex, "bucket": bucket, "path": path,
+               "content_type": content_type, "attempts": 0, "sent": []}
+        if normalize:
+            job["normalize"] = normalize
+        data_path, _ = self._paths(job['id'])
+        with open(data_path, 'wb') as f:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                if on_chunk is not None:
+                    on_chunk(source)
+                f.write(source)
+            else:
+                copy_stream(source, f, on_chunk)
+        return job
+
+    def submit(self, job):
+        """
+        Confier aux threads d'upload un fichier écrit par stage()
+
+        Returns:
+            str: Identifiant de l'upload
+        """
+        # Les métadonnées sont écrites en dernier : un job sans .json n'est pas rechargé
+        self._save(job)
+        self._schedule(job, delay=0)
+        return job['id']
+
+    def cancel(self, job):
+        """Supprimer un fichier écrit par stage() et jamais confié aux threads d'upload."""
+        self._discard(job)
+
+    def enqueue(self, bucket, path, data, content_type="image/jpeg", normalize=None):
+        """
+        Persister un fichier à uploader et le confier aux threads d'upload
+
+        Args:
+            bucket (str): Bucket de destination
+            path (str): Chemin du fichier dans le bucket
+            data (bytes | file): Contenu du fichier, ou flux binaire
+            content_type (str): Type MIME du fichier
+            normalize (dict, optional): Réencodage avant l'upload (voir stage)
+
+        Returns:
+            str: Identifiant de l'upload
+        """
+        return self.submit(self.stage(bucket, path, data, content_type, normalize=normalize))
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                if self._heap:
+                    due = self._heap[0][0] - time.time()
+                    if due <= 0:
+                        return heapq.heappop(self._heap)[2]
+                    self._cond.wait(due)
+                else:
+                    self._cond.wait()
+
+    def _put(self, job, path, data, content_type):
+        bucket = job['bucket']
+        # Chemins déjà envoyés par une tentative précédente de ce même upload (éventuellement écrits
+        # sans que la réponse soit reçue), persistés avant l'envoi pour survivre à un redémarrage
+        sent = job.setdefault('sent', [])
+        retry = path in sent
+        if not retry:
+            sent.append(path)
+            self._save(job)
+        try:
+            # Les nouvelles tentatives sont gérées par la file, avec un délai plus long
+            response = call('storage.upload', lambda: self.client.storage.from_(bucket).upload(
+                path=path,
+                file=data,
+                file_options={"content-type": content_type}
+            ), retries=0)
+        except Exception as e:
+            if 'Duplicate' in str(e) or 'already exists' in str(e):
+                # Déjà présent : écrit par une tentative précédente de cet upload, sinon par un autre
+                if retry:
+                    return
+                raise UploadConflict(f"{bucket}/{path} existe déjà") from e
+            raise
+        if hasattr(response, 'error') and response.error is not None:
+            raise Exception(f"Erreur {bucket}: {response.error}")
+
+    def _normalize(self, job, data_path):
+        """Réencoder l'image du spool ; None si elle n'est pas décodable (envoyée telle quelle)."""
+        options = dict(job['normalize'])
+        options.pop('thumbnail_path', None)
+        try:
+            with SCAN_STAGE_SECONDS.time(stage='storage_normalize'), open(data_path, 'rb') as f:
+                return normalize_image(f, **options)
+        except Exception as e:
+            print(f"Normalisation impossible pour {job['bucket']}/{job['path']} ({e}), envoi du fichier d'origine")
+            return None
+
+    def _upload(self, job):
+        data_path, _ = self._paths(job['id'])
+        if job.get('normalize'):
+            variants = self._normalize(job, data_path)
+            if variants is not None:
+                # Miniature d'abord : c'est elle qu'affiche la page de résultat
+                thumbnail_path = job['normalize'].get('thumbnail_path')
+                if variants['thumbnail'] is not None and thumbnail_path:
+                    self._put(job, thumbnail_path, variants['thumbnail'], variants['content_type'])
+                self._put(job, job['path'], variants['data'], variants['content_type'])
+                return
+
+        # Le fichier du spool est envoyé par blocs, sans être chargé en mémoire
+        with open(data_path, 'rb') as data:
+            self._put(job, job['path'], data, job['content_type'])
+
+    def _discard(self, job, failed=False):
+        for path in self._paths(job['id']):
+            if not os.path.exists(path):
+                continue
+            if failed:
+                os.replace(path, os.path.join(self.failed_dir, os.path.basename(path)))
+            else:
+                os.remove(path)
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            try:
+                with SCAN_STAGE_SECONDS.time(stage='storage_upload'):
+                    self._upload(job)
+                self._discard(job)
+                with self._cond:
+                    self.uploaded += 1
+                UPLOAD_JOBS.inc(result='uploaded')
+            except Exception as e:
+                job['attempts'] += 1
+                if isinstance(e, UploadConflict) or job['attempts'] >= self.max_attempts:
+                    print(f"Abandon de l'upload {job['bucket']}/{job['path']} après "
+                          f"{job['attempts']} tentatives: {e}")
+                    self._discard(job, failed=True)
+                    with self._cond:
+                        self.failed += 1
+                    UPLOAD_JOBS.inc(result='failed')
+                    continue
+                delay = self.base_delay * (2 ** (job['attempts'] - 1))
+                print(f"Échec de l'upload {job['bucket']}/{job['path']} ({e}), "
+                      f"nouvelle tentative dans {delay:.0f}s")
+                self._save(job)
+                self._schedule(job, delay)
+                with self._cond:
+                    self.retried += 1
+                UPLOAD_JOBS.inc(result='retried')
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._heap)
+        return {"pending": pending, "uploaded": self.uploaded, "retried": self.retried, "failed": self.failed}
@@ -0,0 +1,6 @@
+"""
+Point d'entrée WSGI de production.
+
+    gunicorn -c python_file/gunicorn.conf.py wsgi:app
+"""
+from app import app, start_background_services  # noqa: F401
@@ -0,0 +1,14 @@
+-- Historique des analyses (scan_history.SupabaseHistoryBackend)
+-- Appliquée par deploy.sh (supabase db push) ou à coller dans l'éditeur SQL de Supabase
+create table if not exists "Scans" (
+    id text primary key,
+    user_id uuid not null,
+    image_path text not null,
+    thumbnail_path text,
+    animal text not null,
+    confidence real not null,
+    model_version text,
+    scanned_at timestamptz not null,
+    recorded_at timestamptz not null default now()
+);
+create index if not exists scans_user_id_id on "Scans" (user_id, id desc);